@@ -22,6 +22,11 @@ namespace AIUnityTester.Editor
         private Vector2 _configScrollPos;
         private Vector2 _promptScrollPos;
         private static StringBuilder _serverLog = new StringBuilder();
+        private static long _lastLogSeq = 0;       // last /logs event already shown
+        private double _nextLogPollTime = 0;
+        private bool _isPollingLogs = false;
+        private const double LogPollInterval = 1.0; // seconds
+        private const int MaxServerLogChars = 20000;
         private int _serverPort = 8000;  // 서버 포트
         
         private string _configContent = "";
@@ -85,10 +90,13 @@ namespace AIUnityTester.Editor
             
             // 저장된 포트 불러오기
             _serverPort = PlayerPrefs.GetInt("AITester_ServerPort", 8000);
+
+            EditorApplication.update += PollServerLogs;
         }
 
         private void OnDisable()
         {
+            EditorApplication.update -= PollServerLogs;
             // 에디터 창 닫힐 때 서버 정리
             StopServer();
         }
@@ -444,7 +452,7 @@ namespace AIUnityTester.Editor
                 EditorGUILayout.TextArea(_serverLog.ToString(), EditorStyles.miniLabel);
                 EditorGUILayout.EndScrollView();
                 
-                if (GUILayout.Button("Clear Logs", EditorStyles.miniButton)) _serverLog.Clear();
+                if (GUILayout.Button("Clear Logs", EditorStyles.miniButton)) _serverLog.Clear(); // keeps _lastLogSeq, so old events don't come back
                 
                 GUILayout.Space(5);
                 if (GUILayout.Button("Reset Memory (Restart Processes)", EditorStyles.miniButton))
@@ -702,7 +710,7 @@ namespace AIUnityTester.Editor
 
         private void InstallRequirements()
         {
-            RunCommand(_pythonPath, "-m pip install fastapi uvicorn pydantic python-multipart");
+            RunCommand(_pythonPath, "-m pip install fastapi uvicorn pydantic python-multipart httpx websockets");
         }
 
         private void RunCommand(string cmd, string args)
@@ -748,6 +756,48 @@ namespace AIUnityTester.Editor
             StopServer();
         }
 
+        // 서버의 GET /logs를 주기적으로 폴링해 Server Logs 창을 채움 (서버 콘솔 출력은 별도 창)
+        private void PollServerLogs()
+        {
+            if (_isPollingLogs || _serverProcess == null || _serverProcess.HasExited) return;
+            if (EditorApplication.timeSinceStartup < _nextLogPollTime) return;
+            _nextLogPollTime = EditorApplication.timeSinceStartup + LogPollInterval;
+
+            string url = $"http://127.0.0.1:{_serverPort}/logs?since={_lastLogSeq}&level=info";
+            var request = UnityEngine.Networking.UnityWebRequest.Get(url);
+            _isPollingLogs = true;
+            request.SendWebRequest().completed += _ =>
+            {
+                _isPollingLogs = false;
+                try
+                {
+                    if (request.result != UnityEngine.Networking.UnityWebRequest.Result.Success) return; // 서버 시작 중
+                    JObject response = JObject.Parse(request.downloadHandler.text);
+                    long lastSeq = response["last_seq"]?.Value<long>() ?? 0;
+                    if (lastSeq < _lastLogSeq) _lastLogSeq = 0; // 서버 재시작됨
+
+                    foreach (JObject evt in response["events"] as JArray ?? new JArray())
+                    {
+                        string time = System.DateTimeOffset.FromUnixTimeMilliseconds((long)(evt["time"].Value<double>() * 1000)).LocalDateTime.ToString("HH:mm:ss");
+                        string level = evt["level"]?.ToString();
+                        string prefix = level == "info" ? "" : $"{level.ToUpper()} ";
+                        _serverLog.AppendLine($"[{time}] {prefix}{evt["message"]}");
+                        _lastLogSeq = evt["seq"].Value<long>();
+                    }
+                    if (_serverLog.Length > MaxServerLogChars) _serverLog.Remove(0, _serverLog.Length - MaxServerLogChars);
+                    Repaint();
+                }
+                catch (System.Exception e)
+                {
+                    UnityEngine.Debug.LogWarning($"[AI Tester] Log poll failed: {e.Message}");
+                }
+                finally
+                {
+                    request.Dispose();
+                }
+            };
+        }
+
         private async void ResetServerMemory()
         {
             if (_serverProcess == null || _serverProcess.HasExited) return;
@@ -950,21 +1000,15 @@ namespace AIUnityTester.Editor
                 JArray argsJson = new JArray();
                 foreach (var arg in argArray) if(!string.IsNullOrWhiteSpace(arg)) argsJson.Add(arg.Trim());
 
-                JObject newToolData = new JObject
-                {
-                    ["command"] = _command,
-                    ["arguments"] = argsJson,
-                    ["description"] = _description,
-                    ["requires_api_key"] = _requiresApiKey,
-                    ["image_support"] = _imageSupport
-                };
+                // Start from the existing entry so keys this window doesn't edit (url, api, persistent, ...) survive
+                JObject newToolData = tools[_originalToolName] is JObject oldTool ? (JObject)oldTool.DeepClone() : new JObject();
+                newToolData["command"] = _command;
+                newToolData["arguments"] = argsJson;
+                newToolData["description"] = _description;
+                newToolData["requires_api_key"] = _requiresApiKey;
+                newToolData["image_support"] = _imageSupport;
                 if (!string.IsNullOrEmpty(_modelName)) newToolData["model_name"] = _modelName;
-                
-                if (tools[_originalToolName] != null)
-                {
-                    string oldKey = tools[_originalToolName]["api_key"]?.ToString();
-                    if (!string.IsNullOrEmpty(oldKey)) newToolData["api_key"] = oldKey;
-                }
+                else newToolData.Remove("model_name");
 
                 if (_toolName != _originalToolName)
                 {
@@ -0,0 +1,116 @@
+"""Offline stand-in for google.generativeai.
+
+Select it for an "internal" tool with "sdk_module": "fake_genai" in tools_config.json
+(or AITESTER_GENAI_MODULE=fake_genai) to exercise the native route without network or quota.
+FAKE_GENAI_LATENCY sets the simulated model latency in seconds; with stream=True it is spread
+evenly over STREAM_CHUNKS chunks, like tokens arriving from the real API.
+FAKE_GENAI_QUOTA_RPM simulates a per-key quota: requests beyond it within a minute fail with a
+429 error shaped like the real one, including its retry delay.
+"""
+import asyncio
+import json
+import os
+import time
+from types import SimpleNamespace
+
+LATENCY = float(os.environ.get("FAKE_GENAI_LATENCY", "0.2"))
+STREAM_CHUNKS = 8
+QUOTA_RPM = int(os.environ.get("FAKE_GENAI_QUOTA_RPM", "0"))
+
+_api_key = None
+calls = [] # (api_key, model_name, image_count) per request, for assertions
+_recent = {} # api_key -> request times within the last minute
+
+def configure(api_key=None, **kwargs):
+    global _api_key
+    _api_key = api_key
+
+def _count_images(contents):
+    count = 0
+    for part in contents:
+        if isinstance(part, dict) and "parts" in part:
+            count += _count_images(part["parts"])
+        elif isinstance(part, dict) and "data" in part:
+            count += 1
+        elif not isinstance(part, str):
+            count += 1 # PIL image or other binary part
+    return count
+
+class FakeAsyncClient:
+    def __init__(self, api_key):
+        self.api_key = api_key
+
+# Like google.generativeai.client: the default client carries the key of the last configure()
+client = SimpleNamespace(get_default_generative_async_client=lambda: FakeAsyncClient(_api_key))
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+class FakeStreamResponse:
+    def __init__(self, text):
+        self.text = text
+
+    async def __aiter__(self):
+        size = -(-len(self.text) // STREAM_CHUNKS)
+        for i in range(0, len(self.text), size):
+            await asyncio.sleep(LATENCY / STREAM_CHUNKS)
+            yield FakeResponse(self.text[i:i + size])
+
+class GenerativeModel:
+    def __init__(self, model_name, **kwargs):
+        self.model_name = model_name
+        self._async_client = None # resolved per request unless pinned, as in the real SDK
+
+    @property
+    def api_key(self):
+        return (self._async_client or client.get_default_generative_async_client()).api_key
+
+    def _check_quota(self):
+        if not QUOTA_RPM: return
+        now = time.monotonic()
+        recent = [t for t in _recent.get(self.api_key, []) if now - t < 60.0]
+        if len(recent) >= QUOTA_RPM:
+            _recent[self.api_key] = recent
+            raise RuntimeError(f"429 Resource has been exhausted (e.g. check quota). Please retry in {60.0 - (now - recent[0]):.1f}s.")
+        _recent[self.api_key] = recent + [now]
+
+    def _answer(self, contents):
+        images = _count_images(contents)
+        calls.append((self.api_key, self.model_name, images))
+        action = {
+            "thought": f"Fake {self.model_name} saw {images} image(s).",
+            "actionType": "Click",
+            "screenPosition": {"x": 0.5, "y": 0.5},
+            "targetPosition": {"x": 0.0, "y": 0.0},
+            "keyName": "",
+            "textToType": "",
+            "duration": 0.0
+        }
+        return FakeResponse(json.dumps(action))
+
+    def generate_content(self, contents, **kwargs):
+        self._check_quota()
+        time.sleep(LATENCY)
+        return self._answer(contents)
+
+    async def generate_content_async(self, contents, stream=False, **kwargs):
+        self._check_quota()
+        if stream: return FakeStreamResponse(self._answer(contents).text)
+        await asyncio.sleep(LATENCY)
+        return self._answer(contents)
+
+    def start_chat(self, history=None):
+        return ChatSession(self, history)
+
+class ChatSession:
+    def __init__(self, model, history=None):
+        self.model = model
+        self.history = list(history or [])
+
+    async def send_message_async(self, parts):
+        parts = parts if isinstance(parts, list) else [parts]
+        self.history.append({"role": "user", "parts": parts})
+        response = await self.model.generate_content_async(self.history)
+        self.history.append({"role": "model", "parts": [response.text]})
+        return response
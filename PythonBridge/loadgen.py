@@ -0,0 +1,406 @@
+"""Load generator / benchmark for the bridge server (server.py).
+
+Drives /ask with synthetic JPEG frames and UIHierarchyDumper-sized contexts at a configurable
+concurrency and rate, and reports throughput and p50/p95/p99 latency per route. Runs fully
+offline against bundled backends:
+
+    oneshot     mock_agent.py spawned per request
+    persistent  persistent_mock.py worker pool
+    native      "internal" tool backed by fake_genai.py
+
+Examples:
+    python loadgen.py --routes oneshot,persistent,native --concurrency 8 --requests 200
+    python loadgen.py --url http://127.0.0.1:8000 --rate 5 --duration 30
+    python loadgen.py --output new.json --compare baseline.json --max-regression 0.15
+    python loadgen.py --startup 5 --startup-target-ms 1500 --output startup.json
+"""
+import argparse
+import http.client
+import io
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+import uuid
+
+BRIDGE_DIR = os.path.dirname(os.path.abspath(__file__))
+ROUTES = ("oneshot", "persistent", "native")
+PERCENTILES = (50, 95, 99)
+
+# --- Synthetic Inputs ---
+def make_frames(count, width, height, quality, seed):
+    """Random 'game screens' as JPEG bytes; falls back to the bundled sample frame without PIL."""
+    try:
+        from PIL import Image, ImageDraw
+    except ImportError:
+        sample = os.path.join(BRIDGE_DIR, "last_frame.jpg")
+        print("[LoadGen] PIL not installed, using the sample frame for every request.")
+        with open(sample, "rb") as f: return [f.read()]
+
+    rng = random.Random(seed)
+    frames = []
+    for _ in range(count):
+        img = Image.new("RGB", (width, height), tuple(rng.randrange(256) for _ in range(3)))
+        draw = ImageDraw.Draw(img)
+        for _ in range(12):
+            x0, y0 = rng.randrange(width), rng.randrange(height)
+            x1, y1 = x0 + rng.randrange(20, width // 3), y0 + rng.randrange(20, height // 3)
+            draw.rectangle((x0, y0, x1, y1), fill=tuple(rng.randrange(256) for _ in range(3)))
+        buf = io.BytesIO()
+        img.save(buf, "JPEG", quality=quality)
+        frames.append(buf.getvalue())
+    return frames
+
+def make_context(target_bytes, width, height, seed):
+    """Text in the UIHierarchyDumper format, padded with nodes up to roughly target_bytes."""
+    rng = random.Random(seed)
+    kinds = ["[Button]", "[Text]", "[Image]", "[Rect]", "[Toggle]", "[Slider]", "[Input]"]
+    lines = [
+        "[Game Description]",
+        "Synthetic load test scene. Click buttons and navigate menus.",
+        "",
+        "[Current State]",
+        "=== Active UI Elements ===",
+        "[Canvas] MainCanvas (RenderMode: ScreenSpaceOverlay)"
+    ]
+    size = sum(len(l) + 1 for l in lines)
+    index = 0
+    while size < target_bytes:
+        depth = rng.randint(1, 4)
+        line = (f"{'-' * depth * 2} {rng.choice(kinds)} \"Node_{index}\" "
+                f"(Pos: {rng.randrange(width)},{rng.randrange(height)} Size: {rng.randint(20, 400)}x{rng.randint(20, 200)})")
+        lines.append(line)
+        size += len(line) + 1
+        index += 1
+    return "\n".join(lines) + "\n"
+
+def encode_multipart(fields, files):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f"--{boundary}\r\nContent-Disposition: form-data; name=\"{name}\"\r\n\r\n".encode("utf-8"))
+        parts.append(value.encode("utf-8") + b"\r\n")
+    for name, (filename, content, mime) in files.items():
+        parts.append((f"--{boundary}\r\nContent-Disposition: form-data; name=\"{name}\"; filename=\"{filename}\"\r\n"
+                      f"Content-Type: {mime}\r\n\r\n").encode("utf-8"))
+        parts.append(content + b"\r\n")
+    parts.append(f"--{boundary}--\r\n".encode("utf-8"))
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+# --- Bundled Server Targets ---
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def bench_config(route, pool_size, prewarm=False):
+    python = sys.executable
+    tools = {
+        "oneshot": {
+            "command": python,
+            "arguments": [os.path.join(BRIDGE_DIR, "mock_agent.py"), "{image_path}", "{context}"],
+            "max_concurrency": 64,
+            "cache": False
+        },
+        "persistent": {
+            "command": python,
+            "arguments": ["-u", os.path.join(BRIDGE_DIR, "persistent_mock.py")],
+            "persistent": True,
+            "pool_size": pool_size,
+            "cache": False
+        },
+        "native": {
+            "command": "internal",
+            "sdk_module": "fake_genai",
+            "api_key": "offline-benchmark",
+            "model_name": "fake-model",
+            "cache": False
+        }
+    }
+    return {"selected_tool": route, "prewarm": prewarm, "tools": tools}
+
+def wait_startup(base_url, started, timeout, poll=0.02):
+    """Seconds from `started` until /health answers and until it reports ready (None if not reached)."""
+    listening = None
+    while time.perf_counter() - started < timeout:
+        try:
+            with urllib.request.urlopen(base_url + "/health", timeout=1) as r:
+                if r.status == 200:
+                    now = time.perf_counter() - started
+                    if listening is None: listening = now
+                    if json.loads(r.read()).get("ready", True): return listening, now # older servers have no "ready"
+        except (OSError, ValueError): pass
+        time.sleep(poll)
+    return listening, None
+
+def wait_healthy(base_url, timeout):
+    return wait_startup(base_url, time.perf_counter(), timeout, poll=0.1)[1] is not None
+
+class BridgeProcess:
+    """server.py in a subprocess with a generated config selecting one bundled route."""
+    def __init__(self, route, args):
+        self.route = route
+        self.args = args
+        self.port = free_port()
+        self.base_url = f"http://127.0.0.1:{self.port}"
+        self.proc = None
+        self.config_path = None
+        self.log_file = None
+
+    def __enter__(self):
+        self.start()
+        if not wait_healthy(self.base_url, 30):
+            self.__exit__(None, None, None)
+            raise RuntimeError(f"Bridge for route '{self.route}' did not become healthy.")
+        return self
+
+    def start(self):
+        fd, self.config_path = tempfile.mkstemp(prefix=f"loadgen_{self.route}_", suffix=".json")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(bench_config(self.route, self.args.pool_size, self.args.prewarm), f)
+        env = dict(os.environ)
+        env["FAKE_GENAI_LATENCY"] = str(self.args.backend_latency)
+        env["MOCK_AGENT_LATENCY"] = str(self.args.backend_latency)
+        self.log_file = tempfile.TemporaryFile()
+        self.proc = subprocess.Popen(
+            [sys.executable, os.path.join(BRIDGE_DIR, "server.py"), "--config", self.config_path, "--port", str(self.port)],
+            cwd=BRIDGE_DIR, env=env, stdout=self.log_file, stderr=subprocess.STDOUT
+        )
+
+    def __exit__(self, *exc):
+        if self.proc and self.proc.poll() is None:
+            self.proc.terminate()
+            try: self.proc.wait(10)
+            except subprocess.TimeoutExpired: self.proc.kill()
+        if self.log_file: self.log_file.close()
+        if self.config_path and os.path.exists(self.config_path): os.remove(self.config_path)
+
+# --- Load Loop ---
+class RateGate:
+    """Open-loop pacing: request i may start at start + i / rate (no pacing when rate is 0)."""
+    def __init__(self, rate):
+        self.rate = rate
+        self.lock = threading.Lock()
+        self.next_slot = None
+
+    def wait(self):
+        if self.rate <= 0: return
+        with self.lock:
+            now = time.perf_counter()
+            if self.next_slot is None: self.next_slot = now
+            slot = self.next_slot
+            self.next_slot = max(slot, now) + 1.0 / self.rate
+        delay = slot - time.perf_counter()
+        if delay > 0: time.sleep(delay)
+
+def run_load(base_url, route, frames, contexts, args):
+    url = urllib.parse.urlparse(base_url)
+    gate = RateGate(args.rate)
+    lock = threading.Lock()
+    samples = [] # (latency_seconds, ok)
+    counter = {"issued": 0}
+    stop_at = time.perf_counter() + args.duration if args.duration > 0 else None
+
+    def next_index():
+        with lock:
+            if stop_at is None and counter["issued"] >= args.requests: return None
+            if stop_at is not None and time.perf_counter() >= stop_at: return None
+            counter["issued"] += 1
+            return counter["issued"] - 1
+
+    def agent(agent_index):
+        conn = http.client.HTTPConnection(url.hostname, url.port, timeout=args.timeout)
+        session_id = f"loadgen-{route}-{agent_index}"
+        while True:
+            i = next_index()
+            if i is None: break
+            gate.wait()
+            body, content_type = encode_multipart(
+                {"context": contexts[i % len(contexts)], "session_id": session_id},
+                {"screenshot": ("screen.jpg", frames[i % len(frames)], "image/jpeg")}
+            )
+            start = time.perf_counter()
+            ok = False
+            try:
+                conn.request("POST", "/ask", body=body, headers={"Content-Type": content_type})
+                response = conn.getresponse()
+                payload = response.read()
+                if response.status == 200:
+                    ok = not json.loads(payload).get("thought", "").startswith("Error:")
+            except (OSError, http.client.HTTPException, ValueError):
+                conn.close()
+                conn = http.client.HTTPConnection(url.hostname, url.port, timeout=args.timeout)
+            latency = time.perf_counter() - start
+            with lock: samples.append((latency, ok))
+        conn.close()
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=agent, args=(n,), daemon=True) for n in range(args.concurrency)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    return summarize(route, samples, time.perf_counter() - started)
+
+def percentile(sorted_values, pct):
+    if not sorted_values: return 0.0
+    k = (len(sorted_values) - 1) * pct / 100.0
+    lo, hi = int(k), min(int(k) + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+def summarize(route, samples, wall_seconds):
+    latencies = sorted(s[0] for s in samples)
+    errors = sum(1 for s in samples if not s[1])
+    result = {
+        "route": route,
+        "requests": len(samples),
+        "errors": errors,
+        "wall_seconds": round(wall_seconds, 3),
+        "throughput_rps": round(len(samples) / wall_seconds, 2) if wall_seconds > 0 else 0.0,
+        "mean_ms": round(1000 * sum(latencies) / len(latencies), 2) if latencies else 0.0,
+        "max_ms": round(1000 * latencies[-1], 2) if latencies else 0.0
+    }
+    for pct in PERCENTILES:
+        result[f"p{pct}_ms"] = round(1000 * percentile(latencies, pct), 2)
+    return result
+
+# --- Startup Benchmark ---
+def run_startup(route, args):
+    """Cold-start the bridge --startup times, timing spawn -> /health answering -> ready."""
+    listening, ready, failures = [], [], 0
+    for _ in range(args.startup):
+        bridge = BridgeProcess(route, args)
+        started = time.perf_counter()
+        bridge.start()
+        try:
+            listen_s, ready_s = wait_startup(bridge.base_url, started, 60)
+        finally:
+            bridge.__exit__(None, None, None)
+        if ready_s is None:
+            failures += 1
+            continue
+        listening.append(listen_s)
+        ready.append(ready_s)
+    listening.sort()
+    ready.sort()
+    result = {"route": route, "runs": args.startup, "failures": failures, "prewarm": args.prewarm,
+              "listen_p50_ms": round(1000 * percentile(listening, 50), 1),
+              "ready_p50_ms": round(1000 * percentile(ready, 50), 1),
+              "ready_max_ms": round(1000 * ready[-1], 1) if ready else 0.0}
+    result["passed"] = not failures and (not args.startup_target_ms or result["ready_max_ms"] <= args.startup_target_ms)
+    return result
+
+def print_startup_table(results, target_ms):
+    header = f"{'route':<12}{'runs':>6}{'fail':>6}{'listen p50':>12}{'ready p50':>12}{'ready max':>12}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(f"{r['route']:<12}{r['runs']:>6}{r['failures']:>6}{r['listen_p50_ms']:>12.1f}{r['ready_p50_ms']:>12.1f}"
+              f"{r['ready_max_ms']:>12.1f}{'' if r['passed'] else '  OVER TARGET' if not r['failures'] else '  FAILED'}")
+    if target_ms: print(f"\nTarget: ready within {target_ms:.0f} ms of spawning the server")
+
+# --- Reporting ---
+def print_table(results):
+    header = f"{'route':<12}{'reqs':>7}{'errs':>6}{'rps':>9}{'mean':>10}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(f"{r['route']:<12}{r['requests']:>7}{r['errors']:>6}{r['throughput_rps']:>9.2f}"
+              f"{r['mean_ms']:>10.1f}{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}{r['p99_ms']:>10.1f}{r['max_ms']:>10.1f}")
+
+def compare(results, baseline_path, max_regression):
+    """Print latency/throughput deltas against a previous results file. Returns False on regression."""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {r["route"]: r for r in json.load(f)["results"]}
+    passed = True
+    print(f"\nComparison with {baseline_path} (max regression {max_regression:.0%}):")
+    for r in results:
+        base = baseline.get(r["route"])
+        if not base:
+            print(f"  {r['route']}: no baseline")
+            continue
+        for key, higher_is_better in (("throughput_rps", True), ("p50_ms", False), ("p95_ms", False), ("p99_ms", False)):
+            if not base[key]: continue
+            change = (r[key] - base[key]) / base[key]
+            regressed = (-change if higher_is_better else change) > max_regression
+            passed = passed and not regressed
+            print(f"  {r['route']:<12}{key:<16}{base[key]:>10.2f} -> {r[key]:>10.2f} ({change:+.1%}){'  REGRESSION' if regressed else ''}")
+    return passed
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load generator for the AI Unity Tester bridge server")
+    parser.add_argument("--url", type=str, help="Benchmark an already running server instead of the bundled routes")
+    parser.add_argument("--routes", type=str, default=",".join(ROUTES), help=f"Bundled routes to run ({', '.join(ROUTES)})")
+    parser.add_argument("--concurrency", type=int, default=4, help="Virtual agents, each with its own session")
+    parser.add_argument("--rate", type=float, default=0.0, help="Total requests/second (0 = as fast as responses allow)")
+    parser.add_argument("--requests", type=int, default=100, help="Requests per route (ignored with --duration)")
+    parser.add_argument("--duration", type=float, default=0.0, help="Seconds per route instead of a request count")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Per-request client timeout")
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--quality", type=int, default=75, help="JPEG quality (Unity sends EncodeToJPG(75))")
+    parser.add_argument("--frames", type=int, default=16, help="Distinct synthetic frames to cycle through")
+    parser.add_argument("--context-bytes", type=int, default=6000, help="Approximate size of each UI context")
+    parser.add_argument("--pool-size", type=int, default=4, help="Workers for the persistent route")
+    parser.add_argument("--backend-latency", type=float, default=0.05, help="Simulated model latency of the bundled backends")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--output", type=str, default="loadgen_results.json", help="Machine-readable results file")
+    parser.add_argument("--compare", type=str, help="Previous results file to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="Allowed relative slowdown before failing --compare")
+    parser.add_argument("--startup", type=int, default=0, help="Benchmark N cold starts per route instead of request load")
+    parser.add_argument("--startup-target-ms", type=float, default=2000.0, help="Fail --startup if any start takes longer to become ready (0 = no target)")
+    parser.add_argument("--prewarm", action="store_true", help="Enable the server's prewarm stage in the generated configs")
+    args = parser.parse_args()
+
+    if args.startup:
+        if args.url: parser.error("--startup spawns its own servers and cannot be combined with --url")
+        results = []
+        for route in [r.strip() for r in args.routes.split(",") if r.strip()]:
+            if route not in ROUTES: parser.error(f"Unknown route '{route}'")
+            print(f"[LoadGen] Starting '{route}' {args.startup} times ...")
+            results.append(run_startup(route, args))
+        print()
+        print_startup_table(results, args.startup_target_ms)
+        report = {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": sys.version.split()[0],
+                  "params": {k: v for k, v in vars(args).items() if k not in ("output", "compare")}, "startup": results}
+        with open(args.output, "w", encoding="utf-8") as f: json.dump(report, f, indent=2)
+        print(f"\n[LoadGen] Results written to {args.output}")
+        if not all(r["passed"] for r in results): sys.exit(1)
+        return
+
+    frames = make_frames(args.frames, args.width, args.height, args.quality, args.seed)
+    contexts = [make_context(args.context_bytes, args.width, args.height, args.seed + i) for i in range(args.frames)]
+    print(f"[LoadGen] {len(frames)} frames (~{sum(map(len, frames)) // len(frames) // 1024} KB), "
+          f"contexts ~{args.context_bytes} bytes, concurrency {args.concurrency}, rate {args.rate or 'unbounded'}")
+
+    results = []
+    if args.url:
+        results.append(run_load(args.url.rstrip("/"), "external", frames, contexts, args))
+    else:
+        for route in [r.strip() for r in args.routes.split(",") if r.strip()]:
+            if route not in ROUTES: parser.error(f"Unknown route '{route}'")
+            with BridgeProcess(route, args) as bridge:
+                print(f"[LoadGen] Running '{route}' against {bridge.base_url} ...")
+                results.append(run_load(bridge.base_url, route, frames, contexts, args))
+
+    print()
+    print_table(results)
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "params": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+        "results": results
+    }
+    with open(args.output, "w", encoding="utf-8") as f: json.dump(report, f, indent=2)
+    print(f"\n[LoadGen] Results written to {args.output}")
+
+    if args.compare and not compare(results, args.compare, args.max_regression):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
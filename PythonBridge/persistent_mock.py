@@ -1,4 +1,5 @@
 import sys
+import os
 import json
 import time
 
@@ -21,8 +22,8 @@ while True:
         # Log to stderr to verify stderr capturing
         print(f"DEBUG: Received {len(line)} chars", file=sys.stderr, flush=True)
         
-        # Simulate processing time
-        time.sleep(0.5)
+        # Simulate processing time (MOCK_AGENT_LATENCY overrides, e.g. for loadgen.py)
+        time.sleep(float(os.environ.get("MOCK_AGENT_LATENCY", "0.5")))
         
         response = {
             "thought": f"Echo: {line[:20]}...",
@@ -1,4 +1,6 @@
-from fastapi import FastAPI, UploadFile, File, Form
+from fastapi import FastAPI, UploadFile, File, Form, Request, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import PlainTextResponse, Response, JSONResponse
 from pydantic import BaseModel
 import uvicorn
 import json
@@ -11,111 +13,712 @@ import threading
 import queue
 import time
 import re
-from contextlib import asynccontextmanager
+import hashlib
+import math
+import glob
+import heapq
+import socket
+import itertools
+import importlib
+import tempfile
+import io
+from collections import Counter, OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager, nullcontext
+import contextvars
+from typing import List
 import asyncio
+from trace_store import TraceWriter
+from state_store import StateStore
 
 # --- Configuration ---
 HOST = "127.0.0.1"
 PORT = 8000
 CONFIG_FILE = "tools_config.json"
 SYSTEM_PROMPT_FILE = "system_prompt.txt"
+DEFAULT_SESSION_ID = "default"
+SESSION_IDLE_TIMEOUT = 1800 # seconds without requests before a session is evicted
+SESSION_SWEEP_INTERVAL = 60
+WORKER_ID = None # index of this process when running behind the --workers router
+state_store = None # StateStore shared with other workers / restarts (--state-db)
+# Frames stay in memory; this is only used when a CLI tool needs a file path (tmpfs when available)
+FRAME_DIR = os.path.join("/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "aiunitytester_frames")
 
 # ANSI escape code regex
 ANSI_ESCAPE = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
 
-def log(message):
-    print(message, flush=True)
+LOG_LEVELS = {"debug": 10, "info": 20, "warning": 30, "error": 40}
+LOG_BUFFER_SIZE = 2000 # recent events kept for GET /logs
+
+class BridgeLogger:
+    """Levelled log events kept in a ring buffer for /logs and written to stdout by a background thread,
+    so request handlers never block on console I/O."""
+    def __init__(self, level="info", buffer_size=LOG_BUFFER_SIZE):
+        self.level = LOG_LEVELS.get(level, LOG_LEVELS["info"])
+        self.events = deque(maxlen=buffer_size)
+        self.seq = 0
+        self.lock = threading.Lock() # log() is also called from worker threads
+        self.queue = queue.Queue()
+        self.writer = None
+
+    def set_level(self, level):
+        self.level = LOG_LEVELS[level]
+
+    def emit(self, level, message, fields=None):
+        if LOG_LEVELS[level] < self.level: return
+        with self.lock:
+            self.seq += 1
+            event = {"seq": self.seq, "time": time.time(), "level": level, "message": message}
+            if fields: event["fields"] = fields
+            self.events.append(event)
+            if self.writer is None:
+                self.writer = threading.Thread(target=self._write_loop, name="bridge-log", daemon=True)
+                self.writer.start()
+        self.queue.put(event)
+
+    def since(self, seq, level="debug", limit=500):
+        """Events newer than `seq` (the "seq" of the last event a client has seen)."""
+        min_level = LOG_LEVELS.get(level, 0)
+        with self.lock:
+            if not self.events: return []
+            start = max(0, seq - self.events[0]["seq"] + 1) # seqs are contiguous within the buffer
+            events = list(itertools.islice(self.events, start, None))
+        return [e for e in events if LOG_LEVELS[e["level"]] >= min_level][:limit]
+
+    def format(self, event):
+        stamp = time.strftime("%H:%M:%S", time.localtime(event["time"]))
+        prefix = "" if event["level"] == "info" else f"{event['level'].upper()} "
+        fields = " ".join(f"{k}={v}" for k, v in event.get("fields", {}).items())
+        return f"{stamp} {prefix}{event['message']}" + (f" ({fields})" if fields else "")
+
+    def _write_loop(self):
+        while True:
+            batch = [self.queue.get()]
+            while not self.queue.empty(): batch.append(self.queue.get_nowait())
+            closing = None in batch
+            lines = [self.format(e) for e in batch if e is not None]
+            try:
+                if lines:
+                    sys.stdout.write("\n".join(lines) + "\n")
+                    sys.stdout.flush()
+            except (OSError, ValueError, UnicodeEncodeError):
+                pass # console gone or cannot encode; the ring buffer still has the events
+            if closing: return
+
+    def close(self, timeout=2.0):
+        if self.writer is None: return
+        self.queue.put(None)
+        self.writer.join(timeout)
+        self.writer = None
+
+logger = BridgeLogger(os.environ.get("AITESTER_LOG_LEVEL", "info"))
+
+def log(message, level="info", **fields):
+    logger.emit(level, message, fields)
 
 # --- Native SDK Engine (Direct API Replacement) ---
-try:
-    import google.generativeai as genai
-    from PIL import Image
-    SDK_AVAILABLE = True
-except ImportError:
-    SDK_AVAILABLE = False
+# google.generativeai and PIL are most of the import time, so they load on first use: a bridge
+# serving CLI or HTTP tools never pays for them (the "prewarm" config key loads them at startup).
+_pil_image = None
+
+def load_pil():
+    """PIL.Image, imported on first use; None if Pillow is not installed."""
+    global _pil_image
+    if _pil_image is None:
+        try: from PIL import Image
+        except ImportError: Image = False
+        _pil_image = Image
+    return _pil_image or None
+
+DEFAULT_GENAI_MODULE = os.environ.get("AITESTER_GENAI_MODULE", "google.generativeai")
+MAX_NATIVE_MODELS = 32
+
+class NativeClientRegistry:
+    """Model objects keyed by (sdk module, api_key, model_name), built once and reused.
+
+    genai.configure() is process-global, so each model gets its async client pinned right after
+    configuring its key; later configure() calls for other keys do not affect it.
+    """
+    def __init__(self, max_models=MAX_NATIVE_MODELS):
+        self.max_models = max_models
+        self.models = OrderedDict()
+        self.sdk_modules = {}
+
+    def load_sdk(self, module_name):
+        if module_name not in self.sdk_modules:
+            try: self.sdk_modules[module_name] = importlib.import_module(module_name)
+            except ModuleNotFoundError as e:
+                if module_name == "google.generativeai" and (e.name or "").startswith("google"):
+                    raise RuntimeError("google-generativeai is not installed (pip install google-generativeai).") from e
+                raise
+        return self.sdk_modules[module_name]
+
+    def get(self, api_key, model_name, sdk_module=None):
+        key = (sdk_module or DEFAULT_GENAI_MODULE, api_key, model_name)
+        model = self.models.get(key)
+        if model is not None:
+            self.models.move_to_end(key)
+            return model
+
+        sdk = self.load_sdk(key[0])
+        log(f"[Native] Creating model '{model_name}' ({key[0]}, {len(self.models) + 1} cached)")
+        sdk.configure(api_key=api_key)
+        model = sdk.GenerativeModel(model_name)
+        # GenerativeModel takes no client or client_options, so the private attribute is the only
+        # way to pin one; a missing attribute is logged rather than silently sharing the last key
+        try: sdk_client = importlib.import_module(sdk.__name__ + ".client")
+        except ImportError: sdk_client = getattr(sdk, "client", None)
+        if sdk_client is not None and hasattr(model, "_async_client"):
+            model._async_client = sdk_client.get_default_generative_async_client()
+        else:
+            log(f"[Native] Could not pin a client for '{model_name}' ({key[0]}); it will use whichever API key was configured last", level="warning")
+
+        self.models[key] = model
+        while len(self.models) > self.max_models:
+            self.models.popitem(last=False)
+        return model
+
+    def clear(self):
+        self.models.clear()
 
 class NativeGeminiEngine:
     def __init__(self):
-        self.current_api_key = None
-        self.model = None
-
-    def configure(self, api_key, model_name="gemini-3-flash-preview"):
-        if self.current_api_key != api_key: # Re-configure if key changes
-             log(f"[Native] Configuring Gemini SDK with provided key")
-             genai.configure(api_key=api_key)
-             self.current_api_key = api_key
-        
-        # Always update model object
-        self.model = genai.GenerativeModel(model_name)
+        self.clients = NativeClientRegistry()
+        self.finishing = set() # streams still being read after their action was returned
 
-    async def generate_action(self, system_prompt, context, image_path, api_key, model_name="gemini-3-flash-preview"):
+    async def generate_action(self, system_prompt, context, frame, api_key, model_name="gemini-3-flash-preview", sdk_module=None, stream=False):
         try:
-            self.configure(api_key, model_name)
+            model = self.clients.get(api_key, model_name, sdk_module)
             
             # Prepare contents
             contents = [f"{system_prompt}\n\n[Game Context]\n{context}\n\nRespond with JSON only."]
-            if image_path and os.path.exists(image_path):
-                img = Image.open(image_path)
-                contents.append(img)
+            if frame:
+                contents.append(frame.blob())
             
-            response = self.model.generate_content(contents)
-            return response.text, None
+            return await self.generate(model, contents, stream), None
         except Exception as e:
             return None, str(e)
 
-    # New: Chat Session Support
-    def start_chat(self, tool_name, system_prompt, history=[]):
-        if not self.model: return False
+    # Chat Session Support (history lives on the BridgeSession, keyed by tool)
+    async def generate_chat_response(self, history, system_prompt, context, frame, api_key, model_name, sdk_module=None, stream=False):
         try:
-            # Note: system_instruction is supported in newer genai versions
-            # If fail, we prepend to first message
-            self.chat_sessions[tool_name] = self.model.start_chat(history=history)
-            self.chat_syst_prompts[tool_name] = system_prompt
-            return True
-        except: return False
-
-    async def generate_chat_response(self, tool_name, context, image_path, api_key, model_name):
-        try:
-            self.configure(api_key, model_name)
-            
-            if tool_name not in getattr(self, 'chat_sessions', {}):
-                if not hasattr(self, 'chat_sessions'): self.chat_sessions = {}
-                if not hasattr(self, 'chat_syst_prompts'): self.chat_syst_prompts = {}
-                self.chat_sessions[tool_name] = self.model.start_chat(history=[])
-                # We need to know system prompt... handled in caller?
-            
-            chat = self.chat_sessions[tool_name]
-            
-            # Construct message
-            msg_parts = []
-            
-            # Inject system prompt if new or reset? 
-            # Chat history keeps context, so system prompt usually sent once or implicitly.
-            # But here we just send user context.
+            model = self.clients.get(api_key, model_name, sdk_module)
+            await history.settle() # the previous answer may still be streaming into the history
             
-            # Simple approach: Prepend system prompt to the context if history is empty?
-            # Or just send context.
-            
-            full_text = f"[Game Context]\n{context}\n\nRespond with JSON only."
-            if len(chat.history) == 0:
-                 # First turn: Add System Prompt
-                 # Note: Ideally system_instruction in start_chat, but let's prepend here
-                 sys_p = getattr(self, 'chat_syst_prompts', {}).get(tool_name, "")
-                 if sys_p: full_text = f"SYSTEM: {sys_p}\n\n{full_text}"
-
-            msg_parts.append(full_text)
-            
-            if image_path and os.path.exists(image_path):
-                img = Image.open(image_path)
-                msg_parts.append(img)
-                
-            response = await chat.send_message_async(msg_parts)
-            return response.text, None
+            context_text, parsed_context, full_context = history.encode_context(context)
+            user_text = f"[Game Context]\n{context_text}\n\nRespond with JSON only."
+            contents = history.build_contents(system_prompt, user_text, frame)
+            on_complete = lambda text: history.append(user_text, frame, text, parsed_context, full_context)
+            return await self.generate(model, contents, stream, on_complete, history), None
         except Exception as e:
             return None, str(e)
 
+    async def generate(self, model, contents, stream=False, on_complete=None, history=None):
+        """Answer text for `contents`; on_complete(full_text) runs once the whole answer is known.
+
+        With stream=True the answer is parsed as it streams and returned as soon as it holds a
+        complete action; the rest (usually the end of "thought") is read in the background."""
+        if not stream:
+            response = await model.generate_content_async(contents)
+            if on_complete: on_complete(response.text)
+            return response.text
+
+        response = await model.generate_content_async(contents, stream=True)
+        chunks = response.__aiter__()
+        parser = StreamingActionParser()
+        timer = current_timer.get()
+        async for chunk in chunks:
+            parser.feed(stream_chunk_text(chunk))
+            if timer: timer.report_thought(partial_thought(parser.text()))
+            action = parser.action()
+            if action and not parser.closed:
+                metrics.inc("aitester_native_early_actions_total")
+                task = asyncio.create_task(self.finish_stream(chunks, parser, timer, on_complete))
+                self.finishing.add(task)
+                task.add_done_callback(self.finishing.discard)
+                if history is not None: history.pending = task
+                return json.dumps(action)
+        if on_complete: on_complete(parser.text())
+        return parser.text()
+
+    async def finish_stream(self, chunks, parser, timer, on_complete):
+        try:
+            async for chunk in chunks: parser.feed(stream_chunk_text(chunk))
+        except Exception as e:
+            log(f"[Native] Stream ended early after the action was returned: {e}", level="warning")
+        finally:
+            if timer: timer.report_thought(partial_thought(parser.text()))
+            if on_complete: on_complete(parser.text())
+            log(f"[Native] Finished stream in background ({len(parser.text())} chars)", level="debug")
+
+def stream_chunk_text(chunk):
+    try: return chunk.text
+    except (ValueError, AttributeError): return "" # e.g. a final chunk carrying only the finish reason
+
+# --- Context Delta Encoding ---
+UI_NODE_LINE = re.compile(r'^(-+) (\[\w+\]) "(.*)"\s*(?:\(Pos: (-?\d+),(-?\d+) Size: (\d+)x(\d+)\))?\s*$')
+UI_CANVAS_LINE = re.compile(r'^\[Canvas\] (.*?)(?: \(.*\))?\s*$')
+CONTEXT_DELTA_MAX_RATIO = 0.6 # send the full context when the delta would not be much smaller
+
+def parse_context(context):
+    """Split a context into UIHierarchyDumper nodes keyed by type and path, and all other lines."""
+    nodes, other, path = {}, [], []
+    for line in context.splitlines():
+        m = UI_NODE_LINE.match(line)
+        if m:
+            depth, ui_type, name = len(m.group(1)) // 2, m.group(2), m.group(3)
+            rect = tuple(int(v) for v in m.group(4, 5, 6, 7)) if m.group(4) else None
+        else:
+            m = UI_CANVAS_LINE.match(line)
+            if not m:
+                if line.strip(): other.append(line)
+                continue
+            depth, ui_type, name, rect = 0, "[Canvas]", m.group(1), None
+        del path[depth:]
+        path.append(name)
+        key = base = f'{ui_type} "{"/".join(path)}"'
+        n = 2
+        while key in nodes: # same-named siblings
+            key = f"{base} #{n}"
+            n += 1
+        nodes[key] = (rect, line.strip("- "))
+    return nodes, other
+
+def format_rect(rect):
+    return f"(Pos: {rect[0]},{rect[1]} Size: {rect[2]}x{rect[3]})" if rect else ""
+
+def diff_context(old, new):
+    """Text listing removed, added and changed UI nodes between two parsed contexts,
+    or None when it would not be much shorter than the new context itself."""
+    (old_nodes, old_other), (new_nodes, new_other) = old, new
+    lines = [f"- {key}" for key in old_nodes if key not in new_nodes]
+    lines += [f"+ {key} {format_rect(value[0])}".rstrip() for key, value in new_nodes.items() if key not in old_nodes]
+    for key, (rect, text) in new_nodes.items():
+        if key not in old_nodes or old_nodes[key][1] == text: continue
+        lines.append(f"~ {key} {format_rect(rect)}" if rect else f"~ {key} now: {text}")
+    if new_other != old_other:
+        lines += ["[Other Context]"] + new_other
+    if not lines:
+        return "[UI Changes Since Previous Step]\nNone, the UI is the same as in the previous step."
+    delta = "[UI Changes Since Previous Step] (unchanged elements omitted; - removed, + added, ~ changed)\n" + "\n".join(lines)
+    full_size = sum(len(line) for line in new_other) + sum(len(text) for _, text in new_nodes.values())
+    return delta if len(delta) <= full_size * CONTEXT_DELTA_MAX_RATIO else None
+
+class ContextDelta:
+    """The last context a stateful backend has seen, so the next step can send only what changed.
+
+    Callers pass `anchored=False` when the backend may have lost the last full context (reset,
+    history truncation); the full context is then sent again and becomes the new base."""
+    def __init__(self, enabled=True, refresh_every=0):
+        self.enabled = enabled
+        self.refresh_every = refresh_every # force a full context after this many deltas (0 = never)
+        self.last = None
+        self.deltas_since_full = 0
+
+    def apply_config(self, conf):
+        self.enabled = bool(conf.get("context_delta", True))
+        self.refresh_every = int(conf.get("context_refresh", self.refresh_every))
+
+    def encode(self, context, anchored=True):
+        """Returns (text to send, parsed context, is_full)."""
+        if not self.enabled: return context, None, True
+        parsed = parse_context(context)
+        refresh_due = self.refresh_every and self.deltas_since_full >= self.refresh_every
+        if anchored and self.last is not None and not refresh_due:
+            delta = diff_context(self.last, parsed)
+            if delta is not None:
+                metrics.inc("aitester_context_steps_total", kind="delta")
+                metrics.inc("aitester_context_chars_saved_total", len(context) - len(delta))
+                return delta, parsed, False
+        metrics.inc("aitester_context_steps_total", kind="full")
+        return context, parsed, True
+
+    def commit(self, parsed, is_full):
+        """Record what the backend now holds; call only after it accepted the step."""
+        self.last = parsed
+        self.deltas_since_full = 0 if is_full else self.deltas_since_full + 1
+
+    def reset(self):
+        self.last = None
+        self.deltas_since_full = 0
+
+# --- Chat History Management ---
+IMAGE_TOKEN_ESTIMATE = 258 # Gemini bills a small image as one 258-token tile
+CHARS_PER_TOKEN = 4
+
+class ChatTurn:
+    def __init__(self, user_text, image, response_text):
+        self.user_text = user_text
+        self.image = image # inline blob dict, dropped once the turn is older than image_turns
+        self.response_text = response_text
+
+class ChatHistory:
+    """Sliding window of chat turns sent with every persistent native request.
+
+    Only the last `image_turns` turns keep their screenshot, turns beyond `max_turns` are dropped
+    and (optionally) folded into a rolling text summary, so per-step cost stays flat on long runs.
+    """
+    def __init__(self, conf=None):
+        conf = conf or {}
+        self.max_turns = max(1, int(conf.get("max_turns", 12)))
+        self.image_turns = max(0, int(conf.get("image_turns", 2)))
+        self.summarize = bool(conf.get("summarize", True))
+        self.summary_max_chars = int(conf.get("summary_max_chars", 2000))
+        self.turns = []
+        self.summary_lines = deque()
+        self.dropped_turns = 0
+        self.context = ContextDelta(bool(conf.get("context_delta", True)))
+        self.anchor = None # turn that carried the full context the later deltas build on
+        self.pending = None # background task still streaming the last answer into the history
+        self.persist = None # called after each new turn when the session state is externalized
+
+    def to_state(self):
+        """Text-only snapshot for the state store; screenshots stay in process memory."""
+        return {"turns": [[t.user_text, t.response_text] for t in self.turns],
+                "summary_lines": list(self.summary_lines), "dropped_turns": self.dropped_turns}
+
+    def restore(self, state):
+        self.turns = [ChatTurn(user_text, None, response_text) for user_text, response_text in state.get("turns", [])]
+        self.summary_lines = deque(state.get("summary_lines", []))
+        self.dropped_turns = int(state.get("dropped_turns", 0))
+        # anchor stays None: the next step sends the full context
+
+    async def settle(self):
+        if self.pending is not None and not self.pending.done():
+            await asyncio.shield(self.pending)
+        self.pending = None
+
+    def encode_context(self, context):
+        # Deltas are only meaningful while the full-context turn is still in the window
+        return self.context.encode(context, anchored=self.anchor in self.turns)
+
+    def build_contents(self, system_prompt, user_text, frame):
+        header = f"SYSTEM: {system_prompt}\n\n" if system_prompt else ""
+        if self.summary_lines:
+            header += "[Earlier Steps]\n" + "\n".join(self.summary_lines) + "\n\n"
+
+        contents = []
+        for turn in self.turns:
+            parts = [turn.user_text] + ([turn.image] if turn.image else [])
+            contents.append({"role": "user", "parts": parts})
+            contents.append({"role": "model", "parts": [turn.response_text]})
+        parts = [user_text] + ([frame.blob()] if frame else [])
+        contents.append({"role": "user", "parts": parts})
+        # The system prompt rides on the first message that is still in the window
+        contents[0]["parts"][0] = header + contents[0]["parts"][0]
+        return contents
+
+    def append(self, user_text, frame, response_text, parsed_context=None, full_context=True):
+        turn = ChatTurn(user_text, frame.blob() if frame else None, response_text)
+        self.turns.append(turn)
+        if full_context: self.anchor = turn
+        self.context.commit(parsed_context, full_context)
+        for turn in self.turns[:max(0, len(self.turns) - self.image_turns)]:
+            turn.image = None
+        while len(self.turns) > self.max_turns:
+            self._drop(self.turns.pop(0))
+        if self.persist: self.persist()
+
+    def _drop(self, turn):
+        self.dropped_turns += 1
+        if not self.summarize: return
+        action = extract_json(turn.response_text) or {}
+        pos = action.get("screenPosition") or {}
+        line = f"Step {self.dropped_turns}: {action.get('actionType', '?')}"
+        if isinstance(pos, dict) and "x" in pos: line += f" at ({pos.get('x')}, {pos.get('y')})"
+        thought = str(action.get("thought", "")).strip()
+        if thought: line += f" - {thought[:120]}"
+        self.summary_lines.append(line)
+        while self.summary_lines and sum(len(l) + 1 for l in self.summary_lines) > self.summary_max_chars:
+            self.summary_lines.popleft()
+
+    def stats(self):
+        text_chars = sum(len(t.user_text) + len(t.response_text) for t in self.turns)
+        text_chars += sum(len(l) + 1 for l in self.summary_lines)
+        images = [t.image for t in self.turns if t.image]
+        return {
+            "turns": len(self.turns),
+            "dropped_turns": self.dropped_turns,
+            "images": len(images),
+            "summary_chars": sum(len(l) + 1 for l in self.summary_lines),
+            "estimated_tokens": text_chars // CHARS_PER_TOKEN + len(images) * IMAGE_TOKEN_ESTIMATE,
+            "memory_bytes": text_chars + sum(len(img["data"]) for img in images)
+        }
+
 native_engine = NativeGeminiEngine()
 
+# --- In-Memory Frames ---
+class Frame:
+    """Uploaded screenshot kept as bytes. Decoding and file spill happen at most once, on demand."""
+    def __init__(self, content, spill_path):
+        self.content = content
+        self.spill_path = spill_path
+        self.spilled = False
+        self._image = None
+        self._decoded = False
+        self._base64 = None
+
+    @property
+    def mime_type(self):
+        if self.content.startswith(b"\x89PNG"): return "image/png"
+        if self.content[:4] == b"RIFF" and self.content[8:12] == b"WEBP": return "image/webp"
+        return "image/jpeg"
+
+    def blob(self):
+        # Inline blob part: the SDK uploads the original bytes without a decode/re-encode round trip
+        return {"mime_type": self.mime_type, "data": self.content}
+
+    @property
+    def image(self):
+        """Decoded PIL image, or None if PIL is missing or the bytes are not an image."""
+        if not self._decoded:
+            self._decoded = True
+            Image = load_pil()
+            if Image:
+                try:
+                    self._image = Image.open(io.BytesIO(self.content))
+                    self._image.load()
+                except Exception: self._image = None
+        return self._image
+
+    def base64(self):
+        if self._base64 is None: self._base64 = base64.b64encode(self.content).decode("ascii")
+        return self._base64
+
+    def path(self):
+        """Spill to a temp file for CLI tools that only accept a path."""
+        if not self.spilled:
+            os.makedirs(os.path.dirname(self.spill_path), exist_ok=True)
+            with open(self.spill_path, "wb") as f: f.write(self.content)
+            self.spilled = True
+        return self.spill_path
+
+    def variant(self, content, tag):
+        """A re-encoded copy (see ImageStage) spilling next to this frame."""
+        base, _ = os.path.splitext(self.spill_path)
+        frame = Frame(content, f"{base}_{tag}.jpg")
+        if frame.mime_type != "image/jpeg": frame.spill_path = f"{base}_{tag}.{frame.mime_type.split('/')[1]}"
+        return frame
+
+# --- Image Stage (per-tool downscale / re-encode / crop before a backend sees the frame) ---
+IMAGE_FORMATS = {"jpeg": "JPEG", "webp": "WEBP", "png": "PNG"}
+IMAGE_MIN_QUALITY = 30
+IMAGE_MAX_PASSES = 8 # encode attempts while shrinking toward max_bytes
+CROP_UI_TYPES = ("[Button]", "[Input]", "[Toggle]", "[Slider]", "[Scroll]")
+CROP_NOTE = "[Screenshot] The image shows only the region around the interactive UI. Give positions relative to the image."
+
+class ImageStage:
+    """The optional "image" block of a tool: the frame is resized, re-encoded, made grayscale or
+    cropped to the interactive UI before this tool sees it, within a byte and image-token budget.
+
+    Positions in answers are normalized, so a resized frame needs no mapping back; answers about a
+    cropped frame are mapped back to the full screen with map_from_crop(). Frames that already fit
+    the budget are passed through without decoding them fully."""
+    def __init__(self, conf):
+        if not isinstance(conf, dict): raise ValueError("'image' must be an object")
+        try:
+            self.max_width = int(conf.get("max_width", 0))
+            self.max_height = int(conf.get("max_height", 0))
+            self.quality = int(conf.get("quality", 75))
+            self.grayscale = bool(conf.get("grayscale", False))
+            self.crop_margin = float(conf.get("crop_margin", 0.05))
+            self.crop_max_area = float(conf.get("crop_max_area", 0.8)) # crops keeping more than this are skipped
+            self.max_bytes = int(conf.get("max_bytes", 0))
+            self.max_tokens = int(conf.get("max_tokens", 0))
+            self.tile_size = int(conf.get("tile_size", 768)) # Gemini bills 258 tokens per 768x768 tile
+            self.tile_tokens = int(conf.get("tile_tokens", 258))
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"invalid 'image' option: {e}")
+        self.format = conf.get("format")
+        if self.format is not None and str(self.format).lower() not in IMAGE_FORMATS:
+            raise ValueError(f"'image.format' must be one of {', '.join(IMAGE_FORMATS)}")
+        self.crop = conf.get("crop", False)
+        if self.crop not in (False, None, "ui"): raise ValueError("'image.crop' must be \"ui\" or false")
+        if self.tile_size <= 0 or self.tile_tokens <= 0: raise ValueError("'image.tile_size' and 'image.tile_tokens' must be positive")
+        # Without an explicit format/quality or grayscale, frames within the budget are left as sent
+        self.reencode = self.grayscale or "quality" in conf or self.format is not None
+
+    def estimate_tokens(self, width, height):
+        return math.ceil(width / self.tile_size) * math.ceil(height / self.tile_size) * self.tile_tokens
+
+    def target_scale(self, width, height):
+        """Largest scale <= 1 that fits max_width/max_height and the token budget."""
+        scale = 1.0
+        if self.max_width: scale = min(scale, self.max_width / width)
+        if self.max_height: scale = min(scale, self.max_height / height)
+        if self.max_tokens:
+            while scale * min(width, height) > 32 and self.estimate_tokens(width * scale, height * scale) > self.max_tokens:
+                scale *= 0.9
+        return scale
+
+    def crop_box(self, context, width, height):
+        """Normalized (left, top, width, height) around the interactive UI nodes of a
+        UIHierarchyDumper context, or None. Dumper positions are screen pixels from the bottom left."""
+        boxes = [rect for key, (rect, _) in parse_context(context or "")[0].items()
+                 if rect and key.split(" ", 1)[0] in CROP_UI_TYPES and rect[2] > 0 and rect[3] > 0]
+        if not boxes: return None
+        left = min(cx - w / 2 for cx, cy, w, h in boxes) - self.crop_margin * width
+        right = max(cx + w / 2 for cx, cy, w, h in boxes) + self.crop_margin * width
+        top = height - max(cy + h / 2 for cx, cy, w, h in boxes) - self.crop_margin * height
+        bottom = height - min(cy - h / 2 for cx, cy, w, h in boxes) + self.crop_margin * height
+        left, top = max(0.0, left / width), max(0.0, top / height)
+        right, bottom = min(1.0, right / width), min(1.0, bottom / height)
+        if right <= left or bottom <= top or (right - left) * (bottom - top) > self.crop_max_area: return None
+        return (left, top, right - left, bottom - top)
+
+    def process(self, content, context):
+        """(new bytes, crop) or None to send the frame unchanged. Runs in a worker thread."""
+        Image = load_pil()
+        if Image is None: return None
+        img = Image.open(io.BytesIO(content)) # reads the header only
+        width, height = img.size
+        crop = self.crop_box(context, width, height) if self.crop == "ui" else None
+        crop_width, crop_height = (width * crop[2], height * crop[3]) if crop else (width, height)
+        scale = self.target_scale(crop_width, crop_height)
+        if (scale >= 1.0 and not crop and not self.reencode
+                and (not self.max_bytes or len(content) <= self.max_bytes)): return None
+
+        if img.format == "JPEG": # let libjpeg decode at 1/2, 1/4 or 1/8 size when that is enough
+            img.draft("L" if self.grayscale else "RGB", (math.ceil(width * scale), math.ceil(height * scale)))
+        img = img.convert("L" if self.grayscale else "RGB")
+        if crop:
+            w, h = img.size
+            img = img.crop((round(crop[0] * w), round(crop[1] * h), round((crop[0] + crop[2]) * w), round((crop[1] + crop[3]) * h)))
+        out_format = IMAGE_FORMATS[str(self.format or "jpeg").lower()]
+        quality, data = self.quality, content
+        for _ in range(IMAGE_MAX_PASSES):
+            size = (max(1, round(crop_width * scale)), max(1, round(crop_height * scale)))
+            resized = img.resize(size, Image.BILINEAR, reducing_gap=2.0) if size != img.size else img
+            buf = io.BytesIO()
+            resized.save(buf, out_format, quality=quality, **({"optimize": True} if out_format == "PNG" else {}))
+            data = buf.getvalue()
+            if not self.max_bytes or len(data) <= self.max_bytes: break
+            if quality > IMAGE_MIN_QUALITY and out_format != "PNG": quality = max(IMAGE_MIN_QUALITY, quality - 15)
+            else: scale *= 0.75
+        return data, crop
+
+def map_from_crop(action, crop):
+    """Map the normalized positions of an answer about a cropped frame back to the full screen."""
+    left, top, width, height = crop
+    keys = ("screenPosition", "targetPosition") if str(action.get("actionType", "")).lower() == "drag" else ("screenPosition",)
+    for key in keys:
+        pos = action.get(key)
+        try: action[key] = {"x": round(left + float(pos["x"]) * width, 4), "y": round(top + float(pos["y"]) * height, 4)}
+        except (TypeError, KeyError, ValueError): pass
+    return action
+
+async def prepare_frame(spec, frame, context):
+    """(frame, context, crop) as the tool should see them after its image stage."""
+    if spec.image is None or frame is None: return frame, context, None
+    with timed_stage("image_prep"):
+        try: result = await asyncio.to_thread(spec.image.process, frame.content, context)
+        except Exception as e:
+            log(f"[Image] '{spec.name}': sending the original frame ({e})", level="warning")
+            result = None
+    metrics.inc("aitester_image_bytes_in_total", len(frame.content), tool=spec.name)
+    if result is None:
+        metrics.inc("aitester_image_bytes_out_total", len(frame.content), tool=spec.name)
+        return frame, context, None
+    content, crop = result
+    metrics.inc("aitester_image_bytes_out_total", len(content), tool=spec.name)
+    log(f"[Image] '{spec.name}': {len(frame.content) // 1024} KB -> {len(content) // 1024} KB" + (" (cropped)" if crop else ""), level="debug")
+    return frame.variant(content, re.sub(r"\W", "_", spec.name)), f"{context}\n\n{CROP_NOTE}" if crop else context, crop
+
+# --- Session Management ---
+class BridgeSession:
+    """Per-agent state: last frame, chat histories and a lock serializing its requests."""
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.chats = {} # tool_name -> ChatHistory
+        self.lock = asyncio.Lock()
+        self.created_at = time.time()
+        self.last_access = self.created_at
+        self.request_count = 0
+        self.speculation = None # see Speculator
+        # Hash keeps arbitrary client ids filesystem-safe and collision-free
+        digest = hashlib.sha1(session_id.encode("utf-8")).hexdigest()[:16]
+        self.frame_path = os.path.join(FRAME_DIR, f"frame_{digest}.jpg")
+
+    def touch(self):
+        self.last_access = time.time()
+        self.request_count += 1
+
+    def new_frame(self, content):
+        return Frame(content, self.frame_path)
+
+    async def chat_history(self, tool_name, conf=None):
+        history = self.chats.get(tool_name)
+        if history is None:
+            history = self.chats[tool_name] = ChatHistory(conf)
+            if state_store:
+                # The session may have been served by another worker (or a previous run) before
+                state = await asyncio.to_thread(state_store.load_history, self.session_id, tool_name)
+                if state:
+                    history.restore(state)
+                    log(f"[Session] Restored {len(history.turns)} turns of '{tool_name}' for '{self.session_id}'")
+                history.persist = lambda: state_store.save_history(self.session_id, tool_name, history.to_state())
+        return history
+
+    def stats(self):
+        now = time.time()
+        return {
+            "session_id": self.session_id,
+            "age_seconds": round(now - self.created_at, 1),
+            "idle_seconds": round(now - self.last_access, 1),
+            "requests": self.request_count,
+            "chats": {tool: history.stats() for tool, history in self.chats.items()}
+        }
+
+    def close(self):
+        self.chats.clear()
+        if self.speculation: self.speculation.task.cancel()
+        self.speculation = None
+        for path in glob.glob(os.path.splitext(self.frame_path)[0] + "*"): # the frame and its per-tool variants
+            try: os.remove(path)
+            except OSError: pass
+
+class SessionManager:
+    def __init__(self, idle_timeout=SESSION_IDLE_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self.sessions = {}
+
+    def get(self, session_id):
+        session_id = session_id or DEFAULT_SESSION_ID
+        session = self.sessions.get(session_id)
+        if session is None:
+            session = BridgeSession(session_id)
+            self.sessions[session_id] = session
+            log(f"[Session] Created '{session_id}' ({len(self.sessions)} active)")
+        return session
+
+    def drop(self, session_id, forget=True):
+        """Close a session; with forget=False its externalized state survives (idle eviction)."""
+        session = self.sessions.pop(session_id, None)
+        if session: session.close()
+        if forget and state_store: state_store.drop_session(session_id)
+        return session is not None
+
+    def drop_all(self, forget=False):
+        for session in self.sessions.values(): session.close()
+        self.sessions.clear()
+        if forget and state_store: state_store.drop_all_sessions()
+
+    def evict_idle(self):
+        now = time.time()
+        expired = [sid for sid, s in self.sessions.items()
+                   if now - s.last_access > self.idle_timeout and not s.lock.locked()]
+        for sid in expired:
+            self.drop(sid, forget=False) # another worker may own it by now; the store expires it by age
+            log(f"[Session] Evicted idle session '{sid}'")
+        return expired
+
+    async def sweep_loop(self, interval=SESSION_SWEEP_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            self.evict_idle()
+            if state_store: state_store.expire(self.idle_timeout)
+
+session_manager = SessionManager()
+
 # --- Gemini Headless Engine (Direct Subprocess) ---
 import subprocess
 
@@ -142,8 +745,8 @@ class GeminiHeadlessEngine:
             # We combine System Prompt and Context here because strict Stdin input is one stream.
             full_text_input = f"{system_prompt}\n\n[Game Context]\n{context}\n\nRespond with JSON only."
             
-            log(f"[GeminiHeadless] Running: {' '.join(cmd)}")
-            log(f"[GeminiHeadless] Input Length: {len(full_text_input)}")
+            log(f"[GeminiHeadless] Running: {' '.join(cmd)}", level="debug")
+            log(f"[GeminiHeadless] Input Length: {len(full_text_input)}", level="debug")
             
             # 2. Execute
             # shell=True required for .cmd on Windows often
@@ -166,7 +769,7 @@ class GeminiHeadlessEngine:
             )
             
             if result.returncode != 0:
-                log(f"[GeminiHeadless] ❌ Error: {result.stderr}")
+                log(f"[GeminiHeadless] ❌ Error: {result.stderr}", level="error")
                 return None, f"CLI Error: {result.stderr[:200]}"
             
             # 3. Parse Output
@@ -208,7 +811,1140 @@ class GeminiHeadlessEngine:
         return parsed
 
 terminal_bridge_engine = GeminiHeadlessEngine()
-process_manager = None # Removed PersistentProcessManager usage
+
+# --- HTTP Engine (Ollama / OpenAI-compatible local model servers) ---
+try:
+    import httpx
+    HTTPX_AVAILABLE = True
+except ImportError:
+    HTTPX_AVAILABLE = False
+
+HTTP_TIMEOUT = 120.0
+
+class HttpLLMEngine:
+    """Talks to local model servers over one pooled keep-alive client instead of a curl process per step."""
+    def __init__(self):
+        self.client = None
+
+    def get_client(self):
+        if self.client is None:
+            if not HTTPX_AVAILABLE:
+                raise RuntimeError("httpx is not installed (pip install httpx).")
+            self.client = httpx.AsyncClient(limits=httpx.Limits(max_connections=64, max_keepalive_connections=16))
+        return self.client
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    def build_ollama_request(self, tool, system_prompt, user_text, frame):
+        body = {
+            "model": tool.get("model_name", "llava"),
+            "system": system_prompt,
+            "prompt": user_text,
+            "stream": False
+        }
+        if tool.get("json_mode", True): body["format"] = "json"
+        if frame and tool.get("image_support", True): body["images"] = [frame.base64()]
+        if tool.get("options"): body["options"] = tool["options"]
+        return body
+
+    def build_openai_request(self, tool, system_prompt, user_text, frame):
+        content = [{"type": "text", "text": user_text}]
+        if frame and tool.get("image_support", True):
+            content.append({"type": "image_url", "image_url": {"url": f"data:{frame.mime_type};base64,{frame.base64()}"}})
+        body = {
+            "model": tool.get("model_name", "local-model"),
+            "messages": [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": content}
+            ],
+            "stream": False
+        }
+        if tool.get("json_mode", False): body["response_format"] = {"type": "json_object"}
+        body.update(tool.get("options", {})) # e.g. temperature, max_tokens
+        return body
+
+    async def generate_action(self, tool, system_prompt, context, frame):
+        api = tool.get("api", "openai")
+        user_text = f"[Game Context]\n{context}\n\nRespond with JSON only."
+        try:
+            if api == "ollama":
+                body = self.build_ollama_request(tool, system_prompt, user_text, frame)
+            else:
+                body = self.build_openai_request(tool, system_prompt, user_text, frame)
+            headers = {}
+            if tool.get("api_key"): headers["Authorization"] = f"Bearer {tool['api_key']}"
+
+            response = await self.get_client().post(
+                tool["url"], json=body, headers=headers, timeout=float(tool.get("timeout", HTTP_TIMEOUT)))
+            if response.status_code != 200:
+                return None, f"HTTP {response.status_code}: {response.text[:200]}"
+            data = response.json()
+            if api == "ollama":
+                return data.get("response") or data.get("message", {}).get("content", ""), None
+            return data["choices"][0]["message"]["content"], None
+        except KeyError as e:
+            return None, f"HTTP Error: missing '{e.args[0]}' in config or response"
+        except Exception as e:
+            if HTTPX_AVAILABLE and isinstance(e, httpx.TimeoutException):
+                return None, f"Timeout: {tool.get('url')} did not answer in time."
+            return None, f"HTTP Error: {e}"
+
+http_engine = HttpLLMEngine()
+
+# --- Persistent Worker Pool (warm CLI processes, see persistent_mock.py for the protocol) ---
+# Protocol: one request per stdin line, the first JSON object on stdout is the answer.
+WORKER_HEALTH_INTERVAL = 5.0 # seconds between dead-worker sweeps
+
+async def spawn_process(cmd_list, **kwargs):
+    """Start an asyncio subprocess. .cmd/.bat shims on Windows need the shell."""
+    if os.name == 'nt':
+        return await asyncio.create_subprocess_shell(subprocess.list2cmdline(cmd_list), **kwargs)
+    return await asyncio.create_subprocess_exec(*cmd_list, **kwargs)
+
+async def stop_process(proc, grace=3.0):
+    if proc is None or proc.returncode is not None: return
+    try:
+        proc.terminate()
+        await asyncio.wait_for(proc.wait(), grace)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+    except ProcessLookupError: pass
+
+PERSISTENT_CONTEXT_REFRESH = 8 # CLI agents may trim their own history unseen, so resend the full context periodically
+
+class PersistentWorker:
+    def __init__(self, tool_name, index, cmd_list):
+        self.name = f"{tool_name}#{index}"
+        self.cmd_list = cmd_list
+        self.proc = None
+        self.output = asyncio.Queue() # stdout chunks, None marks EOF
+        self.stderr_tail = deque(maxlen=20)
+        self.initialized = False # SYSTEM prompt already sent to this process
+        self.busy = False
+        self.stale = False # a cancelled request may still answer; recycle before reuse
+        self.session_id = None # last session served, used for affinity
+        self.context = ContextDelta(refresh_every=PERSISTENT_CONTEXT_REFRESH) # what this process has seen this session
+        self.restarts = 0
+        self._pumps = []
+
+    def is_alive(self):
+        return self.proc is not None and self.proc.returncode is None
+
+    async def start(self):
+        self.proc = await spawn_process(
+            self.cmd_list,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        self.output = asyncio.Queue()
+        self.initialized = False
+        self.stale = False
+        self.session_id = None
+        self.context.reset()
+        self._pumps = [asyncio.create_task(self._pump_stdout()), asyncio.create_task(self._pump_stderr())]
+        log(f"[Pool] Started {self.name} (pid {self.proc.pid})")
+
+    async def stop(self):
+        for task in self._pumps: task.cancel()
+        self._pumps = []
+        await stop_process(self.proc)
+
+    async def restart(self):
+        await self.stop()
+        self.restarts += 1
+        await self.start()
+
+    async def _pump_stdout(self):
+        while True:
+            chunk = await self.proc.stdout.read(4096)
+            if not chunk: break
+            self.output.put_nowait(chunk.decode("utf-8", errors="replace"))
+        self.output.put_nowait(None)
+
+    async def _pump_stderr(self):
+        while True:
+            line = await self.proc.stderr.readline()
+            if not line: break
+            self.stderr_tail.append(line.decode("utf-8", errors="replace").rstrip())
+
+    def _drain(self):
+        # Discard banners / late output left over from a previous request
+        while not self.output.empty():
+            if self.output.get_nowait() is None:
+                self.output.put_nowait(None)
+                break
+
+    async def request(self, input_text, timeout):
+        """Send one request line and wait for the first JSON object. Returns (parsed, err)."""
+        self._drain()
+        try:
+            self.proc.stdin.write(input_text.encode("utf-8"))
+            await self.proc.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError) as e:
+            return None, f"Persistent process '{self.name}' is not accepting input: {e}"
+
+        extractor = StreamingJsonExtractor()
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0: break
+            try:
+                chunk = await asyncio.wait_for(self.output.get(), remaining)
+            except asyncio.TimeoutError:
+                break
+            except asyncio.CancelledError:
+                self.stale = True
+                raise
+            if chunk is None:
+                await self.proc.wait()
+                err_out = " | ".join(self.stderr_tail)
+                log(f"[Pool] {self.name} died during execution. STDERR: {err_out[:200]}", level="warning")
+                return None, f"Persistent Process Error (STDERR): {err_out[:200]}"
+            parsed = extractor.feed(chunk)
+            timer = current_timer.get()
+            if parsed:
+                if timer: timer.raw_output = extractor.text()
+                return parsed, None
+            if timer and timer.on_thought: timer.report_thought(partial_thought(extractor.text()))
+
+        clean_out = extractor.text().strip()
+        log(f"[Pool] {self.name} timeout. Snippet: {clean_out[:100]}", level="warning")
+        # A late answer would leak into the next request, so recycle the process
+        await self.restart()
+        return None, f"Persistent timeout. Output snippet: {clean_out[:50]}..."
+
+class PersistentWorkerPool:
+    def __init__(self, tool_name, tool):
+        self.tool_name = tool_name
+        self.cmd_list = [tool["command"]] + list(tool.get("arguments", []))
+        self.size = max(1, int(tool.get("pool_size", 1)))
+        self.timeout = float(tool.get("timeout", 45))
+        self.workers = [PersistentWorker(tool_name, i, self.cmd_list) for i in range(self.size)]
+        self.available = asyncio.Condition()
+
+    def matches(self, tool):
+        return ([tool["command"]] + list(tool.get("arguments", [])) == self.cmd_list
+                and max(1, int(tool.get("pool_size", 1))) == self.size)
+
+    async def start(self):
+        await asyncio.gather(*(w.start() for w in self.workers))
+
+    async def stop(self):
+        await asyncio.gather(*(w.stop() for w in self.workers))
+
+    async def acquire(self, session_id):
+        async with self.available:
+            await self.available.wait_for(lambda: any(not w.busy for w in self.workers))
+            idle = [w for w in self.workers if not w.busy]
+            # Prefer the worker that already holds this session's conversation
+            worker = next((w for w in idle if w.session_id == session_id), None)
+            if worker is None:
+                worker = next((w for w in idle if w.session_id is None), idle[0])
+            worker.busy = True
+        try:
+            if not worker.is_alive() or worker.stale:
+                log(f"[Pool] {worker.name} is {'dead' if not worker.is_alive() else 'stale'}, restarting before dispatch.", level="warning")
+                await worker.restart()
+        except Exception:
+            await self.release(worker)
+            raise
+        if worker.session_id != session_id:
+            worker.initialized = False # other conversation in this process; resend SYSTEM
+            worker.context.reset()
+        worker.session_id = session_id
+        return worker
+
+    async def release(self, worker):
+        async with self.available:
+            worker.busy = False
+            self.available.notify()
+
+    async def health_check(self):
+        for worker in self.workers:
+            if worker.busy or worker.is_alive(): continue
+            log(f"[Pool] Health check: {worker.name} exited (code {worker.proc.returncode if worker.proc else None}), restarting.", level="warning")
+            worker.busy = True
+            try: await worker.restart()
+            except Exception as e: log(f"[Pool] Restart of {worker.name} failed: {e}", level="error")
+            finally: await self.release(worker)
+
+    async def reset_session(self, session_id):
+        for worker in self.workers:
+            if worker.session_id == session_id and not worker.busy:
+                worker.busy = True
+                try: await worker.restart()
+                finally: await self.release(worker)
+
+class WorkerPoolManager:
+    def __init__(self):
+        self.pools = {}
+        self.lock = asyncio.Lock()
+
+    async def get_pool(self, tool_name, tool):
+        async with self.lock:
+            pool = self.pools.get(tool_name)
+            if pool and not pool.matches(tool):
+                log(f"[Pool] Config for '{tool_name}' changed, rebuilding pool.")
+                await pool.stop()
+                pool = None
+            if pool is None:
+                pool = PersistentWorkerPool(tool_name, tool)
+                await pool.start()
+                self.pools[tool_name] = pool
+            return pool
+
+    async def reset_session(self, session_id):
+        for pool in list(self.pools.values()):
+            await pool.reset_session(session_id)
+
+    async def stop_all(self):
+        async with self.lock:
+            for pool in self.pools.values(): await pool.stop()
+            self.pools.clear()
+
+    async def health_loop(self, interval=WORKER_HEALTH_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            for pool in list(self.pools.values()):
+                await pool.health_check()
+
+worker_pool_manager = WorkerPoolManager()
+
+# --- Oneshot Concurrency Limits ---
+ONESHOT_TIMEOUT = 60.0
+ONESHOT_MAX_CONCURRENCY = 4
+
+class ToolLimiter:
+    """Bounded concurrency per tool; excess requests queue on the semaphore."""
+    def __init__(self, max_concurrency, max_queue=None):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.active = 0
+        self.waiting = 0
+
+    def is_full(self):
+        return self.max_queue is not None and self.active >= self.max_concurrency and self.waiting >= self.max_queue
+
+    async def acquire(self):
+        self.waiting += 1
+        try: await self.semaphore.acquire()
+        finally: self.waiting -= 1
+        self.active += 1
+
+    def release(self):
+        self.active -= 1
+        self.semaphore.release()
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc):
+        self.release()
+
+class ToolLimiterRegistry:
+    def __init__(self):
+        self.limiters = {}
+
+    def get(self, tool_name, tool):
+        max_concurrency = max(1, int(tool.get("max_concurrency", ONESHOT_MAX_CONCURRENCY)))
+        max_queue = tool.get("max_queue")
+        limiter = self.limiters.get(tool_name)
+        if limiter is None or limiter.max_concurrency != max_concurrency or limiter.max_queue != max_queue:
+            # In-flight requests keep the old limiter; new ones use the updated limits
+            limiter = ToolLimiter(max_concurrency, max_queue)
+            self.limiters[tool_name] = limiter
+        return limiter
+
+oneshot_limiters = ToolLimiterRegistry()
+
+# --- Rate-Limit-Aware Scheduler (per API key + model) ---
+RATE_BACKOFF_MIN = 1.0
+RATE_BACKOFF_MAX = 60.0
+RATE_MAX_RETRIES = 2
+RATE_RECOVERY = 0.1 # fraction of the configured rate regained per successful request
+RATE_FLOOR = 0.1 # never throttle below this fraction of the configured rate
+QUOTA_ERROR = re.compile(r"\b429\b|quota|rate.?limit|resource.?(?:has been )?exhausted|too many requests", re.IGNORECASE)
+RETRY_AFTER = re.compile(r"retry (?:in|after) (\d+(?:\.\d+)?)\s*s|retry_delay\s*\{\s*seconds:\s*(\d+)", re.IGNORECASE)
+
+class RateBucket:
+    """Token bucket for one (api_key, model) with a priority queue of waiting requests.
+
+    A quota error pauses the bucket (server-provided retry delay, else exponential backoff) and
+    halves its rate; each success restores part of it, so the request rate settles just under
+    the real quota instead of bursting into it over and over."""
+    def __init__(self, label):
+        self.label = label
+        self.conf = None
+        self.rpm = 0.0 # configured requests per minute, 0 = no limit until the API pushes back
+        self.burst = 1.0
+        self.rate = 0.0 # current requests per second
+        self.tokens = 1.0
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.backoff = 0.0
+        self.waiters = [] # heap of (-priority, seq, future): highest priority first, then arrival order
+        self.seq = itertools.count()
+        self.pump = None
+        self.limited = 0
+
+    def configure(self, conf):
+        conf = conf or {}
+        if conf == self.conf: return
+        first = self.conf is None
+        self.conf = dict(conf)
+        self.rpm = float(conf.get("rpm", 0))
+        self.burst = max(1.0, float(conf.get("burst", 1)))
+        self.rate = self.rpm / 60.0
+        self.tokens = self.burst if first else min(self.tokens, self.burst)
+
+    def queue_depth(self):
+        return sum(1 for _, _, future in self.waiters if not future.done())
+
+    async def acquire(self, priority=0):
+        if not self.waiters and self._delay() == 0:
+            self._take()
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (-priority, next(self.seq), future))
+        if self.pump is None or self.pump.done(): self.pump = asyncio.create_task(self._pump())
+        await future # a cancelled waiter is skipped by the pump
+
+    async def _pump(self):
+        while self.waiters:
+            future = self.waiters[0][2]
+            if future.done():
+                heapq.heappop(self.waiters)
+                continue
+            delay = self._delay()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            heapq.heappop(self.waiters)
+            self._take()
+            future.set_result(None)
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.rate > 0: self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return now
+
+    def _delay(self):
+        now = self._refill()
+        if now < self.blocked_until: return self.blocked_until - now
+        if self.rate <= 0 or self.tokens >= 1: return 0
+        return (1 - self.tokens) / self.rate
+
+    def _take(self):
+        if self.rate > 0: self.tokens -= 1
+
+    def on_success(self):
+        self.backoff = 0.0
+        if self.rpm: self.rate = min(self.rpm / 60.0, self.rate + self.rpm / 60.0 * RATE_RECOVERY)
+
+    def on_quota_error(self, err):
+        """Pause and slow down after a quota error. Returns the pause in seconds."""
+        self.limited += 1
+        self.backoff = min(RATE_BACKOFF_MAX, max(RATE_BACKOFF_MIN, self.backoff * 2))
+        match = RETRY_AFTER.search(err)
+        delay = min(RATE_BACKOFF_MAX, float(match.group(1) or match.group(2))) if match else self.backoff
+        self.blocked_until = max(self.blocked_until, time.monotonic() + delay)
+        self.tokens = 0.0
+        if self.rpm: self.rate = max(self.rpm / 60.0 * RATE_FLOOR, self.rate / 2)
+        return delay
+
+class RateScheduler:
+    def __init__(self):
+        self.buckets = {}
+
+    def bucket(self, key, label, conf):
+        bucket = self.buckets.get(key)
+        if bucket is None: bucket = self.buckets[key] = RateBucket(label)
+        bucket.configure(conf)
+        return bucket
+
+    async def run(self, key, label, conf, priority, call):
+        """Run call() -> (result, err) when the bucket allows, retrying quota errors after the backoff
+        (ahead of newer requests) instead of handing the agent a Wait action."""
+        conf = conf or {}
+        bucket = self.bucket(key, label, conf)
+        retries = int(conf.get("max_retries", RATE_MAX_RETRIES))
+        for attempt in range(retries + 1):
+            with timed_stage("rate_wait"): await bucket.acquire(priority + attempt)
+            result, err = await call()
+            if not err:
+                bucket.on_success()
+                return result, None
+            if not QUOTA_ERROR.search(err) or classify_error(err) == "timeout": return None, err
+            delay = bucket.on_quota_error(err)
+            metrics.inc("aitester_rate_limited_total", bucket=label)
+            log(f"[Rate] {label}: quota error, pausing {delay:.1f}s (attempt {attempt + 1}/{retries + 1})", level="warning")
+        return None, f"Rate limited: {err}"
+
+rate_scheduler = RateScheduler()
+
+def resolve_api_key(api_key, tool_conf):
+    """The request's key, else the tool's own (the config placeholder counts as none)."""
+    if api_key: return api_key
+    key = tool_conf.get("api_key", "")
+    return "" if key == "YOUR_API_KEY_HERE" else key
+
+def rate_key(spec, api_key):
+    """(bucket key, metrics label). Native tools share a bucket per API key and model, whatever
+    the tool name; the label carries a key digest rather than the key itself."""
+    if spec.route in ("native", "native_chat"):
+        key, model = resolve_api_key(api_key, spec.conf), spec.conf.get("model_name", "gemini-3-flash-preview")
+        return ("native", key, model), f"{model}/{hashlib.sha1(key.encode('utf-8')).hexdigest()[:8]}"
+    return ("tool", spec.name), spec.name
+
+# --- Response Cache (perceptual hash of the frame + hash of prompt/context) ---
+CACHE_SAVE_INTERVAL = 30.0 # seconds between persistence writes
+CACHE_TRIM_EVERY = 32 # shared cache puts between trims of the state store
+
+def frame_phash(frame):
+    """64-bit difference hash of the frame; None if PIL is missing or the image is unreadable."""
+    if frame.image is None: return None
+    pixels = frame.image.convert("L").resize((9, 8)).tobytes() # one byte per pixel in mode L
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return value
+
+STATELESS_ROUTES = ("native", "http", "oneshot") # routes without per-session backend state
+
+def is_stateless(spec):
+    """True if an answer produced outside the backend (a cache hit) leaves it in the state Unity
+    expects. Chat histories and persistent CLI processes would miss the skipped turn."""
+    if spec.route == "race": return bool(spec.members) and all(m.route in STATELESS_ROUTES for m in spec.members)
+    return spec.route in STATELESS_ROUTES
+
+def normalize_cache_text(text):
+    return " ".join((text or "").split())
+
+class ResponseCache:
+    """LRU/TTL cache of actions. Frames within max_distance bits of a cached frame count as the same screen."""
+    def __init__(self):
+        self.enabled = False
+        self.conf = None
+        self.max_entries = 512
+        self.ttl = 900.0
+        self.max_distance = 4
+        self.persist_path = None
+        self.entries = OrderedDict() # (text_key, phash) -> (action, created_at)
+        self.by_text = {} # text_key -> set of phashes, narrows the similarity scan
+        self.hits = 0
+        self.misses = 0
+        self.dirty = False
+        self.last_save = 0.0
+        self.shared_puts = 0
+
+    def apply_config(self, conf):
+        """Sync settings with the "response_cache" config block. Returns True if caching is enabled."""
+        conf = conf or {}
+        if conf == self.conf: return self.enabled
+        self.conf = dict(conf)
+        self.enabled = bool(conf.get("enabled", False))
+        self.max_entries = max(1, int(conf.get("max_entries", 512)))
+        self.ttl = float(conf.get("ttl_seconds", 900))
+        self.max_distance = max(0, int(conf.get("max_distance", 4)))
+        persist_path = conf.get("persist_path")
+        if persist_path and not os.path.isabs(persist_path):
+            # Relative to the user's config folder, the package folder may be read-only
+            persist_path = os.path.join(os.path.dirname(os.path.abspath(CONFIG_FILE)), persist_path)
+        if persist_path != self.persist_path:
+            self.persist_path = persist_path
+            if persist_path: self.load()
+        self._evict()
+        return self.enabled
+
+    def make_key(self, frame, tool_name, context, system_prompt):
+        text = "\x00".join([tool_name, normalize_cache_text(system_prompt), normalize_cache_text(context)])
+        text_key = hashlib.sha1(text.encode("utf-8")).hexdigest()
+        phash = frame_phash(frame)
+        if phash is None:
+            # No perceptual hash available: fall back to exact frame matches
+            text_key = hashlib.sha1(text_key.encode("utf-8") + frame.content).hexdigest()
+            phash = 0
+        return text_key, phash
+
+    async def lookup(self, key):
+        text_key, phash = key
+        now = time.time()
+        match = key if key in self.entries else None
+        if match is None and self.max_distance > 0:
+            best = self.max_distance + 1
+            for candidate in self.by_text.get(text_key, ()):
+                distance = bin(candidate ^ phash).count("1")
+                if distance < best: best, match = distance, (text_key, candidate)
+        if match is not None:
+            action, created_at = self.entries[match]
+            if now - created_at <= self.ttl:
+                self.entries.move_to_end(match)
+                self.hits += 1
+                return json.loads(json.dumps(action)) # callers may mutate the returned dict
+            self._remove(match)
+        if state_store:
+            candidates = await asyncio.to_thread(state_store.cache_candidates, text_key, now - self.ttl)
+            shared = self._lookup_shared(text_key, phash, candidates)
+            if shared is not None: return shared
+        self.misses += 1
+        return None
+
+    def _lookup_shared(self, text_key, phash, candidates):
+        """Entries stored by other workers (or earlier runs) under the same text key."""
+        best, found = self.max_distance + 1, None
+        for candidate, action, created_at in candidates:
+            distance = bin(candidate ^ phash).count("1")
+            if distance < best: best, found = distance, (candidate, action, created_at)
+        if found is None: return None
+        candidate, action, created_at = found
+        self.entries[(text_key, candidate)] = (action, created_at)
+        self.by_text.setdefault(text_key, set()).add(candidate)
+        self._evict()
+        self.hits += 1
+        return json.loads(json.dumps(action))
+
+    def store(self, key, action):
+        self.entries[key] = (action, time.time())
+        self.entries.move_to_end(key)
+        self.by_text.setdefault(key[0], set()).add(key[1])
+        self._evict()
+        self.dirty = True
+        if state_store:
+            state_store.cache_put(key[0], key[1], action, self.entries[key][1])
+            self.shared_puts += 1
+            if self.shared_puts % CACHE_TRIM_EVERY == 0: state_store.cache_trim(self.max_entries, self.ttl)
+        if self.persist_path and time.time() - self.last_save > CACHE_SAVE_INTERVAL: self.save()
+
+    def clear(self):
+        self.entries.clear()
+        self.by_text.clear()
+        self.dirty = True
+        if state_store: state_store.cache_clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "persist_path": self.persist_path,
+            "shared": state_store is not None
+        }
+
+    def _remove(self, key):
+        self.entries.pop(key, None)
+        phashes = self.by_text.get(key[0])
+        if phashes:
+            phashes.discard(key[1])
+            if not phashes: del self.by_text[key[0]]
+
+    def _evict(self):
+        now = time.time()
+        for key in [k for k, (_, created_at) in self.entries.items() if now - created_at > self.ttl]:
+            self._remove(key)
+        while len(self.entries) > self.max_entries:
+            self._remove(next(iter(self.entries)))
+
+    def load(self):
+        if not self.persist_path or not os.path.exists(self.persist_path): return
+        try:
+            with open(self.persist_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            for item in data.get("entries", []):
+                key = (item["text_key"], int(item["phash"]))
+                self.entries[key] = (item["action"], float(item["created_at"]))
+                self.by_text.setdefault(key[0], set()).add(key[1])
+            self._evict()
+            log(f"[Cache] Loaded {len(self.entries)} entries from {self.persist_path}")
+        except Exception as e: log(f"[Error] Cache load: {e}", level="error")
+
+    def save(self):
+        if not self.persist_path or not self.dirty: return
+        data = {"entries": [
+            {"text_key": k[0], "phash": k[1], "created_at": created_at, "action": action}
+            for k, (action, created_at) in self.entries.items()
+        ]}
+        try:
+            tmp_path = self.persist_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f: json.dump(data, f)
+            os.replace(tmp_path, self.persist_path)
+            self.dirty = False
+            self.last_save = time.time()
+        except Exception as e: log(f"[Error] Cache save: {e}", level="error")
+
+response_cache = ResponseCache()
+
+# --- Trace Recording ---
+class TraceRecorder:
+    """Records /ask exchanges into a trace_store directory (one per server run) when the
+    "trace" config block is enabled. Writes happen on the store's own thread."""
+    def __init__(self):
+        self.conf = None
+        self.enabled = False
+        self.writer = None
+
+    def apply_config(self, conf):
+        conf = conf or {}
+        if conf == self.conf: return self.enabled
+        self.conf = dict(conf)
+        self.enabled = bool(conf.get("enabled", False))
+        root = conf.get("dir", "traces~") # trailing ~: ignored by the Unity asset importer
+        if not os.path.isabs(root):
+            root = os.path.join(os.path.dirname(os.path.abspath(CONFIG_FILE)), root)
+        directory = self.writer.directory if self.writer else None
+        if self.enabled and (directory is None or os.path.dirname(directory) != root):
+            self.close()
+            run_name = time.strftime("%Y%m%d-%H%M%S") + (f"-w{WORKER_ID}" if WORKER_ID is not None else "")
+            directory = os.path.join(root, run_name)
+            self.writer = TraceWriter(directory, max_bytes=int(float(conf.get("max_mb", 1024)) * 1024 * 1024))
+            log(f"[Trace] Recording to {directory}")
+        elif self.writer:
+            self.writer.max_bytes = int(float(conf.get("max_mb", 1024)) * 1024 * 1024)
+        return self.enabled
+
+    def record(self, session_id, content, context, timer, action, err):
+        if not self.enabled or not self.writer: return
+        header = {
+            "time": time.time(),
+            "session_id": session_id,
+            "tool": timer.tool,
+            "route": timer.route,
+            "context": context,
+            "raw_output": timer.raw_output,
+            "action": action,
+            "ok": err is None,
+            "error": err,
+            "elapsed_ms": round(timer.elapsed() * 1000, 1),
+            "stages_ms": {stage: round(seconds * 1000, 2) for stage, seconds in timer.stages.items()},
+            "frame_mime": "image/png" if content.startswith(b"\x89PNG") else "image/jpeg"
+        }
+        if not self.writer.record(header, content) and self.writer.dropped % 100 == 1:
+            log(f"[Trace] Dropped {self.writer.dropped} record(s) (writer behind or max_mb reached).", level="warning")
+
+    def stats(self):
+        if not self.writer: return {"enabled": self.enabled}
+        return {"enabled": self.enabled, "dir": self.writer.directory, "recorded": self.writer.recorded,
+                "dropped": self.writer.dropped, "bytes": self.writer.offset}
+
+    def close(self):
+        if self.writer:
+            self.writer.close()
+            self.writer = None
+
+trace_recorder = TraceRecorder()
+
+# --- Speculative Think-Ahead ---
+SPECULATION_PRIORITY = -10 # behind interactive requests (priority 0) in the rate scheduler
+
+class Speculation:
+    """A backend request running ahead for the frame a client expects to send next."""
+    def __init__(self, tool_name, system_prompt, context, phash, task):
+        self.tool_name = tool_name
+        self.system_prompt = system_prompt
+        self.context = context # normalized
+        self.phash = phash
+        self.task = task
+        self.started = time.perf_counter()
+        self.finished = None
+        task.add_done_callback(self._done)
+
+    def _done(self, task):
+        self.finished = time.perf_counter()
+
+    def saved(self, arrival):
+        """Backend time an /ask arriving at `arrival` no longer has to wait for."""
+        return min(arrival, self.finished or arrival) - self.started
+
+class Speculator:
+    """Serves POST /speculate: a client that has just executed an action sends the resulting frame,
+    and the selected tool starts working on it while the game runs the action's delay. The session's
+    next /ask takes that answer if its frame is within max_distance bits (perceptual hash) of the
+    speculated one and its context is the same; otherwise the speculative request is cancelled.
+
+    Only stateless routes (and races of them) are speculated, so a chat history or a CLI process
+    never sees a step that may be thrown away."""
+    def __init__(self):
+        self.conf = None
+        self.enabled = False
+        self.max_distance = 4
+        self.ttl = 30.0
+        self.match_context = True
+
+    def apply_config(self, conf):
+        """Sync settings with the "speculation" config block. Returns True if speculation is enabled."""
+        conf = conf or {}
+        if conf == self.conf: return self.enabled
+        self.conf = dict(conf)
+        self.enabled = bool(conf.get("enabled", False))
+        self.max_distance = max(0, int(conf.get("max_distance", 4)))
+        self.ttl = float(conf.get("ttl_seconds", 30))
+        self.match_context = bool(conf.get("match_context", True))
+        return self.enabled
+
+    async def start(self, session, content, context, api_key):
+        """Start speculating on a frame. Returns a status string for the client."""
+        snapshot = config_registry.current()
+        config = snapshot.config
+        if not config: return "no_config"
+        if not self.apply_config(config.get("speculation")): return "disabled"
+        tool_name = config.get("selected_tool", "gemini_cli")
+        spec = snapshot.tools.get(tool_name)
+        if not spec or not is_stateless(spec): return "unsupported_tool"
+
+        self.discard(session, "superseded")
+        frame = Frame(content, os.path.splitext(session.frame_path)[0] + "_speculative.jpg")
+        phash = await asyncio.to_thread(frame_phash, frame)
+        if phash is None: return "unsupported_frame"
+        task = asyncio.create_task(self.run(session, spec, snapshot.system_prompt, frame, context, api_key))
+        session.speculation = Speculation(tool_name, snapshot.system_prompt, normalize_cache_text(context), phash, task)
+        metrics.inc("aitester_speculations_total", outcome="started")
+        log(f"[Speculate] Started '{tool_name}' ahead for session '{session.session_id}'", level="debug")
+        return "started"
+
+    async def run(self, session, spec, system_prompt, frame, context, api_key):
+        timer = StageTimer()
+        timer.tool, timer.route, timer.priority = spec.name, spec.route, SPECULATION_PRIORITY
+        current_timer.set(timer) # this task's own context; the /ask that takes the result is timed separately
+        action, err = await run_tool(session, spec, context, system_prompt, frame, api_key)
+        return (normalize_response(action), None) if action and not err else (None, err)
+
+    def discard(self, session, outcome):
+        speculation, session.speculation = session.speculation, None
+        if speculation is None: return
+        speculation.task.cancel()
+        metrics.inc("aitester_speculations_total", outcome=outcome)
+        log(f"[Speculate] Discarded for session '{session.session_id}': {outcome}", level="debug")
+
+    async def take(self, session, tool_name, system_prompt, frame, context):
+        """The speculated action if it fits this /ask, else None (and the speculation is discarded)."""
+        speculation = session.speculation
+        if speculation is None: return None
+        arrival = time.perf_counter()
+        if tool_name != speculation.tool_name or system_prompt != speculation.system_prompt: outcome = "config_changed"
+        elif arrival - speculation.started > self.ttl: outcome = "expired"
+        elif self.match_context and normalize_cache_text(context) != speculation.context: outcome = "context_changed"
+        else:
+            phash = await asyncio.to_thread(frame_phash, frame)
+            outcome = "frame_changed" if phash is None or bin(phash ^ speculation.phash).count("1") > self.max_distance else None
+        if outcome:
+            self.discard(session, outcome)
+            return None
+
+        session.speculation = None
+        with timed_stage("speculation_wait"):
+            try: action, err = await speculation.task
+            except Exception as e: action, err = None, str(e)
+        if err or not action:
+            metrics.inc("aitester_speculations_total", outcome="failed")
+            log(f"[Speculate] Speculative request failed, asking again: {str(err)[:100]}", level="debug")
+            return None
+        saved = speculation.saved(arrival)
+        metrics.inc("aitester_speculations_total", outcome="hit")
+        metrics.inc("aitester_speculation_saved_seconds_total", round(saved, 3))
+        log(f"[Speculate] Hit for session '{session.session_id}' ({saved * 1000:.0f} ms of backend time saved)", level="debug")
+        return action
+
+speculator = Speculator()
+
+BATCH_MAX_CONCURRENCY = 8
+batch_limiter = None
+
+def get_batch_limiter(config):
+    """Global cap on concurrently processed /ask_batch items ("batch_concurrency" in the config)."""
+    global batch_limiter
+    max_concurrency = max(1, int((config or {}).get("batch_concurrency", BATCH_MAX_CONCURRENCY)))
+    if batch_limiter is None or batch_limiter.max_concurrency != max_concurrency:
+        batch_limiter = ToolLimiter(max_concurrency)
+    return batch_limiter
+
+# --- Metrics (Prometheus text format on /metrics) ---
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound: self.counts[i] += 1
+
+class MetricsRegistry:
+    def __init__(self):
+        self.help = {}
+        self.histograms = {} # (name, labels) -> Histogram
+        self.counters = {} # (name, labels) -> float
+        self.collectors = [] # callables yielding (name, labels, value) gauges at scrape time
+
+    def describe(self, name, kind, text):
+        self.help[name] = (kind, text)
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        hist = self.histograms.get(key)
+        if hist is None: hist = self.histograms[key] = Histogram()
+        hist.observe(value)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def render(self):
+        series = {}
+        for (name, labels), value in self.counters.items():
+            series.setdefault(name, []).append(f"{name}{_format_labels(labels)} {value}")
+        for (name, labels), hist in self.histograms.items():
+            lines = series.setdefault(name, [])
+            for bound, count in zip(hist.buckets, hist.counts):
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', repr(bound)),))} {count}")
+            lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {hist.count}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {hist.sum:.6f}")
+            lines.append(f"{name}_count{_format_labels(labels)} {hist.count}")
+        for collect in self.collectors:
+            for name, labels, value in collect():
+                series.setdefault(name, []).append(f"{name}{_format_labels(tuple(sorted(labels.items())))} {value}")
+
+        out = []
+        for name in sorted(series):
+            kind, text = self.help.get(name, ("untyped", name))
+            out.append(f"# HELP {name} {text}")
+            out.append(f"# TYPE {name} {kind}")
+            out.extend(series[name])
+        return "\n".join(out) + "\n"
+
+def _format_labels(labels):
+    if not labels: return ""
+    escaped = [(k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for k, v in labels]
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+metrics = MetricsRegistry()
+metrics.describe("aitester_request_seconds", "histogram", "End-to-end /ask processing time per tool and route.")
+metrics.describe("aitester_stage_seconds", "histogram", "Time spent in each request stage.")
+metrics.describe("aitester_requests_total", "counter", "Processed requests by outcome.")
+metrics.describe("aitester_context_steps_total", "counter", "Stateful-backend steps sent with the full context or a delta.")
+metrics.describe("aitester_context_chars_saved_total", "counter", "Context characters not sent thanks to delta encoding.")
+metrics.describe("aitester_native_early_actions_total", "counter", "Streamed native answers returned before the model finished.")
+metrics.describe("aitester_rate_limited_total", "counter", "Quota errors (429) per rate limit bucket.")
+metrics.describe("aitester_speculations_total", "counter", "Speculative requests by outcome (started, hit, frame_changed, context_changed, ...).")
+metrics.describe("aitester_speculation_saved_seconds_total", "counter", "Backend time hits saved: from the speculation's start until its /ask arrived or it finished, whichever came first.")
+metrics.describe("aitester_image_bytes_in_total", "counter", "Frame bytes received per tool with an image stage.")
+metrics.describe("aitester_image_bytes_out_total", "counter", "Frame bytes sent on to the backend after the image stage.")
+metrics.describe("aitester_race_wins_total", "counter", "Race tool answers by winning member tool.")
+metrics.describe("aitester_errors_total", "counter", "Failed requests by error type.")
+
+current_timer = contextvars.ContextVar("current_timer", default=None)
+
+class StageTimer:
+    """Stage timings of one request. Code deeper in the call chain reaches it through timed_stage()."""
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.tool = "none"
+        self.route = "none"
+        self.raw_output = None # backend answer before JSON extraction, kept for traces
+        self.on_thought = None # set by WebSocket clients to receive partial thoughts
+        self.priority = 0 # higher runs first when a rate limit makes requests queue
+        self.last_thought = None
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try: yield
+        finally: self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def member(self):
+        """Context for one member of a race: the request's priority and thought push, but stage
+        timings of its own, since members overlap and only the race as a whole is timed."""
+        timer = StageTimer()
+        timer.tool, timer.route = self.tool, self.route
+        timer.priority, timer.on_thought = self.priority, self.on_thought
+        return timer
+
+    def report_thought(self, text):
+        if self.on_thought and text and text != self.last_thought:
+            self.last_thought = text
+            self.on_thought(text)
+
+def timed_stage(name):
+    timer = current_timer.get()
+    return timer.stage(name) if timer else nullcontext()
+
+def extract_backend_json(raw):
+    """extract_json() for a backend answer, timed as json_extract; the raw text is kept for traces."""
+    timer = current_timer.get()
+    if timer: timer.raw_output = raw if isinstance(raw, str) else json.dumps(raw)
+    with timed_stage("json_extract"): return extract_json(raw)
+
+PARTIAL_THOUGHT = re.compile(r'"thought"\s*:\s*"((?:[^"\\]|\\.)*)')
+
+def partial_thought(text):
+    """The "thought" string of a JSON answer that may still be arriving, or None."""
+    match = PARTIAL_THOUGHT.search(text)
+    if not match: return None
+    raw = match.group(1)
+    for candidate in (raw, raw[:raw.rfind("\\")]): # drop an escape sequence cut off mid-way
+        try: return json.loads(f'"{candidate}"')
+        except ValueError: continue
+    return None
+
+def classify_error(err):
+    text = err.lower()
+    if text.startswith("rate limited"): return "rate_limited"
+    if "disconnected" in text: return "client_disconnected"
+    if "timeout" in text or "timed out" in text: return "timeout"
+    if "parse error" in text: return "parse_error"
+    if "sdk error" in text or "api key" in text: return "sdk_error"
+    if text.startswith("http "): return "http_error"
+    if "busy" in text: return "queue_full"
+    if "config" in text or "not defined" in text: return "config_error"
+    if "process" in text or "stderr" in text: return "process_error"
+    return "other"
+
+def record_request(timer, err):
+    labels = {"tool": timer.tool, "route": timer.route}
+    metrics.observe("aitester_request_seconds", timer.elapsed(), **labels)
+    for stage, seconds in timer.stages.items():
+        metrics.observe("aitester_stage_seconds", seconds, stage=stage, **labels)
+    metrics.inc("aitester_requests_total", outcome="error" if err else "ok", **labels)
+    if err: metrics.inc("aitester_errors_total", type=classify_error(err), **labels)
+    ms = round(timer.elapsed() * 1000)
+    if err: log(f"[Bridge] Request failed: {err[:200]}", level="warning", ms=ms, **labels)
+    else: log("[Bridge] Request done", level="debug", ms=ms, **labels)
+
+def collect_bridge_gauges():
+    yield "aitester_ready", {}, int(warmup.ready)
+    yield "aitester_warmup_seconds", {}, round(warmup.seconds, 3)
+    yield "aitester_active_sessions", {}, len(session_manager.sessions)
+    yield "aitester_cache_entries", {}, len(response_cache.entries)
+    yield "aitester_cache_hits_total", {}, response_cache.hits
+    yield "aitester_cache_misses_total", {}, response_cache.misses
+    for tool_name, limiter in oneshot_limiters.limiters.items():
+        yield "aitester_oneshot_active", {"tool": tool_name}, limiter.active
+        yield "aitester_oneshot_queue_depth", {"tool": tool_name}, limiter.waiting
+    for bucket in rate_scheduler.buckets.values():
+        yield "aitester_rate_queue_depth", {"bucket": bucket.label}, bucket.queue_depth()
+        yield "aitester_rate_current_rpm", {"bucket": bucket.label}, round(bucket.rate * 60, 2)
+    for tool_name, pool in worker_pool_manager.pools.items():
+        states = {"busy": 0, "idle": 0, "dead": 0}
+        for w in pool.workers:
+            states["dead" if not w.is_alive() else "busy" if w.busy else "idle"] += 1
+        for state, count in states.items():
+            yield "aitester_pool_workers", {"tool": tool_name, "state": state}, count
+
+metrics.describe("aitester_ready", "gauge", "1 once startup warmup has finished.")
+metrics.describe("aitester_warmup_seconds", "gauge", "Time the startup warmup took.")
+metrics.describe("aitester_active_sessions", "gauge", "Sessions currently held by the bridge.")
+metrics.describe("aitester_cache_entries", "gauge", "Entries in the response cache.")
+metrics.describe("aitester_cache_hits_total", "counter", "Response cache hits.")
+metrics.describe("aitester_cache_misses_total", "counter", "Response cache misses.")
+metrics.describe("aitester_oneshot_active", "gauge", "Running oneshot processes per tool.")
+metrics.describe("aitester_oneshot_queue_depth", "gauge", "Oneshot requests waiting for a slot per tool.")
+metrics.describe("aitester_rate_queue_depth", "gauge", "Requests waiting for a rate limit token per bucket.")
+metrics.describe("aitester_rate_current_rpm", "gauge", "Current allowed requests per minute per bucket (0 = unlimited).")
+metrics.describe("aitester_pool_workers", "gauge", "Persistent workers per tool and state.")
+metrics.collectors.append(collect_bridge_gauges)
+
+DISCONNECT_POLL_INTERVAL = 0.5
+
+async def cancel_on_disconnect(request, coro):
+    """Run an (action, err) coroutine, cancelling it (and any subprocess it owns) if the HTTP client goes away."""
+    task = asyncio.ensure_future(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_INTERVAL)
+            if done: return task.result()
+            if await request.is_disconnected():
+                log("[Bridge] Client disconnected, cancelling request.", level="warning")
+                task.cancel()
+                return None, "Client disconnected."
+    finally:
+        if not task.done(): task.cancel()
+
+WARMUP_SAMPLE = '{"thought": "warmup", "actionType": "Click", "screenPosition": {"x": 0.5, "y": 0.5}}'
+
+class Warmup:
+    """Startup work done after the port is open, so a restarting editor can connect at once;
+    /health reports ready when it has finished.
+
+    Persistent workers of the selected tool (or the persistent members of a race) are always
+    pre-spawned. With "prewarm": true in the config the selected engines are built too (SDK
+    import and model, HTTP client, Pillow) and a canned answer runs through the parsers, so
+    the first /ask pays none of that."""
+    def __init__(self):
+        self.ready = False
+        self.seconds = 0.0
+        self.errors = []
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    def stop(self):
+        if self.task: self.task.cancel()
+
+    async def run(self):
+        started = time.perf_counter()
+        snapshot = config_registry.current()
+        prewarm = bool((snapshot.config or {}).get("prewarm", False))
+        spec = snapshot.tools.get((snapshot.config or {}).get("selected_tool"))
+        try:
+            if spec:
+                for member in (spec.members if spec.route == "race" else [spec]):
+                    await self.warm_tool(member, prewarm)
+            if prewarm:
+                await asyncio.to_thread(load_pil)
+                self.dry_run()
+        except Exception as e:
+            self.errors.append(f"dry run: {e}")
+            log(f"[Warmup] Dry run failed: {e}", level="error")
+        finally:
+            self.seconds = time.perf_counter() - started
+            self.ready = True
+        log(f"[Warmup] Ready in {self.seconds * 1000:.0f} ms" + (" (prewarmed)" if prewarm else ""),
+            level="warning" if self.errors else "info")
+
+    async def warm_tool(self, spec, prewarm):
+        try:
+            if spec.route == "persistent":
+                await worker_pool_manager.get_pool(spec.name, spec.conf)
+            elif prewarm and spec.route in ("native", "native_chat"):
+                sdk_module = spec.conf.get("sdk_module") or DEFAULT_GENAI_MODULE
+                await asyncio.to_thread(native_engine.clients.load_sdk, sdk_module) # the slow part, off the event loop
+                api_key = resolve_api_key(None, spec.conf)
+                if api_key: native_engine.clients.get(api_key, spec.conf.get("model_name", "gemini-3-flash-preview"), sdk_module)
+            elif prewarm and spec.route == "http":
+                http_engine.get_client()
+        except Exception as e:
+            self.errors.append(f"{spec.name}: {e}")
+            log(f"[Warmup] Failed to warm '{spec.name}': {e}", level="error")
+
+    def dry_run(self):
+        """Parse a canned answer the way a real one is parsed (one-shot and streamed)."""
+        parser = StreamingActionParser()
+        parser.feed(WARMUP_SAMPLE)
+        ActionResponse(**normalize_response(parser.action()))
+        ActionResponse(**normalize_response(extract_json(f"```json\n{WARMUP_SAMPLE}\n```")))
+
+warmup = Warmup()
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -216,9 +1952,22 @@ async def lifespan(app: FastAPI):
     log(f"--- Starting AI Unity Server on port {PORT} ---")
     log(f"Config: {CONFIG_FILE}")
     log(f"Prompt: {SYSTEM_PROMPT_FILE}")
+    sweeper = asyncio.create_task(session_manager.sweep_loop())
+    health = asyncio.create_task(worker_pool_manager.health_loop())
+    warmup.start()
     yield
     # Shutdown logic
+    warmup.stop()
+    sweeper.cancel()
+    health.cancel()
+    await worker_pool_manager.stop_all()
+    await http_engine.close()
+    session_manager.drop_all()
+    response_cache.save()
+    trace_recorder.close()
+    if state_store: await asyncio.to_thread(state_store.close) # runs the writes still queued
     log("--- Stopping AI Unity Server ---")
+    logger.close()
 
 app = FastAPI(lifespan=lifespan)
 
@@ -259,26 +2008,132 @@ def normalize_response(data: dict) -> dict:
 
     return data
 
+class BatchItemResult(BaseModel):
+    index: int
+    session_id: str
+    ok: bool
+    action: ActionResponse # failed items carry the usual Wait error action
+    error: str = ""
+
+class BatchResponse(BaseModel):
+    results: List[BatchItemResult]
+
 class HealthResponse(BaseModel):
     status: str
+    ready: bool = True
     config_loaded: bool
     selected_tool: str
+    active_sessions: int = 0
+    config_error: str = ""
+    warmup_ms: float = 0.0
+    warmup_errors: List[str] = []
 
-def load_config():
-    if os.path.exists(CONFIG_FILE):
-        try:
-            with open(CONFIG_FILE, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except Exception as e: log(f"[Error] Config: {e}")
-    return None
+DEFAULT_SYSTEM_PROMPT = "You are a QA agent. Respond in JSON format only."
+TOOL_PLACEHOLDERS = re.compile(r"\{(image_path|image_base64|context|system_prompt)\}")
+
+class ArgTemplate:
+    """Argument list split once into literals and placeholders, so rendering is a join instead of repeated str.replace."""
+    def __init__(self, args):
+        self.parts = [TOOL_PLACEHOLDERS.split(arg) for arg in args] # odd indexes are placeholder names
+        self.fields = {name for parts in self.parts for name in parts[1::2]}
+
+    def render(self, values):
+        # Placeholders without a value (e.g. {image_path} when not spilled) stay as written
+        return ["".join(values.get(part, "{" + part + "}") if i % 2 else part for i, part in enumerate(parts))
+                for parts in self.parts]
+
+class ToolSpec:
+    """A validated tools_config.json entry. `conf` is the raw dict the routes read their options from."""
+    NUMERIC_FIELDS = ("timeout", "pool_size", "max_concurrency", "max_queue", "hedge_delay")
+
+    def __init__(self, name, conf):
+        if not isinstance(conf, dict): raise ValueError("entry must be an object")
+        if not isinstance(conf.get("command"), str) or not conf["command"]: raise ValueError("'command' is required")
+        for field in self.NUMERIC_FIELDS:
+            if field in conf and not isinstance(conf[field], (int, float)): raise ValueError(f"'{field}' must be a number")
+        self.name = name
+        self.conf = conf
+        self.route = tool_route(conf)
+        self.args = None
+        self.members = [] # resolved ToolSpecs of a race tool
+        if self.route == "http" and not conf.get("url"): raise ValueError("http tools need a 'url'")
+        if self.route == "race" and not isinstance(conf.get("tools"), list): raise ValueError("race tools need a 'tools' list")
+        if self.route in ("oneshot", "persistent"):
+            args = conf.get("arguments", [])
+            if not isinstance(args, list) or not all(isinstance(arg, str) for arg in args):
+                raise ValueError("'arguments' must be a list of strings")
+            self.args = ArgTemplate(args)
+        self.image = ImageStage(conf["image"]) if conf.get("image") and self.route != "race" else None # race members use their own
+
+class ConfigSnapshot:
+    """One consistent view of the config file and system prompt; replaced as a whole on reload."""
+    def __init__(self, config, system_prompt, config_error=""):
+        self.config = config
+        self.system_prompt = system_prompt
+        self.config_error = config_error
+        self.tools = {}
+        self.tool_errors = {}
+        for name, conf in (config or {}).get("tools", {}).items():
+            try: self.tools[name] = ToolSpec(name, conf)
+            except ValueError as e: self.tool_errors[name] = str(e)
+        for spec in self.tools.values():
+            if spec.route != "race": continue
+            for member in spec.conf["tools"]:
+                member_spec = self.tools.get(member)
+                if member_spec and member_spec.route != "race": spec.members.append(member_spec)
+                else: log(f"[Config] Race tool '{spec.name}': skipping member '{member}' (not defined, invalid or nested race).", level="warning")
+        for name, err in self.tool_errors.items():
+            log(f"[Config] Tool '{name}' is invalid: {err}", level="warning")
+
+class ConfigRegistry:
+    """Caches tools_config.json and system_prompt.txt, re-reading them only when their mtime or size changes.
 
-def load_system_prompt():
-    if os.path.exists(SYSTEM_PROMPT_FILE):
+    A file that fails to parse keeps the previous snapshot serving, with the error reported on /health."""
+    def __init__(self):
+        self.snapshot = ConfigSnapshot(None, DEFAULT_SYSTEM_PROMPT)
+        self._signature = None
+
+    def _file_signature(self, path):
         try:
-            with open(SYSTEM_PROMPT_FILE, "r", encoding="utf-8") as f:
-                return f.read().strip()
-        except Exception as e: log(f"[Error] Prompt: {e}")
-    return "You are a QA agent. Respond in JSON format only."
+            stat = os.stat(path)
+            return (path, stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            return (path, None, None)
+
+    def current(self):
+        signature = (self._file_signature(CONFIG_FILE), self._file_signature(SYSTEM_PROMPT_FILE))
+        if signature != self._signature:
+            self.snapshot = self._load(signature)
+            self._signature = signature
+        return self.snapshot
+
+    def _load(self, signature):
+        old = self.snapshot
+        config, config_error = None, ""
+        if signature[0][1] is not None:
+            try:
+                with open(CONFIG_FILE, "r", encoding="utf-8") as f: config = json.load(f)
+                if not isinstance(config, dict): raise ValueError("top level must be an object")
+                log(f"[Config] Loaded {CONFIG_FILE}")
+            except Exception as e:
+                config_error = f"Config: {e}"
+                log(f"[Error] {config_error} (keeping previous config)", level="error")
+                config = old.config
+        system_prompt = DEFAULT_SYSTEM_PROMPT
+        if signature[1][1] is not None:
+            try:
+                with open(SYSTEM_PROMPT_FILE, "r", encoding="utf-8") as f: system_prompt = f.read().strip()
+            except Exception as e:
+                log(f"[Error] Prompt: {e} (keeping previous prompt)", level="error")
+                system_prompt = old.system_prompt
+        if config is old.config and system_prompt == old.system_prompt and config_error == old.config_error:
+            return old
+        return ConfigSnapshot(config, system_prompt, config_error)
+
+config_registry = ConfigRegistry()
+
+def load_config():
+    return config_registry.current().config
 
 def extract_json(text):
     if not text: return None
@@ -295,6 +2150,159 @@ def extract_json(text):
     except: pass
     return None
 
+ANSI_MAX_LEN = 32 # longest escape sequence held back while the rest of it is still arriving
+
+def strip_ansi_chunk(pending, chunk):
+    """(clean text, new pending) for one chunk of a stream. An escape sequence cut off at the end
+    of the chunk is held back and completed by the next one."""
+    text = pending + chunk
+    pending = ""
+    esc = text.rfind("\x1b")
+    if esc != -1 and len(text) - esc < ANSI_MAX_LEN and not ANSI_ESCAPE.match(text, esc):
+        text, pending = text[:esc], text[esc:]
+    return ANSI_ESCAPE.sub('', text), pending
+
+class StreamingJsonExtractor:
+    """Incremental version of extract_json for streamed CLI output.
+
+    Chunks are ANSI-stripped as they arrive (an escape sequence split across chunks is held back)
+    and scanned once for brace depth and string state, so the first complete JSON object is
+    returned as soon as its closing brace arrives. Cost is linear in the output size.
+    """
+    SIGNIFICANT = re.compile(r'[{}"\\]')
+
+    def __init__(self):
+        self.clean_chunks = []
+        self.pending = "" # trailing, possibly incomplete escape sequence
+        self.object_parts = [] # text of the object being scanned, from earlier chunks
+        self.depth = 0
+        self.in_string = False
+        self.skip_next = False # previous chunk ended with a backslash inside a string
+
+    def feed(self, chunk):
+        clean, self.pending = strip_ansi_chunk(self.pending, chunk)
+        if not clean: return None
+        self.clean_chunks.append(clean)
+        return self._scan(clean)
+
+    def text(self):
+        return "".join(self.clean_chunks) + self.pending
+
+    def _scan(self, clean):
+        start = 0 if self.depth > 0 else None
+        skip_pos = 0 if self.skip_next else -1
+        self.skip_next = False
+        for match in self.SIGNIFICANT.finditer(clean):
+            pos = match.start()
+            if pos == skip_pos: continue
+            char = match.group()
+            if self.in_string:
+                if char == "\\":
+                    skip_pos = pos + 1
+                    if skip_pos == len(clean): self.skip_next = True
+                elif char == '"':
+                    self.in_string = False
+            elif self.depth == 0:
+                if char == "{":
+                    self.depth, start = 1, pos
+                    self.object_parts = []
+            elif char == '"':
+                self.in_string = True
+            elif char == "{":
+                self.depth += 1
+            elif char == "}":
+                self.depth -= 1
+                if self.depth == 0:
+                    candidate = "".join(self.object_parts) + clean[start:pos + 1]
+                    self.object_parts = []
+                    try:
+                        parsed = json.loads(candidate)
+                        if isinstance(parsed, dict): return parsed
+                    except ValueError: pass # TUI noise that merely looked like an object
+        if self.depth > 0:
+            self.object_parts.append(clean[start:])
+        return None
+
+# Fields each action type needs before a streamed answer can be acted on
+ACTION_REQUIRED_FIELDS = {
+    "click": ("screenPosition",),
+    "drag": ("screenPosition", "targetPosition"),
+    "keypress": ("keyName",),
+    "type": ("textToType",),
+    "wait": ("duration",)
+}
+
+class StreamingActionParser:
+    """Collects the top-level members of a JSON answer while it streams in.
+
+    A member is parsed as soon as the comma or closing brace after it arrives, so the action is
+    known once actionType and the fields that type needs are complete, usually well before a
+    long "thought" (or the rest of the object) has finished generating. ANSI sequences are
+    stripped as they arrive, and a brace pair without any "key": value member is skipped as noise.
+    """
+    SIGNIFICANT = re.compile(r'[{}\[\]",\\]')
+
+    def __init__(self):
+        self.pending = "" # trailing, possibly incomplete escape sequence
+        self.text_so_far = ""
+        self.scanned = 0
+        self.depth = 0
+        self.in_string = False
+        self.skip_pos = -1 # character escaped by a backslash
+        self.member_start = None
+        self.fields = {}
+        self.closed = False
+
+    def feed(self, chunk):
+        if not chunk or self.closed: return
+        chunk, self.pending = strip_ansi_chunk(self.pending, chunk)
+        self.text_so_far += chunk
+        text = self.text_so_far
+        for match in self.SIGNIFICANT.finditer(text, self.scanned):
+            pos, char = match.start(), match.group()
+            if pos == self.skip_pos: continue
+            if self.in_string:
+                if char == "\\": self.skip_pos = pos + 1
+                elif char == '"': self.in_string = False
+            elif char == '"':
+                if self.depth > 0: self.in_string = True
+            elif char in "{[":
+                self.depth += 1
+                if self.depth == 1 and char == "{": self.member_start = pos + 1
+            elif char in "}]":
+                self.depth -= 1
+                if self.depth == 0 and self.member_start is not None:
+                    self._member(text[self.member_start:pos])
+                    if not self.fields: # e.g. "{spinner}" before the answer
+                        self.member_start = None
+                        continue
+                    self.closed = True
+                    break
+            elif char == "," and self.depth == 1:
+                self._member(text[self.member_start:pos])
+                self.member_start = pos + 1
+        self.scanned = len(text)
+
+    def _member(self, text):
+        try: self.fields.update(json.loads("{" + text + "}"))
+        except ValueError: pass # not a clean "key": value pair (e.g. a stray markdown fence)
+
+    def text(self):
+        return self.text_so_far + self.pending
+
+    def action(self):
+        """The action as soon as it is actionable, else None. "thought" may still be partial."""
+        fields = self.fields
+        action_type = fields.get("actionType", fields.get("action"))
+        if not isinstance(action_type, str): return None
+        required = ACTION_REQUIRED_FIELDS.get(action_type.lower())
+        if required is None and not self.closed: return None # unknown type: wait for the whole object
+        if not self.closed and any(name not in fields and not (name == "screenPosition" and "position" in fields) for name in required):
+            return None
+        action = dict(fields)
+        if "thought" not in action: action["thought"] = partial_thought(self.text_so_far) or ""
+        return action
+
 def create_error_response(msg):
     return {
         "thought": f"Error: {msg}",
@@ -306,255 +2314,842 @@ def create_error_response(msg):
         "duration": 2.0
     }
 
-@app.on_event("shutdown")
-def shutdown_event():
-    pass # No persistent processes to stop
-
 @app.get("/health", response_model=HealthResponse)
 async def health_check():
-    config = load_config()
+    snapshot = config_registry.current()
+    config = snapshot.config
     return {
-        "status": "running",
+        "status": "running" if warmup.ready else "starting",
+        "ready": warmup.ready,
         "config_loaded": config is not None,
-        "selected_tool": config.get("selected_tool", "none") if config else "none"
+        "selected_tool": config.get("selected_tool", "none") if config else "none",
+        "active_sessions": len(session_manager.sessions),
+        "config_error": snapshot.config_error,
+        "warmup_ms": round(warmup.seconds * 1000, 1),
+        "warmup_errors": warmup.errors
     }
 
 @app.post("/reset")
-async def reset_service():
-    # process_manager.stop_all() # Removed
-    native_engine.current_api_key = None
-    native_engine.current_api_key = None
+async def reset_service(session_id: str = Form(None)):
+    if session_id:
+        found = session_manager.drop(session_id)
+        await worker_pool_manager.reset_session(session_id)
+        log(f"[Bridge] Reset session '{session_id}'.")
+        return {"status": "reset_complete" if found else "session_not_found",
+                "message": f"Memory for session '{session_id}' has been reset."}
+
+    session_manager.drop_all(forget=True)
+    await worker_pool_manager.stop_all()
+    native_engine.clients.clear()
     log("[Bridge] Reset All Processes and Memory.")
     return {"status": "reset_complete", "message": "All persistent tools and memory have been reset."}
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/trace")
+async def trace_stats():
+    return trace_recorder.stats()
+
+@app.get("/logs")
+async def get_logs(since: int = 0, level: str = "debug", limit: int = 500):
+    """Recent log events after `since`. Poll with the returned `last_seq`; if it is lower
+    than what you sent, the server restarted and you should start over from 0."""
+    return {"events": logger.since(since, level, limit), "last_seq": logger.seq}
+
+@app.get("/sessions")
+async def list_sessions():
+    return {"sessions": [s.stats() for s in session_manager.sessions.values()]}
+
+@app.get("/cache")
+async def cache_stats():
+    return response_cache.stats()
+
+@app.post("/cache/clear")
+async def cache_clear():
+    response_cache.clear()
+    response_cache.save()
+    log("[Cache] Cleared.")
+    return {"status": "cleared"}
+
 @app.post("/ask", response_model=ActionResponse)
 async def ask_llm(
+    request: Request,
     screenshot: UploadFile = File(...), 
     context: str = Form(...),
-    api_key: str = Form(None)
+    api_key: str = Form(None),
+    session_id: str = Form(DEFAULT_SESSION_ID),
+    priority: int = Form(0)
 ):
-    image_path = os.path.abspath("last_frame.jpg")
+    timer = StageTimer()
+    timer.priority = priority
     try:
-        content = await screenshot.read()
-        with open(image_path, "wb") as f: f.write(content)
-    except Exception as e: return create_error_response(f"Image Save Error: {e}")
+        with timer.stage("upload_read"): content = await screenshot.read()
+    except Exception as e: return create_error_response(f"Image Read Error: {e}")
+
+    action, err = await cancel_on_disconnect(request, ask_session(session_id, content, context, api_key, timer))
+    if err: return create_error_response(err)
+    return action
+
+@app.post("/speculate")
+async def speculate(
+    screenshot: UploadFile = File(...),
+    context: str = Form(...),
+    api_key: str = Form(None),
+    session_id: str = Form(DEFAULT_SESSION_ID)
+):
+    """Start working on the frame the session is expected to /ask about next. Returns at once."""
+    try: content = await screenshot.read()
+    except Exception as e: return {"status": "error", "error": f"Image Read Error: {e}"}
+    return {"status": await speculator.start(session_manager.get(session_id), content, context, api_key)}
+
+@app.post("/ask_batch", response_model=BatchResponse)
+async def ask_batch(
+    request: Request,
+    screenshots: List[UploadFile] = File(...),
+    contexts: List[str] = Form(...),
+    session_ids: List[str] = Form(None),
+    api_key: str = Form(None),
+    priority: int = Form(0)
+):
+    """Several (screenshot, context, session) items in one request, processed concurrently."""
+    session_ids = session_ids or [DEFAULT_SESSION_ID] * len(screenshots)
+    if not (len(screenshots) == len(contexts) == len(session_ids)):
+        raise HTTPException(status_code=400, detail="screenshots, contexts and session_ids must have the same length.")
+
+    limiter = get_batch_limiter(load_config())
+    items = [run_batch_item(limiter, i, session_ids[i], screenshots[i], contexts[i], api_key, priority) for i in range(len(screenshots))]
+    results, err = await cancel_on_disconnect(request, gather_batch(items))
+    if err: return {"results": []}
+    log(f"[Bridge] Batch of {len(results)} done ({sum(1 for r in results if not r['ok'])} failed).")
+    return {"results": results}
 
-    config = load_config()
-    if not config: return create_error_response("Config not found.")
+async def gather_batch(items):
+    return await asyncio.gather(*items), None
+
+async def run_batch_item(limiter, index, session_id, screenshot, context, api_key, priority=0):
+    timer = StageTimer()
+    timer.priority = priority
+    try:
+        with timer.stage("upload_read"): content = await screenshot.read()
+        async with limiter:
+            action, err = await ask_session(session_id, content, context, api_key, timer)
+    except Exception as e:
+        action, err = None, f"Internal Error: {e}"
+    return {
+        "index": index,
+        "session_id": session_id,
+        "ok": err is None,
+        "action": action if err is None else create_error_response(err),
+        "error": err or ""
+    }
+
+@app.websocket("/ws")
+async def ask_socket(websocket: WebSocket, session_id: str = DEFAULT_SESSION_ID, api_key: str = None):
+    """Persistent connection bound to one session (query string). Each frame is a binary message,
+    optionally announced by an {"type": "ask"} text message carrying its request_id and context
+    (otherwise the last context is reused). The server pushes JSON text messages: "thought"
+    (partial, when the backend streams), then "action" or "error", both with an ActionResponse."""
+    await websocket.accept()
+    outbox = asyncio.Queue() # single writer, so request tasks never interleave sends
+    sender = asyncio.create_task(ws_send_loop(websocket, outbox))
+    outbox.put_nowait({"type": "session", "session_id": session_id})
+    log(f"[Bridge] WebSocket connected (session '{session_id}')")
+    inflight = set()
+    announced, context, counter = None, "", 0
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect": break
+            if message.get("bytes") is not None:
+                header, announced = announced or {}, None
+                context = header.get("context", context)
+                counter += 1
+                request_id = header.get("request_id", counter)
+                task = asyncio.create_task(ws_ask(outbox, session_id, request_id, message["bytes"], context,
+                                                  header.get("api_key", api_key), int(header.get("priority", 0))))
+                inflight.add(task)
+                task.add_done_callback(inflight.discard)
+                continue
+            try:
+                header = json.loads(message.get("text") or "")
+                kind = header.get("type")
+            except (ValueError, AttributeError):
+                kind = None
+            if kind == "ask":
+                announced = header
+            elif kind == "ping":
+                outbox.put_nowait({"type": "pong"})
+            elif kind == "reset":
+                found = session_manager.drop(session_id)
+                await worker_pool_manager.reset_session(session_id)
+                log(f"[Bridge] Reset session '{session_id}' (WebSocket).")
+                outbox.put_nowait({"type": "reset", "status": "reset_complete" if found else "session_not_found"})
+            else:
+                outbox.put_nowait({"type": "error", "request_id": None, "error": "Unknown message; expected ask, ping, reset or a binary frame."})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        # Same as a dropped HTTP client: cancel in-flight work and kill what it spawned
+        for task in inflight: task.cancel()
+        if inflight: await asyncio.gather(*inflight, return_exceptions=True)
+        sender.cancel()
+        log(f"[Bridge] WebSocket closed (session '{session_id}', {counter} frames)")
+
+async def ws_send_loop(websocket, outbox):
+    try:
+        while True: await websocket.send_json(await outbox.get())
+    except Exception: pass # client gone; the receive loop notices and cleans up
+
+async def ws_ask(outbox, session_id, request_id, content, context, api_key, priority=0):
+    timer = StageTimer()
+    timer.priority = priority
+    timer.on_thought = lambda text: outbox.put_nowait({"type": "thought", "request_id": request_id, "text": text})
+    try:
+        action, err = await ask_session(session_id, content, context, api_key, timer)
+        if not err: action = jsonable_encoder(ActionResponse(**action))
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        action, err = None, f"Internal Error: {e}"
+    elapsed_ms = round(timer.elapsed() * 1000, 1)
+    if err:
+        outbox.put_nowait({"type": "error", "request_id": request_id, "error": err, "action": create_error_response(err), "elapsed_ms": elapsed_ms})
+    else:
+        outbox.put_nowait({"type": "action", "request_id": request_id, "action": action, "elapsed_ms": elapsed_ms})
+
+async def ask_session(session_id, content, context, api_key, timer=None):
+    """Process one frame for a session; requests within a session are serialized."""
+    timer = timer or StageTimer()
+    session = session_manager.get(session_id)
+    action, err = None, None
+    try:
+        async with session.lock:
+            session.touch()
+            action, err = await handle_ask(session, content, context, api_key, timer)
+            return action, err
+    except asyncio.CancelledError:
+        err = "Client disconnected."
+        raise
+    finally:
+        record_request(timer, err)
+        trace_recorder.record(session_id, content, context, timer, action, err)
+
+async def handle_ask(session, content, context, api_key, timer):
+    current_timer.set(timer)
+    frame = session.new_frame(content)
+
+    with timer.stage("config_load"): snapshot = config_registry.current()
+    config = snapshot.config
+    if not config: return None, snapshot.config_error or "Config not found."
 
     tool_name = config.get("selected_tool", "gemini_cli")
-    
+    timer.tool = tool_name
+    spec = snapshot.tools.get(tool_name)
+    if not spec:
+        if tool_name in snapshot.tool_errors: return None, f"Tool {tool_name} has an invalid config: {snapshot.tool_errors[tool_name]}"
+        return None, f"Tool {tool_name} not defined."
+    system_prompt = snapshot.system_prompt
+
+    trace_recorder.apply_config(config.get("trace"))
+    cache = response_cache if response_cache.apply_config(config.get("response_cache")) and spec.conf.get("cache", is_stateless(spec)) else None
+    if cache:
+        with timer.stage("cache_lookup"):
+            # Decoding and hashing a full-resolution frame takes milliseconds; keep it off the event loop
+            cache_key = await asyncio.to_thread(cache.make_key, frame, tool_name, context, system_prompt)
+            cached = await cache.lookup(cache_key)
+        if cached:
+            timer.route = "cache"
+            log(f"[Cache] Hit for '{tool_name}' (session '{session.session_id}')", level="debug")
+            speculator.discard(session, "cache_hit")
+            return cached, None
+
+    timer.route = spec.route
+    action = await speculator.take(session, tool_name, system_prompt, frame, context) if session.speculation else None
+    if action is None:
+        action, err = await run_tool(session, spec, context, system_prompt, frame, api_key)
+        if err: return None, err
+    with timer.stage("normalize"): action = normalize_response(action)
+    if cache: cache.store(cache_key, action)
+    return action, None
+
+def tool_route(tool):
+    command = tool.get("command")
+    if command == "internal": return "native_chat" if tool.get("persistent", False) else "native"
+    if command == "terminal_bridge": return "terminal_bridge"
+    if command == "http": return "http"
+    if command == "race": return "race"
+    return "persistent" if tool.get("persistent", False) else "oneshot"
+
+async def run_tool(session, spec, context, system_prompt, frame, api_key):
+    """Run a tool through the rate scheduler. Returns (action_dict, None) or (None, error_message)."""
+    # Race Route (hedged / fallback chain over other tools); each member is scheduled on its own
+    if spec.route == "race":
+        return await execute_race(spec, session, context, system_prompt, frame, api_key)
+
+    timer = current_timer.get()
+    frame, context, crop = await prepare_frame(spec, frame, context)
+    key, label = rate_key(spec, api_key)
+    action, err = await rate_scheduler.run(key, label, spec.conf.get("rate_limit"), timer.priority if timer else 0,
+                                           lambda: dispatch_tool(session, spec, context, system_prompt, frame, api_key))
+    if crop and action: action = map_from_crop(normalize_response(action), crop)
+    return action, err
+
+async def dispatch_tool(session, spec, context, system_prompt, frame, api_key):
+    """Dispatch to the route for this tool."""
+    tool_name, tool = spec.name, spec.conf
     # 1. Native SDK Route
-    selected_tool_config = config.get("tools", {}).get(tool_name, {})
-    if selected_tool_config.get("command") == "internal":
-        log(f"[Bridge] Using Native SDK Engine (Tool: {tool_name})...")
-        tool_conf = selected_tool_config
-        final_api_key = api_key
-        if not final_api_key or final_api_key == "":
-            final_api_key = tool_conf.get("api_key", "")
-            if final_api_key == "YOUR_API_KEY_HERE": final_api_key = ""
-        if not final_api_key:
-             return create_error_response("API Key missing.")
-
-        model_name = tool_conf.get("model_name", "gemini-3-flash-preview")
-        system_prompt = load_system_prompt()
-        
-        # Check Persistent Mode
+    if spec.route in ("native", "native_chat"):
+        return await execute_native(tool_name, tool, session, context, system_prompt, frame, api_key)
+
+    # 1.2 Local Model Server Route (Ollama / LM Studio / OpenAI-compatible)
+    if spec.route == "http":
+        return await execute_http(tool_name, tool, context, system_prompt, frame)
+
+    # 1.5 Terminal Bridge Route (for Option B)
+    if spec.route == "terminal_bridge":
+        with timed_stage("frame_persist"): image_path = frame.path()
+        return await execute_terminal_bridge(tool_name, context, system_prompt, image_path)
+
+    # 2. Process Route
+    if spec.route == "persistent":
+        with timed_stage("frame_persist"): image_path = frame.path()
+        return await execute_persistent(tool_name, tool, session, context, system_prompt, image_path)
+
+    values = {"context": context, "system_prompt": system_prompt}
+    if "image_base64" in spec.args.fields: values["image_base64"] = frame.base64()
+    if "image_path" in spec.args.fields:
+        # Only spill the frame to disk if the command line actually references it
+        with timed_stage("frame_persist"): values["image_path"] = frame.path()
+    return await execute_oneshot(tool_name, tool, [tool["command"]] + spec.args.render(values))
+
+RACE_HEDGE_DELAY = 2.0 # seconds before a race tool starts its next member
+
+async def execute_race(spec, session, context, system_prompt, frame, api_key):
+    """Send the frame to the member tools in order and return the first valid action.
+
+    The next member starts when the previous one fails or after "hedge_delay" seconds
+    without an answer (0 = all at once). Losers are cancelled, which kills their processes."""
+    tool_name, members = spec.name, spec.members
+    if not members: return None, f"Race tool {tool_name} has no usable member tools (check config)."
+    hedge_delay = float(spec.conf.get("hedge_delay", RACE_HEDGE_DELAY))
+
+    parent = current_timer.get()
+    async def attempt(member):
+        timer = parent.member() if parent else None
+        current_timer.set(timer)
+        name = member.name
+        try:
+            action, err = await run_tool(session, member, context, system_prompt, frame, api_key)
+            if err: return name, None, err, None
+            action = normalize_response(action)
+            ActionResponse(**action)
+            return name, action, None, timer
+        except Exception as e:
+            return name, None, f"Invalid action: {e}", None
+
+    pending = set()
+    errors = []
+    next_index = 0
+    def launch():
+        nonlocal next_index
+        member = members[next_index]
+        next_index += 1
+        log(f"[Race] {tool_name}: starting '{member.name}' ({len(pending) + 1} in flight)", level="debug")
+        pending.add(asyncio.create_task(attempt(member)))
+
+    with timed_stage("backend"):
+        try:
+            launch()
+            while pending:
+                wait_timeout = hedge_delay if next_index < len(members) else None
+                done, pending = await asyncio.wait(pending, timeout=wait_timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done: # hedge: nobody answered in time
+                    launch()
+                    continue
+                for task in done:
+                    name, action, err, timer = task.result()
+                    if action is not None:
+                        if parent and timer: parent.raw_output = timer.raw_output # the winner's answer goes into the trace
+                        log(f"[Race] {tool_name}: '{name}' won")
+                        metrics.inc("aitester_race_wins_total", tool=tool_name, member=name)
+                        return action, None
+                    log(f"[Race] {tool_name}: '{name}' failed: {err[:100]}", level="warning")
+                    errors.append(f"{name}: {err}")
+                    if next_index < len(members): launch() # fall back down the chain
+        finally:
+            for task in pending: task.cancel()
+            if pending: await asyncio.gather(*pending, return_exceptions=True)
+    return None, "All race members failed. " + " | ".join(errors)
+
+async def execute_native(tool_name, tool_conf, session, context, system_prompt, frame, api_key):
+    log(f"[Bridge] Using Native SDK Engine (Tool: {tool_name})...", level="debug")
+    final_api_key = resolve_api_key(api_key, tool_conf)
+    if not final_api_key:
+         return None, "API Key missing."
+
+    model_name = tool_conf.get("model_name", "gemini-3-flash-preview")
+    sdk_module = tool_conf.get("sdk_module") # e.g. "fake_genai" for offline tests
+    stream = bool(tool_conf.get("stream", False)) # return as soon as the streamed action is complete
+    
+    # Check Persistent Mode
+    with timed_stage("backend"):
         if tool_conf.get("persistent", False):
-            # Ensure chat initialized
-            if tool_name not in getattr(native_engine, 'chat_sessions', {}):
-                 if not hasattr(native_engine, 'chat_sessions'): native_engine.chat_sessions = {}
-                 if not hasattr(native_engine, 'chat_syst_prompts'): native_engine.chat_syst_prompts = {}
-                 native_engine.chat_syst_prompts[tool_name] = system_prompt # Store for first append
-            
-            raw_resp, err = await native_engine.generate_chat_response(tool_name, context, image_path, final_api_key, model_name)
+            history = await session.chat_history(tool_name, tool_conf.get("history"))
+            raw_resp, err = await native_engine.generate_chat_response(history, system_prompt, context, frame, final_api_key, model_name, sdk_module, stream)
         else:
             # One-shot
-            raw_resp, err = await native_engine.generate_action(system_prompt, context, image_path, final_api_key, model_name)
-        
-        if err: return create_error_response(f"SDK Error: {err}")
+            raw_resp, err = await native_engine.generate_action(system_prompt, context, frame, final_api_key, model_name, sdk_module, stream)
+    
+    if err: return None, f"SDK Error: {err}"
 
-        parsed = extract_json(raw_resp)
-        if parsed: return normalize_response(parsed)
-        return create_error_response(f"SDK Parse Error. Raw: {str(raw_resp)[:200]}")
+    parsed = extract_backend_json(raw_resp)
+    if parsed: return parsed, None
+    return None, f"SDK Parse Error. Raw: {str(raw_resp)[:200]}"
 
-    # 1.5 Terminal Bridge Route (for Option B)
-    if selected_tool_config.get("command") == "terminal_bridge":
-        log(f"[Bridge] Using Terminal Bridge (Tool: {tool_name})...")
-        system_prompt = load_system_prompt()
+async def execute_http(tool_name, tool, context, system_prompt, frame):
+    log(f"[Bridge] Using HTTP Engine (Tool: {tool_name}, {tool.get('api', 'openai')})...", level="debug")
+    with timed_stage("backend"):
+        raw_resp, err = await http_engine.generate_action(tool, system_prompt, context, frame)
+    if err: return None, err
+
+    parsed = extract_backend_json(raw_resp)
+    if parsed: return parsed, None
+    return None, f"HTTP Parse Error. Raw: {str(raw_resp)[:200]}"
+
+async def execute_terminal_bridge(tool_name, context, system_prompt, image_path):
+    log(f"[Bridge] Using Terminal Bridge (Tool: {tool_name})...", level="debug")
+    with timed_stage("backend"):
         ans, err = await terminal_bridge_engine.generate_action(system_prompt, context, image_path)
-        
-        if err: 
-            log(f"[Bridge] Error: {err}")
-            return create_error_response(err)
-            
-        log(f"[Bridge] Raw Answer: {str(ans)[:100]}...") # Debug logging
-        parsed = extract_json(ans)
-        if parsed: return normalize_response(parsed)
-        return create_error_response(f"Bridge Parse Error: {str(ans)[:100]}")
-
-    # 2. Process Manager Route
-    tool = config.get("tools", {}).get(tool_name)
-    if not tool: return create_error_response(f"Tool {tool_name} not defined.")
-    system_prompt = load_system_prompt()
     
-    if tool.get("persistent", False):
-        return await execute_persistent(tool_name, config, context, system_prompt, image_path, api_key)
-    else:
-        args_template = tool["arguments"]
-        final_args = []
-        for arg in args_template:
-            replaced = arg.replace("{image_path}", image_path).replace("{context}", context).replace("{system_prompt}", system_prompt)
-            final_args.append(replaced)
-        return await execute_oneshot(tool_name, tool, [tool["command"]] + final_args)
+    if err: 
+        log(f"[Bridge] Error: {err}", level="error")
+        return None, err
+        
+    log(f"[Bridge] Raw Answer: {str(ans)[:100]}...", level="debug") # Debug logging
+    parsed = extract_backend_json(ans)
+    if parsed: return parsed, None
+    return None, f"Bridge Parse Error: {str(ans)[:100]}"
 
 async def execute_oneshot(tool_name, tool, cmd_list):
-    log(f"[Bridge] Oneshot: {' '.join(cmd_list)}")
+    limiter = oneshot_limiters.get(tool_name, tool)
+    if limiter.is_full():
+        return None, f"Tool '{tool_name}' is busy ({limiter.waiting} requests queued)."
+    timeout = float(tool.get("timeout", ONESHOT_TIMEOUT))
+
+    with timed_stage("queue_wait"): await limiter.acquire()
     try:
-        result = subprocess.run(cmd_list, capture_output=True, text=True, encoding='utf-8', shell=(os.name=='nt'), timeout=60)
-        parsed = extract_json(result.stdout)
-        if parsed: return parsed
-        stderr = ANSI_ESCAPE.sub('', result.stderr).strip()
-        return create_error_response(f"JSON Parse Error. Stderr: {stderr[:100]}")
-    except Exception as e: return create_error_response(str(e))
-
-async def execute_persistent(tool_name, config, context, system_prompt, image_path, api_key):
-    info = process_manager.get_info(tool_name, config)
-    if not info: return create_error_response("Failed to start persistent process.")
-
-    # PTY MODE
-    if "pty_proc" in info:
+        log(f"[Bridge] Oneshot: {' '.join(arg if len(arg) <= 200 else arg[:200] + '...' for arg in cmd_list)}", level="debug")
+        proc = None
+        try:
+            with timed_stage("backend"):
+                proc = await spawn_process(cmd_list, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+                stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+        except asyncio.TimeoutError:
+            log(f"[Bridge] Oneshot '{tool_name}' timed out after {timeout:.0f}s, killed.", level="warning")
+            return None, f"Timeout: '{tool_name}' took longer than {timeout:.0f}s."
+        except Exception as e: return None, str(e)
+        finally:
+            # Also reached on cancellation (client disconnected): never leave the CLI running
+            if proc is not None and proc.returncode is None:
+                proc.kill()
+                await proc.wait()
+    finally:
+        limiter.release()
+
+    parsed = extract_backend_json(stdout.decode("utf-8", errors="replace"))
+    if parsed: return parsed, None
+    stderr = ANSI_ESCAPE.sub('', stderr.decode("utf-8", errors="replace")).strip()
+    return None, f"JSON Parse Error. Stderr: {stderr[:100]}"
+
+async def execute_persistent(tool_name, tool, session, context, system_prompt, image_path):
+    pool = await worker_pool_manager.get_pool(tool_name, tool)
+    with timed_stage("queue_wait"): worker = await pool.acquire(session.session_id)
+    try:
+        # Optimization: Only send SYSTEM prompt once per warm process
         prompt = ""
-        # We always include system prompt in the file for safety/completeness if the CLI supports big context
-        # Or optimization: check initialized.
-        # But file strategy acts like detailed prompt.
-        if not info.get("initialized", False):
+        if not worker.initialized:
             prompt += f"SYSTEM: {system_prompt}\n"
-            info["initialized"] = True
-            log(f"[Bridge] PTY Sending SYSTEM PROMPT...")
+            log(f"[Bridge] Sending SYSTEM PROMPT to {worker.name}", level="debug")
         
-        prompt += f"IMAGE: @{image_path}\nCONTEXT: {context}\nRespond with JSON only."
-        
-        # Save to temp file to bypass TTY line limits (4096 chars)
-        temp_prompt_path = os.path.abspath("temp_prompt.txt")
-        try:
-            with open(temp_prompt_path, "w", encoding="utf-8") as f:
-                f.write(prompt)
-        except Exception as e:
-            return create_error_response(f"File Write Error: {e}")
+        worker.context.apply_config(tool)
+        context_text, parsed_context, full_context = worker.context.encode(context)
+        prompt += f"IMAGE: @{image_path}\nCONTEXT: {context_text}\nRespond with JSON only."
+        input_text = prompt.replace("\n", " ").strip() + "\n"
 
-        # Send @filename command
-        input_cmd = f"@{temp_prompt_path}\n"
-        
-        log(f"[Bridge] [PTY] Sending via file: {input_cmd.strip()}")
+        log(f"[Bridge] [Persistent] Sending to {worker.name} ({len(input_text)} bytes)...", level="debug")
+        with timed_stage("backend"): parsed, err = await worker.request(input_text, pool.timeout)
+        if err: return None, err
+        worker.initialized = True
+        worker.context.commit(parsed_context, full_context)
+        log("[Bridge] Persistent response parsed successfully.", level="debug")
+        return parsed, None
+    finally:
+        await pool.release(worker)
+
+# --- Multi-Worker Mode (--workers N) ---
+# The router process owns no backends: it starts N copies of this script on private ports, pins
+# each session to one of them (persistent CLI processes, chat history and the session lock live
+# there) and forwards requests. Assignments and chat histories go through the shared StateStore,
+# so a session whose worker died continues on another one.
+try:
+    from websockets.asyncio.client import connect as ws_connect # websockets >= 13
+except ImportError:
+    try: from websockets import connect as ws_connect
+    except ImportError: ws_connect = None
+
+WORKER_START_TIMEOUT = 60.0
+WORKER_SUPERVISE_INTERVAL = 2.0
+WORKER_LOG_POLL_INTERVAL = 1.0
+ROUTER_TIMEOUT = 600.0 # backends enforce their own timeouts; this only catches hung workers
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind((HOST, 0))
+        return sock.getsockname()[1]
+
+def multipart_field(body, name):
+    """Value of a small text field in a multipart body, found without parsing the file parts."""
+    pos = body.find(f'name="{name}"'.encode("utf-8"))
+    if pos == -1: return None
+    start = body.find(b"\r\n\r\n", pos)
+    end = body.find(b"\r\n", start + 4) if start != -1 else -1
+    return body[start + 4:end].decode("utf-8", errors="replace") if end != -1 else None
+
+class WorkerProcess:
+    """One bridge worker: this script with --worker-id, listening on a private port."""
+    def __init__(self, index, argv):
+        self.index = index
+        self.argv = argv
+        self.port = None
+        self.proc = None
+        self.restarts = 0
+        self.log_seq = 0 # last /logs event relayed from this worker
+
+    @property
+    def url(self):
+        return f"http://{HOST}:{self.port}"
+
+    def start(self):
+        self.port = free_port()
+        cmd = [sys.executable, os.path.abspath(__file__), "--port", str(self.port), "--worker-id", str(self.index)] + self.argv
+        # stdout is relayed through /logs (one console and one /logs for the whole bridge); stderr stays visible for crashes
+        self.proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL)
+        self.log_seq = 0
+        log(f"[Router] Started worker {self.index} (pid {self.proc.pid}, port {self.port})")
+
+    def is_alive(self):
+        return self.proc is not None and self.proc.poll() is None
+
+    def terminate(self):
+        if self.is_alive(): self.proc.terminate() # uvicorn shuts down gracefully and stops its CLI pools
+
+    def wait_stopped(self, timeout=10.0):
+        if self.proc is None: return
+        try: self.proc.wait(timeout)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+            self.proc.wait()
+
+class AffinityRouter:
+    def __init__(self, count, argv, store):
+        self.workers = [WorkerProcess(i, argv) for i in range(count)]
+        self.store = store
+        # Keep assignments across router restarts, as long as the worker index still exists
+        self.assigned = {sid: w for sid, w in store.assignments().items() if 0 <= w < count}
+        self.client = None
+
+    def owner(self, session_id):
+        index = self.assigned.get(session_id)
+        if index is not None and self.workers[index].is_alive(): return self.workers[index]
+        return self.reassign(session_id)
+
+    def reassign(self, session_id, exclude=None):
+        """Pin the session to the live worker with the fewest sessions."""
+        candidates = [w for w in self.workers if w is not exclude and w.is_alive()] or [w for w in self.workers if w is not exclude] or self.workers
+        load = Counter(self.assigned.values())
+        worker = min(candidates, key=lambda w: (load[w.index], w.index))
+        previous = self.assigned.get(session_id)
+        self.assigned[session_id] = worker.index
+        self.store.assign(session_id, worker.index)
+        if previous is not None and previous != worker.index:
+            log(f"[Router] Moved session '{session_id}' from worker {previous} to {worker.index}", level="warning")
+        return worker
+
+    async def forward(self, session_id, path, **kwargs):
+        """POST to the session's worker; if it cannot be reached, move the session once and retry."""
+        worker = self.owner(session_id)
         try:
-            info["pty_proc"].write(input_cmd)
-            
-            output_chunks = []
-            start_time = time.time()
-            timeout = 45.0
-            
-            while time.time() - start_time < timeout:
+            return await self.client.post(worker.url + path, **kwargs)
+        except httpx.ConnectError:
+            worker = self.reassign(session_id, exclude=worker)
+            return await self.client.post(worker.url + path, **kwargs)
+
+    async def gather(self, method, path, **kwargs):
+        """(worker, response or None) from every live worker."""
+        async def call(worker):
+            try: return worker, await self.client.request(method, worker.url + path, timeout=5.0, **kwargs)
+            except httpx.HTTPError: return worker, None
+        return await asyncio.gather(*(call(w) for w in self.workers if w.is_alive()))
+
+    async def wait_ready(self, worker, timeout=WORKER_START_TIMEOUT):
+        deadline = time.time() + timeout
+        while time.time() < deadline and worker.is_alive():
+            try:
+                if (await self.client.get(worker.url + "/health", timeout=2.0)).status_code == 200: return True
+            except httpx.HTTPError: pass
+            await asyncio.sleep(0.2)
+        log(f"[Router] Worker {worker.index} did not become ready.", level="error")
+        return False
+
+    async def supervise_loop(self, interval=WORKER_SUPERVISE_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            for worker in self.workers:
+                if worker.is_alive(): continue
+                log(f"[Router] Worker {worker.index} exited (code {worker.proc.returncode}), restarting.", level="warning")
+                worker.restarts += 1
+                worker.start()
+                await self.wait_ready(worker)
+
+    async def relay_logs_loop(self, interval=WORKER_LOG_POLL_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            for worker in self.workers:
+                if not worker.is_alive(): continue
                 try:
-                    # WinPTY read usually returns string, might throw if empty?
-                    # We might need to handle blocking. Assuming pywinpty read() works.
-                    chunk = info["pty_proc"].read() 
-                    if chunk:
-                        log(f"[PTY Chunk] {repr(chunk)}") # Real-time logging
-                        output_chunks.append(chunk)
-                        full_resp = "".join(output_chunks)
-                        # Remove ANSI
-                        full_resp_clean = ANSI_ESCAPE.sub('', full_resp)
-                        parsed = extract_json(full_resp_clean)
-                        if parsed:
-                            log(f"[Bridge] PTY response parsed.")
-                            return parsed
-                except Exception:
-                    pass
-                
-                time.sleep(0.1) # polling delay
-                 
-                if not info["pty_proc"].isalive():
-                    log(f"[Bridge] PTY died.")
-                    break
+                    data = (await self.client.get(worker.url + "/logs", params={"since": worker.log_seq, "limit": 2000}, timeout=5.0)).json()
+                except (httpx.HTTPError, ValueError): continue
+                if data["last_seq"] < worker.log_seq: worker.log_seq = 0 # worker restarted
+                for event in data["events"]:
+                    logger.emit(event["level"], event["message"], dict(event.get("fields") or {}, worker=worker.index))
+                    worker.log_seq = event["seq"]
 
-            raw = "".join(output_chunks)
-            clean = ANSI_ESCAPE.sub('', raw).strip()
-            log(f"[Bridge] PTY Timeout. Snippet: {clean[:100]}")
-            return create_error_response(f"PTY Timeout. Output: {clean[:50]}...")
-            
-        except Exception as e:
-            return create_error_response(f"PTY Error: {e}")
-
-    # STANDARD PIPE MODE
-    stdout_reader = info["stdout"]
-    stderr_reader = info["stderr"]
-    stdout_reader.clear()
-    stderr_reader.clear()
-
-    # Optimization: Only send SYSTEM prompt if not initialized
-    prompt = ""
-    if not info.get("initialized", False):
-        prompt += f"SYSTEM: {system_prompt}\n"
-        info["initialized"] = True
-        log(f"[Bridge] Sending SYSTEM PROMPT to new session '{tool_name}'")
-    
-    prompt += f"IMAGE: @{image_path}\nCONTEXT: {context}\nRespond with JSON only."
-    input_text = prompt.replace("\n", " ").strip() + "\n"
+affinity_router = None
+
+@asynccontextmanager
+async def router_lifespan(app: FastAPI):
+    log(f"--- Starting AI Unity Server router on port {PORT} ({len(affinity_router.workers)} workers) ---")
+    log(f"State: {affinity_router.store.path}")
+    affinity_router.client = httpx.AsyncClient(timeout=httpx.Timeout(ROUTER_TIMEOUT, connect=5.0),
+                                               limits=httpx.Limits(max_connections=256, max_keepalive_connections=64))
+    for worker in affinity_router.workers: worker.start()
+    await asyncio.gather(*(affinity_router.wait_ready(w) for w in affinity_router.workers))
+    tasks = [asyncio.create_task(affinity_router.supervise_loop()), asyncio.create_task(affinity_router.relay_logs_loop())]
+    yield
+    for task in tasks: task.cancel()
+    for worker in affinity_router.workers: worker.terminate()
+    for worker in affinity_router.workers: await asyncio.to_thread(worker.wait_stopped)
+    await affinity_router.client.aclose()
+    await asyncio.to_thread(affinity_router.store.close)
+    log("--- Stopping AI Unity Server router ---")
+    logger.close()
+
+router_app = FastAPI(lifespan=router_lifespan)
+router_app.get("/logs")(get_logs) # worker events are relayed into this process's log
+
+def relay_response(resp):
+    return Response(resp.content, status_code=resp.status_code, media_type=resp.headers.get("content-type"))
 
-    log(f"[Bridge] [Persistent] Sending to {tool_name} ({len(input_text)} bytes)...")
+async def forward_ask(session_id, body, content_type):
     try:
-        info["proc"].stdin.write(input_text)
-        info["proc"].stdin.flush()
-        
-        output_chunks = []
-        start_time = time.time()
-        timeout = 45
-        
-        while time.time() - start_time < timeout:
-            chunk = stdout_reader.get_output(timeout=0.2)
-            if chunk:
-                output_chunks.append(chunk)
-                full_resp = "".join(output_chunks)
-                parsed = extract_json(full_resp)
-                if parsed:
-                    log(f"[Bridge] Persistent response parsed successfully.")
-                    return parsed
-            
-            err_chunk = stderr_reader.get_output(timeout=0.01)
-            if err_chunk:
-                # Log stderr but don't abort immediately unless severe?
-                # Usually standard CLI warnings go to stderr.
-                pass
-
-            if info["proc"].poll() is not None:
-                log(f"[Bridge] Process '{tool_name}' died during execution.")
-                rem_err = stderr_reader.get_output(timeout=1.0)
-                if rem_err: log(f"[Bridge] Final STDERR: {rem_err.strip()}")
-                break
-        
-        raw_out = "".join(output_chunks)
-        clean_out = ANSI_ESCAPE.sub('', raw_out).strip()
-        log(f"[Bridge] Timeout. Raw len: {len(raw_out)}")
-        if clean_out: log(f"[Bridge] Snippet: {clean_out[:100]}")
-        
-        err_out = stderr_reader.get_output(timeout=0.1)
-        if err_out:
-            return create_error_response(f"Persistent Process Error (STDERR): {err_out[:200]}")
-            
-        return create_error_response(f"Persistent timeout. Output snippet: {clean_out[:50]}...")
+        return await affinity_router.forward(session_id, "/ask", content=body, headers={"content-type": content_type}), None
+    except httpx.HTTPError as e:
+        return None, f"Worker unreachable: {e}"
+
+@router_app.post("/ask")
+async def route_ask(request: Request):
+    body = await request.body()
+    session_id = multipart_field(body, "session_id") or DEFAULT_SESSION_ID
+    resp, err = await cancel_on_disconnect(request, forward_ask(session_id, body, request.headers.get("content-type", "")))
+    if err: return JSONResponse(create_error_response(err))
+    return relay_response(resp)
+
+@router_app.post("/speculate")
+async def route_speculate(request: Request):
+    body = await request.body()
+    session_id = multipart_field(body, "session_id") or DEFAULT_SESSION_ID
+    try: resp = await affinity_router.forward(session_id, "/speculate", content=body, headers={"content-type": request.headers.get("content-type", "")})
+    except httpx.HTTPError as e: return {"status": "error", "error": f"Worker unreachable: {e}"}
+    return relay_response(resp)
+
+@router_app.post("/ask_batch")
+async def route_ask_batch(request: Request):
+    """Split a batch by owning worker, send the parts concurrently and merge the results in order."""
+    form = await request.form()
+    screenshots, contexts = form.getlist("screenshots"), form.getlist("contexts")
+    session_ids = form.getlist("session_ids") or [DEFAULT_SESSION_ID] * len(screenshots)
+    if not (len(screenshots) == len(contexts) == len(session_ids)):
+        raise HTTPException(status_code=400, detail="screenshots, contexts and session_ids must have the same length.")
+    groups = {}
+    for i, session_id in enumerate(session_ids):
+        groups.setdefault(affinity_router.owner(session_id), []).append(i)
+
+    async def send(worker, indexes):
+        files = [("screenshots", (screenshots[i].filename or "screen.jpg", await screenshots[i].read(),
+                                  screenshots[i].content_type or "image/jpeg")) for i in indexes]
+        data = {"contexts": [contexts[i] for i in indexes], "session_ids": [session_ids[i] for i in indexes]}
+        for field in ("api_key", "priority"):
+            if form.get(field): data[field] = form.get(field)
+        try:
+            resp = await affinity_router.client.post(worker.url + "/ask_batch", files=files, data=data)
+            results = resp.json()["results"]
+            for item in results: item["index"] = indexes[item["index"]]
+            return results
+        except (httpx.HTTPError, ValueError, KeyError) as e:
+            err = f"Worker {worker.index} failed: {e}"
+            return [{"index": i, "session_id": session_ids[i], "ok": False, "action": create_error_response(err), "error": err} for i in indexes]
+
+    async def send_all():
+        parts = await asyncio.gather(*(send(worker, indexes) for worker, indexes in groups.items()))
+        return sorted((item for part in parts for item in part), key=lambda item: item["index"]), None
+    results, err = await cancel_on_disconnect(request, send_all())
+    if err: return {"results": []}
+    return {"results": results}
+
+@router_app.post("/reset")
+async def route_reset(session_id: str = Form(None)):
+    if session_id:
+        index = affinity_router.assigned.pop(session_id, None)
+        affinity_router.store.unassign(session_id)
+        if index is None or not affinity_router.workers[index].is_alive():
+            affinity_router.store.drop_session(session_id)
+            return {"status": "session_not_found", "message": f"Memory for session '{session_id}' has been reset."}
+        resp = await affinity_router.client.post(affinity_router.workers[index].url + "/reset", data={"session_id": session_id})
+        return relay_response(resp)
+    await affinity_router.gather("POST", "/reset")
+    log("[Router] Reset all workers.")
+    return {"status": "reset_complete", "message": "All persistent tools and memory have been reset."}
+
+@router_app.get("/health")
+async def route_health():
+    replies = [(w, r.json()) for w, r in await affinity_router.gather("GET", "/health") if r is not None and r.status_code == 200]
+    first = replies[0][1] if replies else {}
+    ready = len(replies) == len(affinity_router.workers) and all(h.get("ready", True) for _, h in replies)
+    return {
+        "status": "degraded" if len(replies) < len(affinity_router.workers) else "running" if ready else "starting",
+        "ready": ready,
+        "config_loaded": bool(first.get("config_loaded")),
+        "selected_tool": first.get("selected_tool", "none"),
+        "active_sessions": sum(h.get("active_sessions", 0) for _, h in replies),
+        "config_error": first.get("config_error", ""),
+        "warmup_ms": max((h.get("warmup_ms", 0.0) for _, h in replies), default=0.0),
+        "warmup_errors": sorted({e for _, h in replies for e in h.get("warmup_errors", [])}),
+        "workers": [{"index": w.index, "pid": w.proc.pid if w.proc else None, "port": w.port, "alive": w.is_alive(),
+                     "restarts": w.restarts, "assigned_sessions": sum(1 for i in affinity_router.assigned.values() if i == w.index)}
+                    for w in affinity_router.workers]
+    }
+
+def merge_metrics(texts):
+    """Concatenate worker /metrics outputs, adding a worker label and keeping each family together."""
+    families = OrderedDict() # name -> (header lines, sample lines)
+    for index, text in texts:
+        current = None
+        for line in text.splitlines():
+            if line.startswith("# HELP ") or line.startswith("# TYPE "):
+                current = line.split(" ", 3)[2]
+                header, _ = families.setdefault(current, ([], []))
+                if line not in header: header.append(line)
+            elif line and current:
+                name, brace, rest = line.partition("{")
+                if brace: line = f'{name}{{worker="{index}",{rest}'
+                else:
+                    name, _, value = line.partition(" ")
+                    line = f'{name}{{worker="{index}"}} {value}'
+                families[current][1].append(line)
+    return "\n".join(l for header, samples in families.values() for l in header + samples) + "\n"
+
+@router_app.get("/metrics", response_class=PlainTextResponse)
+async def route_metrics():
+    texts = [(w.index, r.text) for w, r in await affinity_router.gather("GET", "/metrics") if r is not None]
+    return PlainTextResponse(merge_metrics(texts), media_type="text/plain; version=0.0.4")
+
+@router_app.get("/sessions")
+async def route_sessions():
+    sessions = []
+    for worker, resp in await affinity_router.gather("GET", "/sessions"):
+        if resp is None: continue
+        sessions += [dict(s, worker=worker.index) for s in resp.json()["sessions"]]
+    return {"sessions": sessions}
+
+async def per_worker(method, path):
+    return {"workers": [dict(r.json(), worker=w.index) for w, r in await affinity_router.gather(method, path) if r is not None]}
+
+@router_app.get("/cache")
+async def route_cache_stats():
+    return await per_worker("GET", "/cache")
+
+@router_app.post("/cache/clear")
+async def route_cache_clear():
+    await per_worker("POST", "/cache/clear")
+    return {"status": "cleared"}
+
+@router_app.get("/trace")
+async def route_trace_stats():
+    return await per_worker("GET", "/trace")
+
+@router_app.websocket("/ws")
+async def route_socket(websocket: WebSocket, session_id: str = DEFAULT_SESSION_ID):
+    await websocket.accept()
+    if ws_connect is None:
+        await websocket.close(code=1011, reason="websockets is not installed on the bridge (pip install websockets).")
+        return
+    worker = affinity_router.owner(session_id)
+    try:
+        async with ws_connect(f"ws://{HOST}:{worker.port}/ws?{websocket.url.query}", max_size=None) as upstream:
+            async def client_to_worker():
+                while True:
+                    message = await websocket.receive()
+                    if message["type"] == "websocket.disconnect": return
+                    if message.get("bytes") is not None: await upstream.send(message["bytes"])
+                    elif message.get("text") is not None: await upstream.send(message["text"])
+            async def worker_to_client():
+                async for message in upstream:
+                    if isinstance(message, bytes): await websocket.send_bytes(message)
+                    else: await websocket.send_text(message)
+            pumps = [asyncio.create_task(client_to_worker()), asyncio.create_task(worker_to_client())]
+            try: await asyncio.wait(pumps, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                for pump in pumps: pump.cancel()
     except Exception as e:
-        return create_error_response(f"Persistent error: {e}")
+        log(f"[Router] WebSocket relay for '{session_id}' ended: {e}", level="warning")
+    finally:
+        try: await websocket.close()
+        except Exception: pass
+
+def log_state_error(error):
+    log(f"[State] Queued write failed: {error}", level="error")
+
+def run_router(workers, state_db, argv):
+    global affinity_router
+    if not HTTPX_AVAILABLE: sys.exit("--workers needs httpx (pip install httpx).")
+    os.makedirs(os.path.dirname(state_db), exist_ok=True)
+    affinity_router = AffinityRouter(workers, argv + ["--state-db", state_db], StateStore(state_db, on_error=log_state_error))
+    uvicorn.run(router_app, host=HOST, port=PORT)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="AI Unity Tester MCP Bridge Server")
     parser.add_argument("--config", type=str, help="Path to tools_config.json")
     parser.add_argument("--prompt", type=str, help="Path to system_prompt.txt")
     parser.add_argument("--port", type=int, default=8000, help="Server port (default: 8000)")
+    parser.add_argument("--log-level", choices=list(LOG_LEVELS), help="Minimum level logged and kept for /logs (default: info)")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes behind a session-affinity router (default: 1)")
+    parser.add_argument("--state-db", type=str, help="SQLite file for session state shared by workers and kept across restarts")
+    parser.add_argument("--worker-id", type=int, help=argparse.SUPPRESS) # set by the router for its workers
     args = parser.parse_args()
 
     if args.config: CONFIG_FILE = os.path.abspath(args.config)
     if args.prompt: SYSTEM_PROMPT_FILE = os.path.abspath(args.prompt)
     if args.port: PORT = args.port
+    if args.log_level: logger.set_level(args.log_level)
 
-    uvicorn.run(app, host=HOST, port=PORT)
+    if args.workers > 1:
+        worker_argv = ["--config", os.path.abspath(CONFIG_FILE), "--prompt", os.path.abspath(SYSTEM_PROMPT_FILE)]
+        if args.log_level: worker_argv += ["--log-level", args.log_level]
+        state_db = os.path.abspath(args.state_db or os.path.join(os.path.dirname(os.path.abspath(CONFIG_FILE)), "state~", "bridge.db"))
+        run_router(args.workers, state_db, worker_argv)
+    else:
+        WORKER_ID = args.worker_id
+        if args.state_db: state_store = StateStore(os.path.abspath(args.state_db), on_error=log_state_error)
+        uvicorn.run(app, host=HOST, port=PORT)
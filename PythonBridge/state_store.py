@@ -0,0 +1,118 @@
+"""SQLite store for bridge state that must outlive one worker process.
+
+server.py --workers N runs several worker processes behind a session-affinity router; they share
+one database (WAL mode, so readers never block the single writer):
+
+    histories     chat history of native chat tools per (session, tool), text only
+    assignments   which worker a session is pinned to, owned by the router
+    cache         response cache entries, so one worker's answer is a hit for all of them
+
+A session normally stays on its worker, where its persistent CLI processes and in-memory state
+live. When a worker dies, the router moves its sessions and the new worker restores their chat
+histories from here. A single server started with --state-db uses the same store to keep chat
+histories and the cache across restarts.
+"""
+import json
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS histories (
+    session_id TEXT NOT NULL, tool TEXT NOT NULL, data TEXT NOT NULL, updated REAL NOT NULL,
+    PRIMARY KEY (session_id, tool));
+CREATE TABLE IF NOT EXISTS assignments (
+    session_id TEXT PRIMARY KEY, worker INTEGER NOT NULL, updated REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS cache (
+    text_key TEXT NOT NULL, phash TEXT NOT NULL, action TEXT NOT NULL, created REAL NOT NULL,
+    PRIMARY KEY (text_key, phash));
+CREATE INDEX IF NOT EXISTS cache_created ON cache (created);
+"""
+
+class StateStore:
+    """One connection per process, used only by the store's own thread, so a write lock held by
+    another process (up to busy_timeout) never stalls the event loop. Calls run in the order they
+    were made: writes are queued and return at once, reads wait for their result (and see every
+    earlier write), so callers on the event loop run them with asyncio.to_thread."""
+    def __init__(self, path, busy_timeout=5.0, on_error=None):
+        self.path = path
+        self.on_error = on_error # called with the exception of a failed queued write
+        self.errors = 0
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="state-store")
+        self.db = sqlite3.connect(path, timeout=busy_timeout, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL") # WAL keeps the database consistent; a crash loses at most the last steps
+        self.db.executescript(SCHEMA)
+
+    def _run(self, sql, params):
+        return self.db.execute(sql, params).fetchall()
+
+    def _execute(self, sql, params=()):
+        return self.executor.submit(self._run, sql, params).result()
+
+    def _write(self, sql, params=()):
+        future = self.executor.submit(self._run, sql, params)
+        future.add_done_callback(self._write_done)
+        return future
+
+    def _write_done(self, future):
+        error = future.exception()
+        if error is None: return
+        self.errors += 1
+        if self.on_error: self.on_error(error)
+
+    def flush(self):
+        """Wait until every queued write has run."""
+        self.executor.submit(lambda: None).result()
+
+    # --- Chat histories ---
+    def save_history(self, session_id, tool, data):
+        self._write("INSERT OR REPLACE INTO histories VALUES (?, ?, ?, ?)",
+                    (session_id, tool, json.dumps(data, ensure_ascii=False), time.time()))
+
+    def load_history(self, session_id, tool):
+        rows = self._execute("SELECT data FROM histories WHERE session_id = ? AND tool = ?", (session_id, tool))
+        return json.loads(rows[0][0]) if rows else None
+
+    def drop_session(self, session_id):
+        self._write("DELETE FROM histories WHERE session_id = ?", (session_id,))
+
+    def drop_all_sessions(self):
+        self._write("DELETE FROM histories")
+
+    def expire(self, max_idle):
+        """Forget histories and assignments not updated for max_idle seconds."""
+        cutoff = time.time() - max_idle
+        self._write("DELETE FROM histories WHERE updated < ?", (cutoff,))
+        self._write("DELETE FROM assignments WHERE updated < ?", (cutoff,))
+
+    # --- Session -> worker assignments ---
+    def assign(self, session_id, worker):
+        self._write("INSERT OR REPLACE INTO assignments VALUES (?, ?, ?)", (session_id, worker, time.time()))
+
+    def unassign(self, session_id):
+        self._write("DELETE FROM assignments WHERE session_id = ?", (session_id,))
+
+    def assignments(self):
+        return dict(self._execute("SELECT session_id, worker FROM assignments"))
+
+    # --- Response cache ---
+    def cache_put(self, text_key, phash, action, created):
+        self._write("INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)",
+                    (text_key, str(phash), json.dumps(action, ensure_ascii=False), created))
+
+    def cache_candidates(self, text_key, min_created):
+        """(phash, action, created) of the live entries for one text key."""
+        rows = self._execute("SELECT phash, action, created FROM cache WHERE text_key = ? AND created >= ?", (text_key, min_created))
+        return [(int(phash), json.loads(action), created) for phash, action, created in rows]
+
+    def cache_trim(self, max_entries, ttl):
+        self._write("DELETE FROM cache WHERE created < ?", (time.time() - ttl,))
+        self._write("DELETE FROM cache WHERE rowid NOT IN (SELECT rowid FROM cache ORDER BY created DESC LIMIT ?)", (max_entries,))
+
+    def cache_clear(self):
+        self._write("DELETE FROM cache")
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.db.close()
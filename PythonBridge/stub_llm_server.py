@@ -0,0 +1,93 @@
+"""Offline stand-in for a local Ollama / LM Studio server.
+
+Serves /api/generate, /api/chat (Ollama) and /v1/chat/completions (OpenAI-compatible)
+with a canned action, so "http" tools can be exercised without a model:
+
+    python stub_llm_server.py --port 11434
+    python stub_llm_server.py --port 1234 --latency 0.3
+
+Each reply's thought reports how many images arrived and on which connection,
+which makes keep-alive reuse visible.
+"""
+import argparse
+import itertools
+import json
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LATENCY = 0.1
+connection_ids = itertools.count(1)
+
+def make_action(image_count, connection_id):
+    return {
+        "thought": f"Stub reply (images: {image_count}, connection: {connection_id})",
+        "actionType": "Wait",
+        "screenPosition": {"x": 0.5, "y": 0.5},
+        "targetPosition": {"x": 0.0, "y": 0.0},
+        "keyName": "",
+        "textToType": "",
+        "duration": 1.0
+    }
+
+def count_openai_images(messages):
+    count = 0
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, list):
+            count += sum(1 for part in content if part.get("type") == "image_url")
+    return count
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # keep connections open like real servers
+
+    def setup(self):
+        super().setup()
+        self.connection_id = next(connection_ids)
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            req = json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError:
+            return self.send_json(400, {"error": "invalid JSON body"})
+        time.sleep(LATENCY)
+
+        if self.path == "/api/generate":
+            action = make_action(len(req.get("images", [])), self.connection_id)
+            return self.send_json(200, {"model": req.get("model"), "response": json.dumps(action), "done": True})
+        if self.path == "/api/chat":
+            images = sum(len(m.get("images", [])) for m in req.get("messages", []))
+            action = make_action(images, self.connection_id)
+            return self.send_json(200, {"model": req.get("model"), "message": {"role": "assistant", "content": json.dumps(action)}, "done": True})
+        if self.path == "/v1/chat/completions":
+            action = make_action(count_openai_images(req.get("messages", [])), self.connection_id)
+            return self.send_json(200, {
+                "model": req.get("model"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": json.dumps(action)}, "finish_reason": "stop"}]
+            })
+        self.send_json(404, {"error": f"unknown path {self.path}"})
+
+    def log_message(self, format, *args):
+        pass # keep benchmark output clean
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stub Ollama / OpenAI-compatible server")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--latency", type=float, default=LATENCY, help="Simulated model latency in seconds")
+    args = parser.parse_args()
+    LATENCY = args.latency
+
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), StubHandler)
+    print(f"Stub LLM server listening on 127.0.0.1:{args.port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,9 @@
+"""Bridge unit tests: python -m pytest -q "PythonBridge/tests~".
+
+The trailing ~ keeps Unity from importing this folder as assets; the bridge modules are imported
+from the parent folder the same way server.py is run.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,55 @@
+import json
+
+from server import ChatHistory, Frame
+
+def answer(step):
+    return json.dumps({"thought": f"step {step}", "actionType": "Click", "screenPosition": {"x": 0.1, "y": 0.2}})
+
+def fill(history, steps):
+    for step in range(1, steps + 1):
+        history.append(f"ask {step}", Frame(b"frame %d" % step, "unused.jpg"), answer(step))
+
+def test_window_keeps_last_max_turns():
+    history = ChatHistory({"max_turns": 3})
+    fill(history, 5)
+    assert [t.user_text for t in history.turns] == ["ask 3", "ask 4", "ask 5"]
+    assert history.dropped_turns == 2
+    contents = history.build_contents("PROMPT", "ask 6", None)
+    assert [m["role"] for m in contents] == ["user", "model"] * 3 + ["user"]
+    assert contents[0]["parts"][0].startswith("SYSTEM: PROMPT\n\n")
+    assert contents[0]["parts"][0].endswith("ask 3")
+    assert contents[-1]["parts"] == ["ask 6"]
+
+def test_dropped_turns_are_summarized_into_the_header():
+    history = ChatHistory({"max_turns": 3})
+    fill(history, 5)
+    assert list(history.summary_lines) == ["Step 1: Click at (0.1, 0.2) - step 1", "Step 2: Click at (0.1, 0.2) - step 2"]
+    header = history.build_contents("PROMPT", "ask 6", None)[0]["parts"][0]
+    assert "[Earlier Steps]\nStep 1: Click at (0.1, 0.2) - step 1\nStep 2: Click at (0.1, 0.2) - step 2\n\nask 3" in header
+
+def test_summary_drops_oldest_lines_over_budget():
+    history = ChatHistory({"max_turns": 1, "summary_max_chars": 80})
+    fill(history, 6)
+    assert history.dropped_turns == 5
+    assert [line.split(":")[0] for line in history.summary_lines] == ["Step 4", "Step 5"]
+
+def test_summarize_off_drops_turns_silently():
+    history = ChatHistory({"max_turns": 2, "summarize": False})
+    fill(history, 4)
+    assert history.dropped_turns == 2 and not history.summary_lines
+    assert "[Earlier Steps]" not in history.build_contents("PROMPT", "ask 5", None)[0]["parts"][0]
+
+def test_only_last_image_turns_keep_their_screenshot():
+    history = ChatHistory({"max_turns": 3, "image_turns": 1})
+    fill(history, 4)
+    assert [t.image is not None for t in history.turns] == [False, False, True]
+    assert history.turns[-1].image["data"] == b"frame 4"
+    contents = history.build_contents("PROMPT", "ask 5", Frame(b"frame 5", "unused.jpg"))
+    images = [p["data"] for m in contents for p in m["parts"] if isinstance(p, dict)]
+    assert images == [b"frame 4", b"frame 5"]
+    assert history.stats()["images"] == 1
+
+def test_image_turns_zero_sends_text_only_history():
+    history = ChatHistory({"max_turns": 3, "image_turns": 0})
+    fill(history, 2)
+    assert all(t.image is None for t in history.turns)
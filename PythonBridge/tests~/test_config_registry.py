@@ -0,0 +1,58 @@
+import json
+import os
+
+import pytest
+
+import server
+from server import ConfigRegistry
+
+@pytest.fixture
+def files(tmp_path, monkeypatch):
+    config, prompt = tmp_path / "tools_config.json", tmp_path / "system_prompt.txt"
+    monkeypatch.setattr(server, "CONFIG_FILE", str(config))
+    monkeypatch.setattr(server, "SYSTEM_PROMPT_FILE", str(prompt))
+    return config, prompt
+
+def rewrite(path, text):
+    """Write `text` and move the mtime forward, as an editor saving a second later would."""
+    before = os.stat(path).st_mtime_ns if path.exists() else 0
+    path.write_text(text, encoding="utf-8")
+    os.utime(path, ns=(before + 1_000_000_000, before + 1_000_000_000))
+
+def test_reloads_only_when_the_file_changes(files):
+    config, prompt = files
+    rewrite(config, json.dumps({"selected_tool": "a", "tools": {"a": {"command": "echo"}}}))
+    rewrite(prompt, "Be brief.")
+    registry = ConfigRegistry()
+    first = registry.current()
+    assert first.config["selected_tool"] == "a" and first.system_prompt == "Be brief."
+    assert registry.current() is first
+
+    rewrite(config, json.dumps({"selected_tool": "b", "tools": {"b": {"command": "echo"}}}))
+    second = registry.current()
+    assert second is not first
+    assert second.config["selected_tool"] == "b" and set(second.tools) == {"b"}
+
+    rewrite(prompt, "Be thorough.")
+    assert registry.current().system_prompt == "Be thorough."
+
+def test_invalid_json_keeps_previous_config(files):
+    config, _ = files
+    rewrite(config, json.dumps({"selected_tool": "a", "tools": {"a": {"command": "echo"}}}))
+    registry = ConfigRegistry()
+    good = registry.current()
+
+    rewrite(config, '{"selected_tool": "b", ')
+    broken = registry.current()
+    assert broken.config is good.config
+    assert set(broken.tools) == {"a"}
+    assert broken.config_error.startswith("Config: ")
+
+    rewrite(config, json.dumps({"selected_tool": "c", "tools": {}}))
+    fixed = registry.current()
+    assert fixed.config["selected_tool"] == "c" and fixed.config_error == ""
+
+def test_missing_files_fall_back_to_defaults(files):
+    snapshot = ConfigRegistry().current()
+    assert snapshot.config is None
+    assert snapshot.system_prompt == server.DEFAULT_SYSTEM_PROMPT
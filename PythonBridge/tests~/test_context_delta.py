@@ -0,0 +1,81 @@
+import asyncio
+import sys
+
+from server import ContextDelta, PersistentWorker
+
+def ui(buttons, score="Score: 0"):
+    """UIHierarchyDumper-style context with one node per (name, x) in `buttons`."""
+    lines = ["[Canvas] MainMenu (Screen Space)"]
+    lines += [f'-- [Button] "{name}" (Pos: {x},100 Size: 120x40)' for name, x in buttons]
+    return "\n".join(lines + [score])
+
+MENU = [(f"Option {i}", i * 10) for i in range(12)]
+
+def step(delta, context):
+    """One accepted step: encode, then commit as execute_persistent does after a good answer."""
+    text, parsed, full = delta.encode(context)
+    delta.commit(parsed, full)
+    return text, full
+
+def test_first_step_sends_full_context():
+    text, full = step(ContextDelta(), ui(MENU))
+    assert full and text == ui(MENU)
+
+def test_unchanged_frame_sends_no_changes_note():
+    delta = ContextDelta()
+    step(delta, ui(MENU))
+    text, full = step(delta, ui(MENU))
+    assert not full
+    assert text == "[UI Changes Since Previous Step]\nNone, the UI is the same as in the previous step."
+
+def test_changed_frame_lists_only_changes():
+    delta = ContextDelta()
+    step(delta, ui(MENU))
+    changed = [(name, x + 5) if name == "Option 3" else (name, x) for name, x in MENU if name != "Option 7"] + [("Back", 500)]
+    text, full = step(delta, ui(changed, score="Score: 10"))
+    assert not full
+    lines = text.splitlines()[1:]
+    assert lines == [
+        '- [Button] "MainMenu/Option 7"',
+        '+ [Button] "MainMenu/Back" (Pos: 500,100 Size: 120x40)',
+        '~ [Button] "MainMenu/Option 3" (Pos: 35,100 Size: 120x40)',
+        "[Other Context]",
+        "Score: 10",
+    ]
+
+def test_large_change_falls_back_to_full_context():
+    delta = ContextDelta()
+    step(delta, ui(MENU))
+    other = ui([(f"Item {i}", i) for i in range(12)])
+    assert step(delta, other) == (other, True)
+
+def test_disabled_always_sends_full_context():
+    delta = ContextDelta()
+    delta.apply_config({"context_delta": False})
+    step(delta, ui(MENU))
+    text, parsed, full = delta.encode(ui(MENU))
+    assert (text, parsed, full) == (ui(MENU), None, True)
+
+def test_refresh_every_forces_full_context():
+    delta = ContextDelta(refresh_every=2)
+    assert [step(delta, ui(MENU))[1] for _ in range(5)] == [True, False, False, True, False]
+
+def test_uncommitted_step_is_not_the_base():
+    delta = ContextDelta()
+    step(delta, ui(MENU))
+    delta.encode(ui(MENU[:6])) # backend failed, nothing committed
+    text, full = step(delta, ui(MENU))
+    assert not full and "None, the UI is the same" in text
+
+def test_worker_restart_resends_full_context():
+    async def run():
+        worker = PersistentWorker("tool", 0, [sys.executable, "-c", "import sys; sys.stdin.read()"])
+        await worker.start()
+        try:
+            step(worker.context, ui(MENU))
+            assert not step(worker.context, ui(MENU))[1]
+            await worker.restart()
+            return step(worker.context, ui(MENU))
+        finally:
+            await worker.stop()
+    assert asyncio.run(run()) == (ui(MENU), True)
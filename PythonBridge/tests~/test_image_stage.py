@@ -0,0 +1,103 @@
+import io
+
+import pytest
+from PIL import Image
+
+from server import ImageStage, map_from_crop
+
+SCREEN = (800, 600)
+
+def encode(img, fmt="PNG", **kwargs):
+    out = io.BytesIO()
+    img.save(out, fmt, **kwargs)
+    return out.getvalue()
+
+def screen_with_marker(mx, my):
+    """Black screen with a small white square centered on pixel (mx, my), top-left origin."""
+    img = Image.new("L", SCREEN)
+    img.paste(255, (mx - 3, my - 3, mx + 3, my + 3))
+    return encode(img)
+
+def marker_position(data):
+    """Normalized center of the white pixels of an image."""
+    img = Image.open(io.BytesIO(data)).convert("L")
+    width, height = img.size
+    pixels = img.tobytes()
+    points = [(i % width, i // width) for i, value in enumerate(pixels) if value > 128]
+    return (sum(x for x, _ in points) / len(points) + 0.5) / width, (sum(y for _, y in points) / len(points) + 0.5) / height
+
+def ui(*buttons):
+    """UIHierarchyDumper context; buttons are (center x, center y from the bottom, width, height)."""
+    lines = ["[Canvas] HUD (Screen Space)"]
+    lines += [f'-- [Button] "B{i}" (Pos: {cx},{cy} Size: {w}x{h})' for i, (cx, cy, w, h) in enumerate(buttons)]
+    return "\n".join(lines)
+
+def round_trip(stage, context, mx, my):
+    data, crop = stage.process(screen_with_marker(mx, my), context)
+    x, y = marker_position(data)
+    action = map_from_crop({"actionType": "Click", "screenPosition": {"x": x, "y": y}}, crop)
+    return action["screenPosition"], crop, Image.open(io.BytesIO(data)).size
+
+@pytest.mark.parametrize("buttons, marker", [
+    (((400, 300, 200, 80), (500, 200, 100, 40)), (450, 390)), # middle of the screen
+    (((40, 580, 60, 30),), (30, 25)), # top-left corner, the margin is clamped at 0
+    (((770, 15, 60, 30),), (785, 590)), # bottom-right corner, clamped at 1
+])
+def test_point_in_crop_maps_back_to_screen(buttons, marker):
+    stage = ImageStage({"crop": "ui", "format": "png", "crop_max_area": 0.9})
+    pos, crop, _ = round_trip(stage, ui(*buttons), *marker)
+    assert crop is not None and all(0.0 <= v <= 1.0 for v in crop)
+    assert crop[0] + crop[2] <= 1.0 and crop[1] + crop[3] <= 1.0
+    assert pos["x"] == pytest.approx(marker[0] / SCREEN[0], abs=0.004)
+    assert pos["y"] == pytest.approx(marker[1] / SCREEN[1], abs=0.004)
+
+def test_clamped_crop_box_edges():
+    stage = ImageStage({"crop": "ui", "crop_margin": 0.05})
+    left, top, width, height = stage.crop_box(ui((40, 580, 60, 30)), *SCREEN)
+    assert (left, top) == (0.0, 0.0)
+    assert width == pytest.approx((70 + 40) / 800) and height == pytest.approx((35 + 30) / 600)
+    left, top, width, height = stage.crop_box(ui((770, 15, 60, 30)), *SCREEN)
+    assert left + width == 1.0 and top + height == 1.0
+
+def test_crop_and_resize_round_trip():
+    stage = ImageStage({"crop": "ui", "format": "png", "max_width": 100})
+    pos, crop, size = round_trip(stage, ui((400, 300, 200, 80)), 420, 310)
+    assert size[0] == 100
+    assert pos["x"] == pytest.approx(420 / 800, abs=0.01) and pos["y"] == pytest.approx(310 / 600, abs=0.01)
+
+def test_crop_skipped_when_it_keeps_most_of_the_screen():
+    stage = ImageStage({"crop": "ui", "crop_max_area": 0.5})
+    assert stage.crop_box(ui((100, 100, 80, 40), (700, 500, 80, 40)), *SCREEN) is None
+    assert stage.crop_box("no ui here", *SCREEN) is None
+
+def test_drag_maps_both_positions_click_only_the_first():
+    crop = (0.5, 0.25, 0.5, 0.5)
+    drag = map_from_crop({"actionType": "Drag", "screenPosition": {"x": 0, "y": 0}, "targetPosition": {"x": 1, "y": 1}}, crop)
+    assert drag["screenPosition"] == {"x": 0.5, "y": 0.25} and drag["targetPosition"] == {"x": 1.0, "y": 0.75}
+    click = map_from_crop({"actionType": "Click", "screenPosition": {"x": 0.5, "y": 0.5}, "targetPosition": {"x": 0, "y": 0}}, crop)
+    assert click["screenPosition"] == {"x": 0.75, "y": 0.5} and click["targetPosition"] == {"x": 0, "y": 0}
+    assert map_from_crop({"actionType": "Click", "screenPosition": "bad"}, crop)["screenPosition"] == "bad"
+
+def test_resize_to_max_width_and_height():
+    stage = ImageStage({"max_width": 400, "max_height": 150})
+    data, crop = stage.process(encode(Image.new("RGB", SCREEN), "JPEG"), "")
+    assert crop is None and Image.open(io.BytesIO(data)).size == (200, 150)
+
+def test_token_budget_clamps_size():
+    stage = ImageStage({"max_tokens": 258})
+    assert stage.estimate_tokens(1600, 1200) == 3 * 2 * 258 # 768px tiles
+    data, _ = stage.process(encode(Image.new("RGB", (1600, 1200)), "JPEG"), "")
+    width, height = Image.open(io.BytesIO(data)).size
+    assert stage.estimate_tokens(width, height) <= 258
+    assert width > 500 # shrinks only as far as the budget needs
+
+def test_max_bytes_lowers_quality_then_size():
+    noise = Image.effect_noise(SCREEN, 64).convert("RGB")
+    content = encode(noise, "JPEG", quality=95)
+    stage = ImageStage({"max_bytes": 20000})
+    data, _ = stage.process(content, "")
+    assert len(data) <= 20000
+
+def test_frame_within_budget_passes_through():
+    content = encode(Image.new("RGB", (320, 240)), "JPEG")
+    assert ImageStage({"max_width": 640, "max_tokens": 258}).process(content, "") is None
@@ -0,0 +1,27 @@
+import asyncio
+import sys
+from types import ModuleType
+
+import fake_genai
+import server
+from server import NativeClientRegistry
+
+def test_models_keep_the_key_they_were_created_with(monkeypatch):
+    monkeypatch.setattr(fake_genai, "LATENCY", 0.0)
+    registry = NativeClientRegistry()
+    model_a = registry.get("key-a", "model", "fake_genai")
+    model_b = registry.get("key-b", "model", "fake_genai") # configures the process-wide key to key-b
+    assert registry.get("key-a", "model", "fake_genai") is model_a
+    asyncio.run(model_a.generate_content_async(["prompt"]))
+    asyncio.run(model_b.generate_content_async(["prompt"]))
+    assert [call[0] for call in fake_genai.calls[-2:]] == ["key-a", "key-b"]
+
+def test_unpinned_model_is_logged(monkeypatch):
+    sdk = ModuleType("flat_genai")
+    sdk.configure = lambda api_key=None: None
+    sdk.GenerativeModel = lambda model_name: object()
+    monkeypatch.setitem(sys.modules, "flat_genai", sdk)
+    logged = []
+    monkeypatch.setattr(server, "log", lambda msg, level="info": logged.append((level, msg)))
+    NativeClientRegistry().get("key", "model", "flat_genai")
+    assert [level for level, msg in logged if "Could not pin" in msg] == ["warning"]
@@ -0,0 +1,34 @@
+import asyncio
+from types import SimpleNamespace
+
+import server
+
+def race_spec(*names):
+    members = [SimpleNamespace(name=name, route="oneshot", conf={}) for name in names]
+    return SimpleNamespace(name="race", route="race", conf={"hedge_delay": 0}, members=members)
+
+def test_members_keep_request_priority_and_thought_push(monkeypatch):
+    seen, thoughts = {}, []
+    async def fake_run_tool(session, spec, context, system_prompt, frame, api_key):
+        timer = server.current_timer.get()
+        seen[spec.name] = timer
+        timer.report_thought(f"{spec.name} thinking")
+        timer.raw_output = f"raw {spec.name}"
+        await asyncio.sleep(1 if spec.name == "slow" else 0.05)
+        return {"thought": "t", "actionType": "Wait", "duration": 1.0}, None
+    monkeypatch.setattr(server, "run_tool", fake_run_tool)
+
+    async def main():
+        timer = server.StageTimer()
+        timer.priority, timer.on_thought = 5, thoughts.append
+        server.current_timer.set(timer)
+        action, err = await server.execute_race(race_spec("fast", "slow"), None, "", "", None, "")
+        return timer, action, err
+    timer, action, err = asyncio.run(main())
+
+    assert err is None and action["actionType"] == "Wait"
+    assert {name: t.priority for name, t in seen.items()} == {"fast": 5, "slow": 5}
+    assert all(t is not timer for t in seen.values()) # members are timed separately
+    assert "fast thinking" in thoughts
+    assert timer.raw_output == "raw fast"
+    assert set(timer.stages) == {"backend"}
@@ -0,0 +1,39 @@
+import asyncio
+
+from server import SPECULATION_PRIORITY, RateBucket
+
+def serve_order(priorities):
+    """Order in which waiters with `priorities` (queued in that order) get a token from a full bucket."""
+    async def run():
+        bucket = RateBucket("test")
+        bucket.configure({"rpm": 6000, "burst": 1})
+        await bucket.acquire() # take the only token so everything after it queues
+        served = []
+        async def wait(name, priority):
+            await bucket.acquire(priority)
+            served.append(name)
+        tasks = []
+        for name, priority in priorities:
+            tasks.append(asyncio.create_task(wait(name, priority)))
+            await asyncio.sleep(0) # queue them in this order
+        await asyncio.gather(*tasks)
+        return served
+    return asyncio.run(run())
+
+def test_higher_priority_served_first():
+    assert serve_order([("low", -1), ("normal", 0), ("high", 5)]) == ["high", "normal", "low"]
+
+def test_speculation_queues_behind_interactive_requests():
+    assert serve_order([("speculative", SPECULATION_PRIORITY), ("interactive", 0)]) == ["interactive", "speculative"]
+
+def test_equal_priority_served_in_arrival_order():
+    assert serve_order([("a", 0), ("b", 0), ("c", 0)]) == ["a", "b", "c"]
+
+def test_empty_bucket_serves_immediately():
+    async def run():
+        bucket = RateBucket("test")
+        bucket.configure({"rpm": 60, "burst": 2})
+        await asyncio.wait_for(bucket.acquire(), 0.1)
+        await asyncio.wait_for(bucket.acquire(), 0.1)
+        assert bucket.queue_depth() == 0
+    asyncio.run(run())
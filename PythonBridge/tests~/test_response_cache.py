@@ -0,0 +1,70 @@
+import asyncio
+import io
+
+import server
+from server import Frame, ResponseCache
+
+CLICK = {"actionType": "Click", "screenPosition": {"x": 0.5, "y": 0.5}}
+
+def make_cache(**conf):
+    cache = ResponseCache()
+    cache.apply_config({"enabled": True, **conf})
+    return cache
+
+def lookup(cache, key):
+    return asyncio.run(cache.lookup(key))
+
+def png(shade):
+    """Frame of a horizontal gradient, brightened by `shade`."""
+    from PIL import Image
+    img = Image.new("L", (90, 80))
+    img.putdata([min(255, x * 2 + shade) for _ in range(80) for x in range(90)])
+    out = io.BytesIO()
+    img.save(out, "PNG")
+    return Frame(out.getvalue(), "unused.jpg")
+
+def test_hit_within_distance_threshold():
+    cache = make_cache(max_distance=4)
+    cache.store(("text", 0b101100), CLICK)
+    assert lookup(cache, ("text", 0b101100 ^ 0b1011)) == CLICK # 3 bits apart
+    assert cache.hits == 1
+
+def test_miss_outside_distance_threshold_or_text():
+    cache = make_cache(max_distance=4)
+    cache.store(("text", 0), CLICK)
+    assert lookup(cache, ("text", 0b11111)) is None # 5 bits apart
+    assert lookup(cache, ("other text", 0)) is None
+    assert cache.misses == 2
+
+def test_returned_action_is_a_copy():
+    cache = make_cache()
+    cache.store(("text", 0), CLICK)
+    lookup(cache, ("text", 0))["actionType"] = "Wait"
+    assert lookup(cache, ("text", 0))["actionType"] == "Click"
+
+def test_ttl_expiry(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(server.time, "time", lambda: now[0])
+    cache = make_cache(ttl_seconds=60)
+    cache.store(("text", 0), CLICK)
+    now[0] += 59
+    assert lookup(cache, ("text", 1)) == CLICK
+    now[0] += 2
+    assert lookup(cache, ("text", 1)) is None
+    assert cache.entries == {} and cache.by_text == {}
+
+def test_max_entries_drops_least_recently_used():
+    cache = make_cache(max_entries=2, max_distance=0)
+    cache.store(("a", 0), CLICK)
+    cache.store(("b", 0), CLICK)
+    lookup(cache, ("a", 0)) # "b" is now the oldest
+    cache.store(("c", 0), CLICK)
+    assert list(cache.entries) == [("a", 0), ("c", 0)]
+    assert "b" not in cache.by_text
+
+def test_similar_frames_share_a_key():
+    cache = make_cache()
+    key = cache.make_key(png(0), "tool", "ctx", "prompt")
+    cache.store(key, CLICK)
+    assert lookup(cache, cache.make_key(png(3), "tool", " ctx ", "prompt")) == CLICK
+    assert lookup(cache, cache.make_key(png(0), "tool", "other ctx", "prompt")) is None
@@ -0,0 +1,140 @@
+import asyncio
+import io
+from types import SimpleNamespace
+
+import pytest
+from PIL import Image
+
+import server
+from server import SPECULATION_PRIORITY, BridgeSession, ConfigSnapshot, Frame, Speculator
+
+PROMPT = "Play the game."
+CONTEXT = "[Canvas] HUD\n-- [Button] \"Play\" (Pos: 400,300 Size: 100x40)"
+
+def screen(flip=False):
+    """Gradient frame; flipped, its perceptual hash differs in every bit."""
+    img = Image.new("L", (90, 80))
+    img.putdata([(89 - x if flip else x) * 2 for _ in range(80) for x in range(90)])
+    out = io.BytesIO()
+    img.save(out, "PNG")
+    return out.getvalue()
+
+class FakeTool:
+    """Stands in for run_tool: answers after `delay`, recording the priority it ran at."""
+    def __init__(self, delay=0.0, err=None):
+        self.delay, self.err = delay, err
+        self.calls = []
+
+    async def __call__(self, session, spec, context, system_prompt, frame, api_key):
+        self.calls.append(server.current_timer.get().priority)
+        await asyncio.sleep(self.delay)
+        if self.err: return None, self.err
+        return {"thought": f"speculated {len(self.calls)}", "actionType": "Click", "screenPosition": {"x": 0.25, "y": 0.5}}, None
+
+@pytest.fixture
+def bridge(monkeypatch):
+    """Configure a stateless selected tool with speculation on; returns (speculator, tool, outcomes)."""
+    def configure(tool=None, speculation=None, tool_conf=None):
+        config = {"selected_tool": "fake", "speculation": {"enabled": True} if speculation is None else speculation,
+                  "tools": {"fake": tool_conf or {"command": "http", "url": "http://localhost:1"}}}
+        snapshot = ConfigSnapshot(config, PROMPT)
+        monkeypatch.setattr(server, "config_registry", SimpleNamespace(current=lambda: snapshot))
+        tool = tool or FakeTool()
+        monkeypatch.setattr(server, "run_tool", tool)
+        outcomes = []
+        inc = server.metrics.inc
+        def record(name, value=1, **labels):
+            if name == "aitester_speculations_total": outcomes.append(labels["outcome"])
+            if name == "aitester_speculation_saved_seconds_total": outcomes.append(("saved", value))
+            inc(name, value, **labels)
+        monkeypatch.setattr(server.metrics, "inc", record)
+        return Speculator(), tool, outcomes
+    return configure
+
+def speculate_then_ask(speculator, ask_frame=None, ask_context=CONTEXT, prompt=PROMPT, tool_name="fake", before_ask=None):
+    async def run():
+        session = BridgeSession("agent")
+        status = await speculator.start(session, screen(), CONTEXT, "")
+        speculation = session.speculation
+        if before_ask: await before_ask(session)
+        frame = Frame(ask_frame or screen(), "unused.jpg")
+        action = await speculator.take(session, tool_name, prompt, frame, ask_context)
+        await asyncio.sleep(0) # let a cancellation land
+        return status, action, speculation, session
+    return asyncio.run(run())
+
+def test_disabled_without_config_block(bridge):
+    speculator, tool, _ = bridge(speculation={})
+    status, action, speculation, _ = speculate_then_ask(speculator)
+    assert status == "disabled" and action is None and speculation is None
+    assert tool.calls == []
+
+def test_stateful_tool_is_not_speculated(bridge):
+    speculator, tool, _ = bridge(tool_conf={"command": "internal", "persistent": True})
+    status, *_ = speculate_then_ask(speculator)
+    assert status == "unsupported_tool" and tool.calls == []
+
+def test_hit_returns_the_speculated_answer(bridge):
+    speculator, tool, outcomes = bridge(tool=FakeTool(delay=0.05))
+    status, action, speculation, session = speculate_then_ask(speculator)
+    assert status == "started"
+    assert action["thought"] == "speculated 1" and action["screenPosition"] == {"x": 0.25, "y": 0.5}
+    assert tool.calls == [SPECULATION_PRIORITY]
+    assert session.speculation is None
+    assert outcomes[:2] == ["started", "hit"]
+    assert outcomes[2][0] == "saved" and 0 <= outcomes[2][1] <= speculation.finished - speculation.started + 0.001
+
+def test_hit_with_a_slightly_different_frame(bridge):
+    speculator, _, outcomes = bridge()
+    img = Image.open(io.BytesIO(screen())).convert("L")
+    img.putpixel((45, 40), 255)
+    out = io.BytesIO()
+    img.save(out, "PNG")
+    _, action, *_ = speculate_then_ask(speculator, ask_frame=out.getvalue())
+    assert action is not None and "hit" in outcomes
+
+@pytest.mark.parametrize("ask, outcome", [
+    ({"prompt": "Another prompt."}, "config_changed"),
+    ({"tool_name": "other"}, "config_changed"),
+    ({"ask_context": CONTEXT + "\n-- [Button] \"Quit\" (Pos: 400,200 Size: 100x40)"}, "context_changed"),
+    ({"ask_frame": screen(flip=True)}, "frame_changed"),
+])
+def test_mismatch_discards_and_cancels(bridge, ask, outcome):
+    speculator, _, outcomes = bridge(tool=FakeTool(delay=5.0))
+    status, action, speculation, session = speculate_then_ask(speculator, **ask)
+    assert status == "started" and action is None
+    assert session.speculation is None and speculation.task.cancelled()
+    assert outcomes == ["started", outcome]
+
+def test_expired(bridge):
+    speculator, _, outcomes = bridge(tool=FakeTool(delay=5.0), speculation={"enabled": True, "ttl_seconds": 10})
+    async def age(session): session.speculation.started -= 11
+    _, action, speculation, _ = speculate_then_ask(speculator, before_ask=age)
+    assert action is None and speculation.task.cancelled()
+    assert outcomes == ["started", "expired"]
+
+def test_context_ignored_when_match_context_is_off(bridge):
+    speculator, _, outcomes = bridge(speculation={"enabled": True, "match_context": False})
+    _, action, *_ = speculate_then_ask(speculator, ask_context="something else")
+    assert action is not None and "hit" in outcomes
+
+def test_failed_speculation_falls_back(bridge):
+    speculator, _, outcomes = bridge(tool=FakeTool(err="backend down"))
+    _, action, _, session = speculate_then_ask(speculator)
+    assert action is None and session.speculation is None
+    assert outcomes == ["started", "failed"]
+
+def test_new_speculation_supersedes_the_previous(bridge):
+    speculator, tool, outcomes = bridge(tool=FakeTool(delay=5.0))
+    async def run():
+        session = BridgeSession("agent")
+        await speculator.start(session, screen(), CONTEXT, "")
+        first = session.speculation
+        await speculator.start(session, screen(), CONTEXT, "")
+        await asyncio.sleep(0)
+        second = session.speculation
+        speculator.discard(session, "test_done")
+        return first, second
+    first, second = asyncio.run(run())
+    assert first.task.cancelled() and second is not first
+    assert outcomes == ["started", "superseded", "started", "test_done"]
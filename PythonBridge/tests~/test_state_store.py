@@ -0,0 +1,52 @@
+import asyncio
+import sqlite3
+import time
+
+import server
+from server import ResponseCache
+from state_store import StateStore
+
+def test_writes_do_not_wait_for_another_process_lock(tmp_path):
+    path = str(tmp_path / "bridge.db")
+    store = StateStore(path, busy_timeout=2.0)
+    other = sqlite3.connect(path, isolation_level=None)
+    other.execute("BEGIN IMMEDIATE") # another worker holds the write lock
+    try:
+        start = time.perf_counter()
+        store.save_history("s1", "tool", {"turns": [["ask", "answer"]]})
+        store.assign("s1", 1)
+        assert time.perf_counter() - start < 0.2
+    finally:
+        other.execute("COMMIT")
+        other.close()
+    store.flush()
+    assert store.load_history("s1", "tool") == {"turns": [["ask", "answer"]]}
+    assert store.assignments() == {"s1": 1}
+    store.close()
+
+def test_reads_see_earlier_writes(tmp_path):
+    store = StateStore(str(tmp_path / "bridge.db"))
+    store.save_history("s1", "tool", {"turns": []})
+    assert store.load_history("s1", "tool") == {"turns": []}
+    store.drop_session("s1")
+    assert store.load_history("s1", "tool") is None
+    store.close()
+
+def test_failed_write_is_reported(tmp_path):
+    errors = []
+    store = StateStore(str(tmp_path / "bridge.db"), on_error=errors.append)
+    store._write("INSERT INTO missing_table VALUES (1)")
+    store.flush()
+    assert store.errors == 1 and isinstance(errors[0], sqlite3.OperationalError)
+    store.close()
+
+def test_cache_entry_shared_between_workers(tmp_path, monkeypatch):
+    store = StateStore(str(tmp_path / "bridge.db"))
+    monkeypatch.setattr(server, "state_store", store)
+    action = {"actionType": "Click", "screenPosition": {"x": 0.5, "y": 0.5}}
+    writer, reader = ResponseCache(), ResponseCache()
+    for cache in (writer, reader): cache.apply_config({"enabled": True})
+    writer.store(("text", 0b1000), action)
+    assert asyncio.run(reader.lookup(("text", 0b1001))) == action
+    assert reader.hits == 1 and ("text", 0b1000) in reader.entries
+    store.close()
@@ -0,0 +1,73 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+from server import NativeGeminiEngine, StreamingActionParser, extract_json
+
+CLICK = '{"actionType": "Click", "screenPosition": {"x": 0.25, "y": 0.75}, "thought": "open the menu"}'
+
+def feed_until_action(chunks):
+    """Index of the chunk after which the parser first had an action, and the parser."""
+    parser = StreamingActionParser()
+    for i, chunk in enumerate(chunks):
+        parser.feed(chunk)
+        if parser.action(): return i, parser
+    return None, parser
+
+def test_ansi_and_noise_between_chunks():
+    chunks = ['\x1b[2K\x1b[1GLoading {spinner}...\n', '```json\n{"actionType": "Cl', 'ick",\x1b[3', '2m "screenPosition": {"x": 0.25, "y": 0.75}', '\x1b[0m, "thought": "open', ' the menu"}\n```']
+    i, parser = feed_until_action(chunks)
+    assert i == 4 # before "thought" has finished
+    assert not parser.closed
+    assert parser.action()["screenPosition"] == {"x": 0.25, "y": 0.75}
+    for chunk in chunks[i + 1:]: parser.feed(chunk)
+    assert "\x1b" not in parser.text()
+    assert parser.fields["thought"] == "open the menu"
+
+def test_action_split_mid_key():
+    chunks = ['{"actio', 'nType": "Drag", "screenPos', 'ition": {"x": 0.1, "y": 0.2}, "target', 'Position": {"x": 0.3, "y": 0.4}, "thought": "drag it"}']
+    i, parser = feed_until_action(chunks)
+    assert i == 3
+    action = parser.action()
+    assert action["actionType"] == "Drag" and action["targetPosition"] == {"x": 0.3, "y": 0.4}
+
+def test_partial_thought_filled_in_before_it_closes():
+    parser = StreamingActionParser()
+    parser.feed('{"thought": "still thinking')
+    parser.feed('", "actionType": "KeyPress", "keyName": "Esc",')
+    assert parser.action()["keyName"] == "Esc"
+
+class FakeModel:
+    """Streams `chunks` the way generate_content_async(stream=True) does."""
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    async def generate_content_async(self, contents, stream=False):
+        async def stream_chunks():
+            for chunk in self.chunks: yield SimpleNamespace(text=chunk)
+        return SimpleNamespace(__aiter__=stream_chunks)
+
+def generate(chunks):
+    async def run():
+        engine = NativeGeminiEngine.__new__(NativeGeminiEngine)
+        engine.finishing = set()
+        completed = []
+        text = await engine.generate(FakeModel(chunks), ["prompt"], stream=True, on_complete=completed.append)
+        await asyncio.gather(*engine.finishing)
+        return text, completed
+    return asyncio.run(run())
+
+def test_generate_returns_early_action_and_finishes_in_background():
+    chunks = [CLICK[:60], CLICK[60:90], CLICK[90:]]
+    text, completed = generate(chunks)
+    assert json.loads(text)["screenPosition"] == {"x": 0.25, "y": 0.75}
+    assert completed == [CLICK]
+
+def test_generate_falls_back_to_full_output_without_early_action():
+    # Wait without a duration is only actionable once the object closes; a stream that never
+    # yields a parseable member returns the raw text for extract_json.
+    for answer in ['Sure!\n```json\n{"thought": "nothing to do", "actionType": "Wait"}\n```', 'Here you go: {thought: unquoted, actionType: Click}']:
+        chunks = [answer[:20], answer[20:45], answer[45:]]
+        text, completed = generate(chunks)
+        assert text == answer and completed == [answer]
+    assert extract_json(generate(['Sure!\n```json\n{"thought": "nothing', ' to do", "actionType": "Wait"}\n```'])[0]) == {"thought": "nothing to do", "actionType": "Wait"}
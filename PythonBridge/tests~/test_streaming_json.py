@@ -0,0 +1,41 @@
+from server import StreamingJsonExtractor
+
+def feed_all(chunks):
+    """First object the extractor returns while `chunks` arrive, and the extractor."""
+    extractor = StreamingJsonExtractor()
+    for chunk in chunks:
+        parsed = extractor.feed(chunk)
+        if parsed is not None: return parsed, extractor
+    return None, extractor
+
+def test_object_split_across_chunks():
+    parsed, _ = feed_all(['Thinking...\n{"thought": "open', ' the menu", "actionType": "Cl', 'ick", "screenPosition": {"x": 0.5,', ' "y": 0.25}}\n'])
+    assert parsed == {"thought": "open the menu", "actionType": "Click", "screenPosition": {"x": 0.5, "y": 0.25}}
+
+def test_returns_as_soon_as_object_closes():
+    extractor = StreamingJsonExtractor()
+    assert extractor.feed('{"actionType": "Wait"') is None
+    assert extractor.feed('}') == {"actionType": "Wait"}
+
+def test_escaped_quotes_and_braces_inside_strings():
+    parsed, _ = feed_all(['{"thought": "press \\"OK\\" {not a brace}', ' and }} more", "actionType": "Wait"}'])
+    assert parsed == {"thought": 'press "OK" {not a brace} and }} more', "actionType": "Wait"}
+
+def test_backslash_escape_split_between_chunks():
+    parsed, _ = feed_all(['{"thought": "say \\', '"hi\\"", "actionType": "Wait"}'])
+    assert parsed["thought"] == 'say "hi"'
+
+def test_ansi_escape_split_between_chunks():
+    parsed, extractor = feed_all(['\x1b[3', '2m{"actionType": "Wait"', '\x1b[0', 'm}'])
+    assert parsed == {"actionType": "Wait"}
+    assert "\x1b" not in extractor.text()
+
+def test_noise_that_looks_like_an_object_is_skipped():
+    parsed, _ = feed_all(["progress {50%} ", '{"actionType": "Wait"}'])
+    assert parsed == {"actionType": "Wait"}
+
+def test_unterminated_trailing_object():
+    parsed, extractor = feed_all(['{"actionType": "Wait"', ', "thought": "cut off'])
+    assert parsed is None
+    assert extractor.depth == 1
+    assert extractor.text() == '{"actionType": "Wait", "thought": "cut off'
@@ -0,0 +1,252 @@
+"""Append-only store of recorded /ask exchanges, and a replay tool for offline backend evaluation.
+
+The bridge records into one directory per server run (under traces~ by default) when the "trace" config block is enabled:
+
+    trace.dat   records: [u32 header length][header JSON][u32 frame length][frame bytes]
+    trace.idx   one JSON line per record: seq, offset, time, session_id, tool, route, ok, actionType, elapsed_ms
+
+The index is small and streamed line by line, so large traces can be filtered without reading frames.
+Replay feeds the recorded frames and contexts through any tool in a tools_config.json, in recorded
+order per session, and compares the actions and latency with the recording:
+
+    python trace_store.py list traces~/20261016-120000
+    python trace_store.py replay traces~/20261016-120000 --tool ollama_llava --output replay.json
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import queue
+import struct
+import sys
+import threading
+import time
+
+DATA_FILE = "trace.dat"
+INDEX_FILE = "trace.idx"
+LENGTH = struct.Struct("<I")
+INDEX_FIELDS = ("session_id", "tool", "route", "ok", "elapsed_ms")
+
+class TraceWriter:
+    """Appends records from a background thread so request handlers never wait on disk."""
+    def __init__(self, directory, max_bytes=0, queue_size=256):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_bytes = max_bytes # stop recording beyond this data file size (0 = unlimited)
+        self.data = open(os.path.join(directory, DATA_FILE), "ab")
+        self.index = open(os.path.join(directory, INDEX_FILE), "a", encoding="utf-8")
+        self.offset = self.data.tell()
+        with open(os.path.join(directory, INDEX_FILE), encoding="utf-8") as f:
+            self.seq = sum(1 for _ in f) # continue numbering when appending to an existing trace
+        self.recorded = 0
+        self.dropped = 0
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.thread = threading.Thread(target=self._write_loop, name="trace-writer", daemon=True)
+        self.thread.start()
+
+    def record(self, header, frame):
+        """Queue one record. Returns False (and counts a drop) if the writer is behind or full."""
+        if self.max_bytes and self.offset >= self.max_bytes:
+            self.dropped += 1
+            return False
+        try:
+            self.queue.put_nowait((header, frame))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def _write_loop(self):
+        while True:
+            item = self.queue.get()
+            batch = [item]
+            while not self.queue.empty(): batch.append(self.queue.get_nowait())
+            for entry in batch:
+                if entry is not None: self._append(*entry)
+            self.data.flush()
+            self.index.flush()
+            if None in batch: return
+
+    def _append(self, header, frame):
+        self.seq += 1
+        header = dict(header, seq=self.seq)
+        header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+        offset = self.offset
+        self.data.write(LENGTH.pack(len(header_bytes)) + header_bytes + LENGTH.pack(len(frame)) + frame)
+        self.offset += 2 * LENGTH.size + len(header_bytes) + len(frame)
+        entry = {"seq": self.seq, "offset": offset, "time": header.get("time")}
+        entry.update({k: header.get(k) for k in INDEX_FIELDS})
+        entry["actionType"] = (header.get("action") or {}).get("actionType")
+        self.index.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self.recorded += 1
+
+    def close(self, timeout=5.0):
+        self.queue.put(None)
+        self.thread.join(timeout)
+        self.data.close()
+        self.index.close()
+
+class TraceReader:
+    def __init__(self, directory):
+        self.directory = directory
+        self.data_path = os.path.join(directory, DATA_FILE)
+        self.index_path = os.path.join(directory, INDEX_FILE)
+        if not os.path.exists(self.index_path):
+            raise FileNotFoundError(f"No trace index in {directory}")
+
+    def entries(self):
+        """Index entries in recorded order, streamed from disk."""
+        with open(self.index_path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line: yield json.loads(line)
+
+    def read(self, entry, data_file=None):
+        """(header, frame bytes) of one index entry. Pass an open data file to avoid reopening it."""
+        f = data_file or open(self.data_path, "rb")
+        try:
+            f.seek(entry["offset"])
+            header = json.loads(f.read(LENGTH.unpack(f.read(LENGTH.size))[0]))
+            frame = f.read(LENGTH.unpack(f.read(LENGTH.size))[0])
+            return header, frame
+        finally:
+            if data_file is None: f.close()
+
+# --- Replay ---
+def percentile(sorted_values, pct):
+    if not sorted_values: return 0.0
+    k = (len(sorted_values) - 1) * pct / 100.0
+    lo, hi = int(k), min(int(k) + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+def compare_actions(recorded, replayed, tolerance):
+    """(same actionType, same action within `tolerance` normalized screen distance)."""
+    if not recorded or not replayed: return False, False
+    same_type = str(recorded.get("actionType", "")).lower() == str(replayed.get("actionType", "")).lower()
+    a, b = recorded.get("screenPosition") or {}, replayed.get("screenPosition") or {}
+    try:
+        distance = math.hypot(float(a["x"]) - float(b["x"]), float(a["y"]) - float(b["y"]))
+    except (KeyError, TypeError, ValueError):
+        distance = 0.0 # no comparable positions (Wait, TypeText, ...)
+    return same_type, same_type and distance <= tolerance
+
+async def replay_trace(args):
+    import server # heavy import, only needed for replay
+    server.logger.set_level(args.log_level)
+    server.CONFIG_FILE = os.path.abspath(args.config)
+    if args.prompt: server.SYSTEM_PROMPT_FILE = os.path.abspath(args.prompt)
+    snapshot = server.config_registry.current()
+    if not snapshot.config: sys.exit(f"[Replay] Cannot load config {args.config}: {snapshot.config_error}")
+    tool_name = args.tool or snapshot.config.get("selected_tool")
+    spec = snapshot.tools.get(tool_name)
+    if not spec: sys.exit(f"[Replay] Tool '{tool_name}' is not defined or invalid in {args.config}.")
+
+    reader = TraceReader(args.trace)
+    sessions, total = {}, 0
+    for entry in reader.entries():
+        if args.only_ok and not entry.get("ok"): continue
+        if args.session and entry.get("session_id") != args.session: continue
+        sessions.setdefault(entry.get("session_id"), []).append(entry)
+        total += 1
+        if args.limit and total >= args.limit: break
+    print(f"[Replay] {total} records from {len(sessions)} session(s) through '{tool_name}' ({spec.route})")
+
+    gate = asyncio.Semaphore(args.concurrency)
+    rows = []
+    async def run_session(session_id, entries):
+        # Stateful backends see the steps of a session in recorded order
+        session = server.session_manager.get(f"replay-{session_id}")
+        with open(reader.data_path, "rb") as data_file:
+            for entry in entries:
+                header, frame = reader.read(entry, data_file)
+                async with gate:
+                    timer = server.StageTimer()
+                    server.current_timer.set(timer)
+                    try:
+                        action, err = await server.run_tool(session, spec, header.get("context", ""),
+                                                            snapshot.system_prompt, session.new_frame(frame), args.api_key)
+                        if action: action = server.normalize_response(action)
+                    except Exception as e:
+                        action, err = None, f"Internal Error: {e}"
+                    elapsed_ms = timer.elapsed() * 1000
+                same_type, same_action = compare_actions(header.get("action"), action, args.tolerance)
+                rows.append({
+                    "seq": header.get("seq"), "session_id": session_id,
+                    "recorded_tool": header.get("tool"), "recorded_ms": header.get("elapsed_ms"), "replay_ms": round(elapsed_ms, 1),
+                    "recorded_action": header.get("action"), "replay_action": action, "error": err,
+                    "same_type": same_type, "same_action": same_action
+                })
+    try:
+        await asyncio.gather(*(run_session(sid, entries) for sid, entries in sessions.items()))
+    finally:
+        await server.worker_pool_manager.stop_all()
+        await server.http_engine.close()
+        server.session_manager.drop_all()
+    return summarize(tool_name, sorted(rows, key=lambda r: r["seq"] or 0))
+
+def summarize(tool_name, rows):
+    ok = [r for r in rows if not r["error"]]
+    recorded = sorted(r["recorded_ms"] for r in rows if r["recorded_ms"] is not None)
+    replayed = sorted(r["replay_ms"] for r in ok)
+    summary = {
+        "tool": tool_name,
+        "records": len(rows),
+        "errors": len(rows) - len(ok),
+        "type_match_rate": round(sum(r["same_type"] for r in rows) / len(rows), 3) if rows else 0.0,
+        "action_match_rate": round(sum(r["same_action"] for r in rows) / len(rows), 3) if rows else 0.0
+    }
+    for pct in (50, 95, 99):
+        summary[f"recorded_p{pct}_ms"] = round(percentile(recorded, pct), 1)
+        summary[f"replay_p{pct}_ms"] = round(percentile(replayed, pct), 1)
+    return {"summary": summary, "rows": rows}
+
+def list_trace(args):
+    reader = TraceReader(args.trace)
+    count, by_tool = 0, {}
+    for entry in reader.entries():
+        count += 1
+        by_tool.setdefault((entry.get("tool"), entry.get("route")), []).append(entry.get("elapsed_ms") or 0.0)
+        if args.verbose:
+            print(f"#{entry['seq']:<6} {time.strftime('%H:%M:%S', time.localtime(entry.get('time') or 0))} "
+                  f"{entry.get('session_id')}  {entry.get('tool')}/{entry.get('route')}  "
+                  f"{'ok ' if entry.get('ok') else 'ERR'} {entry.get('actionType')}  {entry.get('elapsed_ms')} ms")
+    print(f"{count} records, {os.path.getsize(reader.data_path) / 1e6:.1f} MB")
+    for (tool, route), latencies in sorted(by_tool.items(), key=lambda kv: str(kv[0])):
+        latencies.sort()
+        print(f"  {tool}/{route}: {len(latencies)} records, p50 {percentile(latencies, 50):.0f} ms, p95 {percentile(latencies, 95):.0f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and replay bridge traces")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_list = sub.add_parser("list", help="Summarize a trace directory")
+    p_list.add_argument("trace")
+    p_list.add_argument("-v", "--verbose", action="store_true", help="One line per record")
+
+    bridge_dir = os.path.dirname(os.path.abspath(__file__))
+    p_replay = sub.add_parser("replay", help="Run recorded frames through a tool and compare")
+    p_replay.add_argument("trace")
+    p_replay.add_argument("--config", default=os.path.join(bridge_dir, "tools_config.json"))
+    p_replay.add_argument("--prompt", default=os.path.join(bridge_dir, "system_prompt.txt"))
+    p_replay.add_argument("--tool", help="Tool to replay through (default: the config's selected_tool)")
+    p_replay.add_argument("--api-key", default="", help="API key for tools that need one")
+    p_replay.add_argument("--session", help="Only replay this recorded session")
+    p_replay.add_argument("--limit", type=int, default=0, help="Replay at most N records")
+    p_replay.add_argument("--only-ok", action="store_true", help="Skip records that failed when recorded")
+    p_replay.add_argument("--concurrency", type=int, default=4, help="Sessions replayed in parallel")
+    p_replay.add_argument("--tolerance", type=float, default=0.05, help="Max normalized position distance for a matching action")
+    p_replay.add_argument("--log-level", default="warning", help="Bridge log level while replaying")
+    p_replay.add_argument("--output", help="Write the summary and per-record comparison to this JSON file")
+    args = parser.parse_args()
+
+    if args.command == "list":
+        return list_trace(args)
+
+    result = asyncio.run(replay_trace(args))
+    print(json.dumps(result["summary"], indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f: json.dump(result, f, indent=2, ensure_ascii=False)
+        print(f"[Replay] Wrote {args.output}")
+
+if __name__ == "__main__":
+    main()
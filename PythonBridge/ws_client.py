@@ -0,0 +1,69 @@
+"""Command-line stand-in for Unity on the bridge's /ws WebSocket endpoint.
+
+Connects once, binds a session, uploads frames as binary messages and prints what the server
+pushes back (partial thoughts, the final action, errors) with per-step latency:
+
+    python ws_client.py --session bot1 --steps 5
+    python ws_client.py --frame shot.jpg --context "$(cat ui_dump.txt)" --steps 20
+
+Requires the websockets package (pip install websockets), which the server also needs for /ws.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import urllib.parse
+
+BRIDGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def main():
+    parser = argparse.ArgumentParser(description="WebSocket test client for the AI Unity Tester bridge server")
+    parser.add_argument("--url", default="ws://127.0.0.1:8000/ws")
+    parser.add_argument("--session", default="default", help="Session bound to the connection")
+    parser.add_argument("--api-key", default="", help="API key for native tools")
+    parser.add_argument("--frame", default=os.path.join(BRIDGE_DIR, "last_frame.jpg"), help="JPEG/PNG sent every step")
+    parser.add_argument("--context", default="Main menu. Buttons: Play (0.5, 0.6), Quit (0.5, 0.3).")
+    parser.add_argument("--steps", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=120.0, help="Seconds to wait for each answer")
+    parser.add_argument("--reset", action="store_true", help="Reset the session's memory before the first step")
+    args = parser.parse_args()
+
+    try:
+        from websockets.sync.client import connect
+    except ImportError:
+        sys.exit("[WS] The websockets package is not installed (pip install websockets).")
+
+    with open(args.frame, "rb") as f: frame = f.read()
+    query = {"session_id": args.session}
+    if args.api_key: query["api_key"] = args.api_key
+    url = f"{args.url}?{urllib.parse.urlencode(query)}"
+
+    with connect(url, max_size=None) as ws:
+        print(f"[WS] {json.loads(ws.recv(args.timeout))}")
+        if args.reset:
+            ws.send(json.dumps({"type": "reset"}))
+            print(f"[WS] {json.loads(ws.recv(args.timeout))}")
+        failures = 0
+        for step in range(1, args.steps + 1):
+            started = time.perf_counter()
+            ws.send(json.dumps({"type": "ask", "request_id": step, "context": args.context}))
+            ws.send(frame)
+            while True:
+                message = json.loads(ws.recv(args.timeout))
+                if message.get("request_id") != step: continue
+                if message["type"] == "thought":
+                    print(f"  ... {message['text'][-100:]}")
+                    continue
+                ms = (time.perf_counter() - started) * 1000
+                action = message["action"]
+                if message["type"] == "error":
+                    failures += 1
+                    print(f"[WS] #{step} ERROR after {ms:.0f} ms: {message['error']}")
+                else:
+                    print(f"[WS] #{step} {action['actionType']} at {action['screenPosition']} in {ms:.0f} ms: {action['thought'][:100]}")
+                break
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
@@ -23,6 +23,15 @@ namespace AIUnityTester.Core
         [Tooltip("API Key for Gemini/Claude. Required for Direct modes AND Native Bridge (High Speed).")]
         public string apiKey = "";
 
+        [Tooltip("MCP Bridge session ID. Leave empty to get a new isolated session per test run.")]
+        public string bridgeSessionId = "";
+
+        [Tooltip("Keep one WebSocket connection to the MCP Bridge instead of one HTTP request per step.")]
+        public bool bridgeUseWebSocket = false;
+
+        [Tooltip("Send the post-action frame to the MCP Bridge right away so it can think ahead during the action delay (stateless tools only).")]
+        public bool bridgeSpeculate = false;
+
         [Header("Game Context")]
         [TextArea(3, 10)] public string gameDescription = "Describe your game objectives and controls here.";
         public float actionDelay = 1.0f; 
@@ -80,7 +89,7 @@ namespace AIUnityTester.Core
                     // 에디터에서 설정한 포트 읽기 (기본값 8000)
                     int serverPort = PlayerPrefs.GetInt("AITester_ServerPort", 8000);
                     Debug.Log($"[AITesterAgent] Using MCP Bridge Mode (Port: {serverPort})");
-                    return new MCPBridgeClient(serverPort, apiKey);
+                    return new MCPBridgeClient(serverPort, apiKey, bridgeSessionId, bridgeUseWebSocket);
 
                 case ExecutionMode.DirectGeminiFlash:
                     if (string.IsNullOrEmpty(apiKey))
@@ -118,6 +127,7 @@ namespace AIUnityTester.Core
         {
             IsRunning = false;
             StopAllCoroutines();
+            (_llmClient as System.IDisposable)?.Dispose();
 
             // 리포트 저장
             if (recordTestReport && _reportManager != null && _reportManager.IsRecording)
@@ -177,6 +187,16 @@ namespace AIUnityTester.Core
 
                     var execTask = ExecuteAction(decision);
                     yield return new WaitUntil(() => execTask.Status.IsCompleted());
+
+                    if (bridgeSpeculate && _llmClient is MCPBridgeClient bridgeClient)
+                    {
+                        // 딜레이 동안 서버가 다음 행동을 미리 추론 (다음 화면이 다르면 서버가 결과를 버림)
+                        yield return new WaitForEndOfFrame();
+                        Texture2D nextShot = CaptureScreen();
+                        string nextContext = $"[Game Description]\n{gameDescription}\n\n[Current State]\n{GetGameContext()}";
+                        bridgeClient.SpeculateAsync(nextShot, nextContext).Forget();
+                        Destroy(nextShot); // SpeculateAsync는 첫 await 전에 JPG 인코딩을 마침
+                    }
                 }
                 else
                 {
@@ -1,31 +1,62 @@
 using System;
+using System.Collections.Generic;
+using System.IO;
+using System.Net.WebSockets;
 using System.Text;
+using System.Threading;
 using UnityEngine;
 using UnityEngine.Networking;
 using Cysharp.Threading.Tasks;
 using Newtonsoft.Json;
+using Newtonsoft.Json.Linq;
 using AIUnityTester.Data;
 
 namespace AIUnityTester.Network
 {
-    public class MCPBridgeClient : ILLMClient
+    public class MCPBridgeClient : ILLMClient, IDisposable
     {
         private string _baseUrl;
         private const string ENDPOINT = "/ask";
+        private const string SOCKET_ENDPOINT = "/ws";
+        private const string SPECULATE_ENDPOINT = "/speculate";
+        private const int REQUEST_TIMEOUT = 120; // 로컬 LLM은 느릴 수 있음
+        private const int SPECULATE_TIMEOUT = 5; // 서버는 추론을 시작만 하고 바로 응답함
+
+        private ClientWebSocket _socket;
+        private int _requestCounter;
 
         public string ApiKey { get; set; }
         public int Port { get; set; } = 8000;
 
-        public MCPBridgeClient(int port = 8000, string apiKey = null)
+        /// <summary>
+        /// 브릿지 서버에서 이 에이전트의 프레임/대화 기록을 분리하는 세션 ID.
+        /// 여러 에이전트가 하나의 서버를 공유할 때 서로 간섭하지 않도록 합니다.
+        /// </summary>
+        public string SessionId { get; set; }
+
+        /// <summary>
+        /// true면 매 스텝마다 HTTP 요청 대신 하나의 WebSocket(/ws) 연결로 프레임을 보냅니다.
+        /// 연결할 수 없으면 이번 실행 동안 HTTP로 되돌아갑니다.
+        /// </summary>
+        public bool UseWebSocket { get; set; }
+
+        /// <summary>
+        /// WebSocket 모드에서 백엔드가 스트리밍하는 중간 thought를 받습니다.
+        /// </summary>
+        public event Action<string> OnThought;
+
+        public MCPBridgeClient(int port = 8000, string apiKey = null, string sessionId = null, bool useWebSocket = false)
         {
             Port = port;
             ApiKey = apiKey;
+            UseWebSocket = useWebSocket;
+            SessionId = string.IsNullOrEmpty(sessionId) ? Guid.NewGuid().ToString("N") : sessionId;
             _baseUrl = $"http://127.0.0.1:{Port}";
         }
 
         public async UniTask<bool> InitializeAsync()
         {
-            Debug.Log($"[MCPBridgeClient] Initialized (Target: {_baseUrl})");
+            Debug.Log($"[MCPBridgeClient] Initialized (Target: {_baseUrl}, Session: {SessionId})");
             
             // Health check
             try
@@ -58,9 +89,16 @@ namespace AIUnityTester.Network
         {
             byte[] imageBytes = screenshot.EncodeToJPG(75);
 
+            if (UseWebSocket)
+            {
+                ClientWebSocket socket = await ConnectSocketAsync();
+                if (socket != null) return await RequestActionOverSocketAsync(socket, imageBytes, context);
+            }
+
             WWWForm form = new WWWForm();
             form.AddBinaryData("screenshot", imageBytes, "screen.jpg", "image/jpeg");
             form.AddField("context", context); 
+            form.AddField("session_id", SessionId);
             if (!string.IsNullOrEmpty(ApiKey))
             {
                 form.AddField("api_key", ApiKey);
@@ -68,7 +106,7 @@ namespace AIUnityTester.Network
 
             using (UnityWebRequest www = UnityWebRequest.Post(_baseUrl + ENDPOINT, form))
             {
-                www.timeout = 120; // 로컬 LLM은 느릴 수 있음
+                www.timeout = REQUEST_TIMEOUT;
 
                 try 
                 {
@@ -91,6 +129,137 @@ namespace AIUnityTester.Network
             }
         }
 
+        /// <summary>
+        /// 액션 실행 직후의 화면을 미리 보내, 게임이 액션을 진행하는 동안 서버가 다음 행동을 먼저 추론하게 합니다.
+        /// 다음 RequestActionAsync의 화면과 컨텍스트가 충분히 비슷하면 서버가 미리 계산한 결과를 바로 돌려주고,
+        /// 다르면 버립니다. 상태가 없는 도구(native one-shot, http, oneshot)에서만 동작합니다.
+        /// </summary>
+        /// <returns>서버가 추론을 시작했으면 true</returns>
+        public async UniTask<bool> SpeculateAsync(Texture2D screenshot, string context)
+        {
+            WWWForm form = new WWWForm();
+            form.AddBinaryData("screenshot", screenshot.EncodeToJPG(75), "screen.jpg", "image/jpeg");
+            form.AddField("context", context);
+            form.AddField("session_id", SessionId);
+            if (!string.IsNullOrEmpty(ApiKey))
+            {
+                form.AddField("api_key", ApiKey);
+            }
+
+            using (UnityWebRequest www = UnityWebRequest.Post(_baseUrl + SPECULATE_ENDPOINT, form))
+            {
+                www.timeout = SPECULATE_TIMEOUT;
+                try
+                {
+                    await www.SendWebRequest();
+                    if (www.result != UnityWebRequest.Result.Success) return false;
+
+                    string status = JObject.Parse(www.downloadHandler.text).Value<string>("status");
+                    if (status != "started") Debug.Log($"[MCPBridgeClient] Speculation not started: {status}");
+                    return status == "started";
+                }
+                catch (Exception e)
+                {
+                    Debug.LogWarning($"[MCPBridgeClient] Speculation failed: {e.Message}");
+                    return false;
+                }
+            }
+        }
+
+        private async UniTask<ClientWebSocket> ConnectSocketAsync()
+        {
+            if (_socket != null && _socket.State == WebSocketState.Open) return _socket;
+            _socket?.Dispose();
+            _socket = null;
+
+            var socket = new ClientWebSocket();
+            string url = $"ws://127.0.0.1:{Port}{SOCKET_ENDPOINT}?session_id={Uri.EscapeDataString(SessionId)}";
+            try
+            {
+                using (var cts = new CancellationTokenSource(TimeSpan.FromSeconds(5)))
+                {
+                    await socket.ConnectAsync(new Uri(url), cts.Token);
+                    await ReceiveTextAsync(socket, cts.Token); // {"type": "session"} 확인
+                }
+                Debug.Log($"[MCPBridgeClient] WebSocket connected (Session: {SessionId})");
+                _socket = socket;
+                return socket;
+            }
+            catch (Exception e)
+            {
+                socket.Dispose();
+                Debug.LogWarning($"[MCPBridgeClient] WebSocket unavailable, falling back to HTTP: {e.Message}");
+                UseWebSocket = false;
+                return null;
+            }
+        }
+
+        private async UniTask<AIActionData> RequestActionOverSocketAsync(ClientWebSocket socket, byte[] imageBytes, string context)
+        {
+            string requestId = (++_requestCounter).ToString();
+            var header = new Dictionary<string, object>
+            {
+                { "type", "ask" },
+                { "request_id", requestId },
+                { "context", context }
+            };
+            if (!string.IsNullOrEmpty(ApiKey)) header["api_key"] = ApiKey;
+
+            try
+            {
+                using (var cts = new CancellationTokenSource(TimeSpan.FromSeconds(REQUEST_TIMEOUT)))
+                {
+                    byte[] headerBytes = Encoding.UTF8.GetBytes(JsonConvert.SerializeObject(header));
+                    await socket.SendAsync(new ArraySegment<byte>(headerBytes), WebSocketMessageType.Text, true, cts.Token);
+                    await socket.SendAsync(new ArraySegment<byte>(imageBytes), WebSocketMessageType.Binary, true, cts.Token);
+
+                    while (true)
+                    {
+                        JObject message = JObject.Parse(await ReceiveTextAsync(socket, cts.Token));
+                        if ((string)message["request_id"] != requestId) continue; // 이전 요청의 늦은 메시지
+
+                        string type = (string)message["type"];
+                        if (type == "thought")
+                        {
+                            OnThought?.Invoke((string)message["text"]);
+                            continue;
+                        }
+                        if (type == "error") Debug.LogError($"[MCPBridgeClient] Server Error: {message["error"]}");
+                        return JsonConvert.DeserializeObject<AIActionData>(message["action"].ToString());
+                    }
+                }
+            }
+            catch (Exception e)
+            {
+                // 타임아웃/끊김 후의 소켓은 재사용하지 않고 다음 스텝에서 다시 연결
+                Debug.LogError($"[MCPBridgeClient] WebSocket Exception: {e.Message}");
+                socket.Abort();
+                return CreateErrorAction(e.Message);
+            }
+        }
+
+        private static async UniTask<string> ReceiveTextAsync(ClientWebSocket socket, CancellationToken token)
+        {
+            var buffer = new ArraySegment<byte>(new byte[8192]);
+            using (var stream = new MemoryStream())
+            {
+                while (true)
+                {
+                    WebSocketReceiveResult result = await socket.ReceiveAsync(buffer, token);
+                    if (result.MessageType == WebSocketMessageType.Close)
+                        throw new WebSocketException("Server closed the connection.");
+                    stream.Write(buffer.Array, 0, result.Count);
+                    if (result.EndOfMessage) return Encoding.UTF8.GetString(stream.ToArray());
+                }
+            }
+        }
+
+        public void Dispose()
+        {
+            _socket?.Dispose();
+            _socket = null;
+        }
+
         private AIActionData CreateErrorAction(string message)
         {
             return new AIActionData